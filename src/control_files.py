@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+"""
+Control files of nf.io.
+
+Control files live in the /.nfio directory at the root of the mount. They do
+not exist in the nf.io root; their content is generated by nf.io. A control
+file is a request/response channel: a client opens it, writes a request and
+reads the response back from the same file handle. Every open file handle
+has its own request and response, so several clients can use the same
+control file at the same time.
+
+    /.nfio/batch    runs create and lifecycle operations on many VNF
+                    instances at once, see BatchFile.
+    /.nfio/manifest brings VNF instances to a desired state, see
+                    ManifestFile.
+    /.nfio/drift    reports differences between the nf.io root and the
+                    hypervisor, see DriftFile.
+    /.nfio/metrics  call counts, errors and latency percentiles of the FUSE
+                    operations, see MetricsFile.
+    /.nfio/hypervisor
+                    the same of the hypervisor driver calls per host, and the
+                    health of the hosts, see HypervisorFile.
+"""
+
+import collections
+import errno
+import itertools
+import json
+import os
+import stat
+import threading
+import time
+
+from fuse import FuseOSError, fuse_file_info
+import errors
+from hypervisor import hypervisor_factory
+import instance_registry
+import lifecycle
+import manifest
+import metrics
+import reconcile
+
+# handles of control files are numbered from here, so they never collide
+# with the file descriptors of backing files used as handles by nfio
+FIRST_HANDLE = 1 << 32
+
+
+class ControlFile(object):
+
+    """
+    An open control file. Subclasses implement execute().
+
+    Writes are appended to the request, whatever their offset. The request is
+    executed when the handle is first read, or when it is flushed, e.g., by
+    close(), if it was not read. A write after the response was produced
+    starts a new request.
+    """
+
+    # mode reported by getattr
+    mode = stat.S_IFREG | 0o644
+
+    def __init__(self, operations):
+        """
+        Args:
+            operations: the Nfio object serving the mount.
+        """
+        self.operations = operations
+        self._request = []
+        self._response = None
+        self._lock = threading.Lock()
+
+    def execute(self, request):
+        """
+        Returns the response to a request, the data written to the handle.
+        """
+        raise NotImplementedError
+
+    def write(self, buf, offset):
+        with self._lock:
+            if self._response is not None:
+                self._request = []
+                self._response = None
+            self._request.append(buf)
+        return len(buf)
+
+    def response(self):
+        with self._lock:
+            if self._response is None:
+                self._response = self.execute(''.join(self._request))
+            return self._response
+
+    def read(self, length, offset):
+        return self.response()[offset:offset + length]
+
+    def flush(self):
+        with self._lock:
+            pending = self._request and self._response is None
+        if pending:
+            self.response()
+
+
+class ControlFiles(object):
+
+    """
+    The control directory: maps the names of control files to their classes
+    and the handles of open control files to ControlFile objects.
+    """
+
+    def __init__(self, operations):
+        """
+        Args:
+            operations: the Nfio object serving the mount.
+        """
+        self._operations = operations
+        self._classes = {}
+        self._handles = {}
+        self._next_handle = itertools.count(FIRST_HANDLE)
+        self._lock = threading.Lock()
+        self._mtime = time.time()
+
+    def register(self, name, control_class):
+        """
+        Adds a control file.
+
+        Args:
+            name: name of the file in the control directory.
+            control_class: ControlFile subclass, instantiated on every open.
+        """
+        self._classes[name] = control_class
+
+    def names(self):
+        return sorted(self._classes)
+
+    def _class(self, route):
+        control_class = self._classes.get(route.file)
+        if control_class is None:
+            raise FuseOSError(errno.ENOENT)
+        return control_class
+
+    def getattr(self, route):
+        if route.file == '':
+            mode = stat.S_IFDIR | 0o755
+            nlink = 2
+        else:
+            mode = self._class(route).mode
+            nlink = 1
+        return {
+            'st_atime': self._mtime,
+            'st_ctime': self._mtime,
+            'st_gid': os.getgid(),
+            'st_mode': mode,
+            'st_mtime': self._mtime,
+            'st_nlink': nlink,
+            'st_size': 0,
+            'st_uid': os.getuid(),
+        }
+
+    def readdir(self, route):
+        if route.file != '':
+            raise FuseOSError(errno.ENOTDIR)
+        return ['.', '..'] + self.names()
+
+    def open(self, route, fi):
+        """
+        Opens a control file. The file is opened with direct_io, as its size
+        is not known before the response is produced.
+        """
+        if route.file == '':
+            raise FuseOSError(errno.EISDIR)
+        control = self._class(route)(self._operations)
+        with self._lock:
+            fh = next(self._next_handle)
+            self._handles[fh] = control
+        fi.fh = fh
+        fi.direct_io = 1
+        return 0
+
+    def get(self, fh):
+        """
+        Returns the ControlFile of an open handle, or None if fh is not the
+        handle of a control file.
+        """
+        return self._handles.get(fh)
+
+    def release(self, fh):
+        with self._lock:
+            self._handles.pop(fh, None)
+
+
+# batch keys of the configuration of an instance -> configuration file
+CONFIG_KEYS = dict((attribute, config_file) for config_file, attribute in
+                   instance_registry.CONFIG_FILES.items())
+CONFIG_KEYS['ip'] = 'machine/ip'
+
+BATCH_ACTIONS = ('activate', 'start', 'stop', 'destroy')
+# operations that change the instance directory instead of the VNF
+BATCH_CHANGES = ('create', 'configure', 'remove')
+
+
+class Operation(object):
+
+    """
+    One operation of a batch.
+    """
+    __slots__ = ('op', 'nf_type', 'name', 'config', 'text', 'result')
+
+    def __init__(self, op='', nf_type='', name='', config=None, text='',
+                 result=None):
+        self.op = op
+        self.nf_type = nf_type
+        self.name = name
+        self.config = config or {}
+        self.text = text
+        self.result = result
+
+    def validate(self):
+        if self.op not in BATCH_CHANGES and self.op not in BATCH_ACTIONS:
+            self.result = lifecycle.FAILED_PREFIX + 'unknown operation'
+        elif not self.nf_type or not self.name or '/' in self.name or \
+                self.name in ('.', '..'):
+            self.result = lifecycle.FAILED_PREFIX + 'invalid instance'
+        elif self.op in ('create', 'configure'):
+            unknown = [key for key in self.config if key not in CONFIG_KEYS]
+            if unknown:
+                self.result = (lifecycle.FAILED_PREFIX + 'unknown keys ' +
+                               ', '.join(sorted(unknown)))
+        return self.result is None
+
+
+def parse_batch(request):
+    """
+    Parses a batch request into a list of Operation objects. Operations that
+    cannot be parsed have their result set.
+
+    Raises:
+        ValueError if the request looks like JSON but is not valid JSON.
+    """
+    operations = []
+    if request.lstrip()[:1] in ('[', '{'):
+        items = json.loads(request)
+        if isinstance(items, dict):
+            items = [items]
+        for item in items:
+            if not isinstance(item, dict):
+                operations.append(Operation(
+                    result=lifecycle.FAILED_PREFIX + 'not an object'))
+                continue
+            config = dict((str(key), str(value)) for key, value in
+                          item.items() if key not in ('op', 'type', 'name'))
+            operations.append(Operation(str(item.get('op', '')),
+                                         str(item.get('type', '')),
+                                         str(item.get('name', '')), config))
+    else:
+        for line in request.splitlines():
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            tokens = line.split()
+            nf_type, _, name = tokens[1].partition('/') \
+                if len(tokens) > 1 else ('', '', '')
+            config = dict(token.partition('=')[::2] for token in tokens[2:])
+            operations.append(Operation(tokens[0], nf_type, name, config,
+                                         line))
+    for operation in operations:
+        if operation.result is None:
+            operation.validate()
+    return operations
+
+
+class BatchFile(ControlFile):
+
+    """
+    /.nfio/batch: creates VNF instances and runs lifecycle actions on them in
+    bulk.
+
+    A request is either a JSON list of objects, e.g.,
+        [{"op": "create", "type": "firewall", "name": "fw1",
+          "ip": "10.0.0.1", "image": "nfio/firewall"},
+         {"op": "activate", "type": "firewall", "name": "fw1"}]
+    or one operation per line, e.g.,
+        create firewall/fw1 ip=10.0.0.1 image=nfio/firewall
+        activate firewall/fw1
+
+    create builds the instance directory and writes its configuration: ip
+    (or host), image, vcpu and memory. configure rewrites the given
+    configuration of an existing instance and remove deletes its directory.
+    activate, start, stop and destroy are written to the action file of the
+    instance, and run on the lifecycle manager like any other action: in
+    order for each instance, in parallel across instances, and capped per
+    hypervisor host. create, configure and remove wait for the actions of
+    the batch on the same instance that precede them, e.g., a destroy.
+
+    The response has a result for every operation, 'ok' or 'failed:
+    <reason>', as a JSON list if the request was JSON and one line per
+    operation otherwise. It is produced once all actions have completed.
+    """
+
+    def execute(self, request):
+        is_json = request.lstrip()[:1] in ('[', '{')
+        try:
+            operations = parse_batch(request)
+        except ValueError, ex:
+            return json.dumps({'result': lifecycle.FAILED_PREFIX +
+                               str(ex)}) + '\n'
+        self.run(operations)
+        if is_json:
+            return json.dumps(self.results(operations), indent=1) + '\n'
+        return ''.join(operation.text + ' ' + operation.result + '\n'
+                       for operation in operations)
+
+    def run(self, operations):
+        """
+        Runs a list of Operation objects and sets their results. Returns
+        once all of them have completed.
+        """
+        pending = {}
+        for operation in operations:
+            if operation.result is not None:
+                continue
+            key = (operation.nf_type, operation.name)
+            try:
+                if operation.op in BATCH_CHANGES:
+                    self._wait(pending.pop(key, ()))
+                    getattr(self, '_' + operation.op)(operation)
+                    operation.result = 'ok'
+                else:
+                    action = self._submit(operation)
+                    pending.setdefault(key, []).append((operation, action))
+            except EnvironmentError, ex:
+                operation.result = lifecycle.FAILED_PREFIX + (
+                    os.strerror(ex.errno) if ex.errno else str(ex))
+        for actions in pending.values():
+            self._wait(actions)
+
+    def results(self, operations):
+        return [collections.OrderedDict([('op', operation.op),
+                                         ('type', operation.nf_type),
+                                         ('name', operation.name),
+                                         ('result', operation.result)])
+                for operation in operations]
+
+    def _instance_path(self, operation):
+        return '/nf-types/' + operation.nf_type + '/' + operation.name
+
+    def _write_file(self, path, data):
+        fi = fuse_file_info()
+        fi.flags = os.O_WRONLY | os.O_TRUNC
+        self.operations.open(path, fi)
+        try:
+            self.operations.write(path, data, 0, fi)
+        finally:
+            self.operations.release(path, fi)
+
+    def _create(self, operation):
+        type_path = '/nf-types/' + operation.nf_type
+        if self.operations.middleboxes.get(operation.nf_type) is not None \
+                and not os.path.isdir(self.operations._full_path(type_path)):
+            self.operations.mkdir(type_path, 0o755)
+        self.operations.mkdir(self._instance_path(operation), 0o755)
+        self._configure(operation)
+
+    def _configure(self, operation):
+        path = self._instance_path(operation)
+        for key, value in sorted(operation.config.items()):
+            self._write_file(path + '/' + CONFIG_KEYS[key], value)
+
+    def _remove(self, operation):
+        path = self._instance_path(operation)
+        full_path = self.operations._full_path(path)
+        if not os.path.isdir(full_path):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        for dir_path, dir_names, file_names in os.walk(full_path,
+                                                       topdown=False):
+            mount_path = path + dir_path[len(full_path):]
+            for file_name in file_names:
+                self.operations.unlink(mount_path + '/' + file_name)
+            self.operations.rmdir(mount_path)
+
+    def _submit(self, operation):
+        """
+        Writes an action to the action file of an instance.
+
+        Returns:
+            The lifecycle Action, or None if the middlebox module ran the
+            action synchronously as a write to the action file.
+        """
+        path = self._instance_path(operation) + '/action'
+        action = self.operations.submit_action(path, operation.op)
+        if action is None:
+            self._write_file(path, operation.op)
+            operation.result = 'ok'
+        return action
+
+    def _wait(self, actions):
+        for operation, action in actions:
+            if action is None:
+                continue
+            action.done.wait()
+            if action.failure is None:
+                operation.result = 'ok'
+            else:
+                operation.result = lifecycle.FAILED_PREFIX + action.failure
+
+
+class ManifestFile(BatchFile):
+
+    """
+    /.nfio/manifest: brings VNF instances to the state described by a
+    manifest, see manifest.py for its format.
+
+    The manifest is compared with the instance registry and the state of the
+    VMs/containers, and only the operations needed to close the difference
+    are run, as a batch. Re-applying a manifest that is already in effect
+    runs nothing. The response is a JSON object with the number of instances
+    that were already in their desired state and the result of every
+    operation that was run. An instance whose VM/container state cannot be
+    read, e.g., because its host is unreachable, gets a failed 'plan' result
+    and is left alone.
+    """
+
+    def execute(self, request):
+        try:
+            desired = manifest.parse_manifest(request)
+        except ValueError, ex:
+            return json.dumps({'result': lifecycle.FAILED_PREFIX +
+                               str(ex)}) + '\n'
+        plans = []
+        # instances whose state could not be read, e.g., on an unreachable
+        # host, are reported as failed and the others are still brought to
+        # their desired state
+        failed = []
+        for instance in desired:
+            try:
+                plans.extend(manifest.plan([instance],
+                                           self.operations.instances,
+                                           self._container_status))
+            except errors.nfioError, ex:
+                failed.append(Operation(
+                    'plan', instance.nf_type, instance.name,
+                    result=lifecycle.FAILED_PREFIX + ex.__class__.__name__))
+        steps = manifest.interleave(plans)
+        operations = []
+        for op, nf_type, name, config in steps:
+            operation = Operation(op, nf_type, name, config)
+            operation.validate()
+            operations.append(operation)
+        self.run(operations)
+        return json.dumps(collections.OrderedDict([
+            ('unchanged', sum(1 for plan in plans if not plan)),
+            ('changes', self.results(failed + operations))]),
+            indent=1) + '\n'
+
+    def _container_status(self, nf_type, name):
+        # actions that are still running would change the state
+        lifecycle.wait((nf_type, name))
+        instance = self.operations.instances.get(nf_type, name)
+        if not instance.host:
+            # nothing can have been deployed for an instance without a host
+            return ''
+        return self.operations.vnfs_ops.vnfs_get_container_status(
+            '/nf-types/' + nf_type + '/' + name)
+
+
+class DriftFile(ControlFile):
+
+    """
+    /.nfio/drift: the drift report of the last reconciliation pass, see
+    reconcile.py. Writing anything to it runs a new pass first.
+    """
+
+    def execute(self, request):
+        reconciler = reconcile.get_reconciler()
+        if reconciler is None:
+            return 'reconciliation is disabled\n'
+        if request or reconciler.last_report is None:
+            return reconciler.run().format()
+        return reconciler.last_report.format()
+
+
+class MetricsFile(ControlFile):
+
+    """
+    /.nfio/metrics: the metrics of the FUSE operations, per operation and VNF
+    type, see metrics.py. Writing json returns them as JSON instead of a
+    table, writing reset starts counting anew.
+    """
+
+    def execute(self, request):
+        fuse_metrics = metrics.get_fuse_metrics()
+        if fuse_metrics is None:
+            return 'fuse metrics are disabled\n'
+        request = request.strip()
+        if request == 'json':
+            return fuse_metrics.to_json()
+        if request == 'reset':
+            fuse_metrics.reset()
+        elif request:
+            return lifecycle.FAILED_PREFIX + 'unknown request %r, expected ' \
+                'json or reset\n' % request
+        return fuse_metrics.format()
+
+
+class HypervisorFile(ControlFile):
+
+    """
+    /.nfio/hypervisor: the metrics of the hypervisor driver, its calls and
+    the remote API calls they make per operation and host, and the health of
+    the hosts. Requests are those of MetricsFile.
+    """
+
+    def execute(self, request):
+        driver = hypervisor_factory.HypervisorFactory.get_hypervisor_instance()
+        driver_metrics = driver.get_metrics()
+        health = driver.host_health()
+        if not driver_metrics and health is None:
+            return 'the %s driver keeps no metrics\n' % \
+                driver.__class__.__name__
+        request = request.strip()
+        if request == 'json':
+            snapshot = dict((name, calls.snapshot())
+                            for name, calls in driver_metrics)
+            if health is not None:
+                snapshot['hosts'] = health.snapshot()
+            return json.dumps(snapshot, indent=1, sort_keys=True) + '\n'
+        if request == 'reset':
+            for name, calls in driver_metrics:
+                calls.reset()
+        elif request:
+            return lifecycle.FAILED_PREFIX + 'unknown request %r, expected ' \
+                'json or reset\n' % request
+        sections = [calls.format() for name, calls in driver_metrics]
+        if health is not None:
+            sections.append(health.format())
+        return '\n'.join(sections)
+
+
+def get_control_files(operations):
+    """
+    Returns the control directory of a mount with the control files of nf.io.
+    """
+    control_files = ControlFiles(operations)
+    control_files.register('batch', BatchFile)
+    control_files.register('manifest', ManifestFile)
+    control_files.register('drift', DriftFile)
+    control_files.register('metrics', MetricsFile)
+    control_files.register('hypervisor', HypervisorFile)
+    return control_files
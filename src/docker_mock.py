@@ -0,0 +1,640 @@
+#!/usr/bin/env python
+"""
+A stand-in for the docker daemon that speaks the subset of the Docker Remote
+API used by DockerDriver.
+
+The Simulated hypervisor replaces the docker driver, so it cannot tell how
+the driver itself performs. MockDockerDaemon serves the remote API over HTTP
+from memory, so that the real driver, docker-py and requests code path can
+be measured without a docker daemon: connection pooling, version
+negotiation, inspect caching and the events stream all run as they would
+against a daemon. It serves
+
+    GET    /version, /_ping
+    GET    /containers/json                 list
+    POST   /containers/create               create
+    GET    /containers/<id>/json            inspect
+    POST   /containers/<id>/<action>        start, stop, restart, pause and
+                                            unpause
+    DELETE /containers/<id>                 remove
+    POST   /containers/<id>/exec            exec_create
+    POST   /exec/<id>/start                 exec_start
+    GET    /events                          events
+
+with or without a /v<version> prefix, and GET /mock/requests, the number of
+requests per endpoint. Every endpoint, named as in the right column, has an
+injectable latency and failure rate. Injected failures are
+answered with HTTP 500. Commands run in a container have no output, except
+for the one reading the network statistics, which gets counters that grow
+with the running time of the container.
+
+Each daemon listens on one address. DockerDriver uses the same port on every
+host, so a cluster of hosts is simulated with daemons on several loopback
+addresses, e.g., 127.0.0.1 to 127.0.0.16, which Linux routes to lo:
+
+    python docker_mock.py --hosts 16 --port 4444 --latency 0.002
+
+With --port 0 the daemons listen on a free port, which is printed.
+
+See lifecycle_bench.py for a benchmark of the driver against them.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import argparse
+import binascii
+import collections
+import json
+import os
+import platform
+import Queue
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import urlparse
+
+from hypervisor.hypervisor_base import HypervisorBase
+from hypervisor.simulated_driver import LATENCY_DISTRIBUTIONS, \
+    draw_latency, format_net_stats, parse_call_values, _Guest
+
+# endpoints that fail at the daemon's failure rate. The others only fail if
+# a failure rate is set for them explicitly.
+LIFECYCLE_ENDPOINTS = ('create', 'start', 'stop', 'restart', 'pause',
+                       'unpause', 'remove', 'exec_create', 'exec_start')
+
+# (method, path without the version prefix, endpoint)
+ROUTES = [(method, re.compile(path + '$'), endpoint)
+          for method, path, endpoint in [
+              ('GET', r'/version', 'version'),
+              ('GET', r'/_ping', 'ping'),
+              ('GET', r'/containers/json', 'list'),
+              ('POST', r'/containers/create', 'create'),
+              ('GET', r'/containers/([^/]+)/json', 'inspect'),
+              ('POST', r'/containers/([^/]+)/start', 'start'),
+              ('POST', r'/containers/([^/]+)/stop', 'stop'),
+              ('POST', r'/containers/([^/]+)/restart', 'restart'),
+              ('POST', r'/containers/([^/]+)/pause', 'pause'),
+              ('POST', r'/containers/([^/]+)/unpause', 'unpause'),
+              ('DELETE', r'/containers/([^/]+)', 'remove'),
+              ('POST', r'/containers/([^/]+)/exec', 'exec_create'),
+              ('POST', r'/exec/([^/]+)/start', 'exec_start'),
+              ('GET', r'/events', 'events'),
+              ('GET', r'/mock/requests', 'mock_requests')]]
+
+VERSION_PREFIX = re.compile(r'^/v[0-9.]+(?=/)')
+
+# docker's stream type of stdout in multiplexed exec output
+STDOUT = 1
+
+
+class MockAPIError(Exception):
+
+    """
+    An error answered with an HTTP status code and a JSON message, like the
+    daemon does.
+    """
+
+    def __init__(self, code, message):
+        super(MockAPIError, self).__init__(message)
+        self.code = code
+
+
+class _Container(_Guest):
+
+    """
+    A container of the mock daemon.
+    """
+    __slots__ = ('name', 'created')
+
+    def __init__(self, cont_id, name, image, ip, rate):
+        super(_Container, self).__init__(cont_id, image, ip, rate)
+        self.name = name
+        self.created = time.time()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    Dispatches the requests of one connection to the MockDockerDaemon.
+    """
+
+    # keep-alive connections, as the driver pools its clients
+    protocol_version = 'HTTP/1.1'
+    # a response goes out in one write, without waiting for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, content_type='application/json',
+              close=False):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        url = urlparse.urlparse(self.path)
+        path = VERSION_PREFIX.sub('', url.path)
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        for route_method, pattern, endpoint in ROUTES:
+            match = pattern.match(path)
+            if match is not None and route_method == method:
+                break
+        else:
+            self._send(404, json.dumps({'message': 'page not found'}))
+            return
+        daemon = self.server.docker
+        params = dict((key, values[-1]) for key, values in
+                      urlparse.parse_qs(url.query).items())
+        if endpoint == 'mock_requests':
+            self._send(200, json.dumps(daemon.request_counts()))
+            return
+        try:
+            daemon.simulate(endpoint)
+            if endpoint == 'events':
+                self._stream_events(daemon)
+                return
+            code, result = getattr(daemon, '_' + endpoint)(
+                params, body, *match.groups())
+        except MockAPIError, ex:
+            self._send(ex.code, json.dumps({'message': str(ex)}))
+            return
+        if endpoint == 'exec_start':
+            # docker hijacks the connection for the output and closes it
+            self._send(code, result, 'application/vnd.docker.raw-stream',
+                       close=True)
+        elif isinstance(result, str):
+            self._send(code, result, 'text/plain')
+        else:
+            self._send(code, '' if result is None else json.dumps(result))
+
+    def _stream_events(self, daemon):
+        events = daemon.subscribe()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            self.wfile.flush()
+            while not daemon.stopped:
+                try:
+                    event = events.get(timeout=0.5)
+                except Queue.Empty:
+                    continue
+                data = json.dumps(event) + '\n'
+                self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write('0\r\n\r\n')
+        except EnvironmentError:
+            # the client went away
+            pass
+        finally:
+            daemon.unsubscribe(events)
+            self.close_connection = 1
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockDockerDaemon(object):
+
+    """
+    An in-memory docker daemon listening on one address.
+    """
+
+    def __init__(self, address='127.0.0.1', port=4444, api_version='1.24',
+                 latency=0.0, latency_distribution='constant',
+                 endpoint_latency=None, failure_rate=0.0,
+                 endpoint_failure_rate=None, counter_rate=125000.0,
+                 drop_rate=0.001, seed=None):
+        """
+        Args:
+            address: address to listen on.
+            port: port to listen on, 0 for any free port.
+            api_version: remote API version reported by /version.
+            latency: mean seconds every request takes before it is
+                answered.
+            latency_distribution: one of LATENCY_DISTRIBUTIONS.
+            endpoint_latency: dictionary of endpoint -> mean latency,
+                overriding latency.
+            failure_rate: probability that a request to one of
+                LIFECYCLE_ENDPOINTS fails with HTTP 500.
+            endpoint_failure_rate: dictionary of endpoint -> probability
+                that it fails, overriding failure_rate.
+            counter_rate: mean bytes per second a running container receives
+                and sends, see simulated_driver.Simulated.
+            drop_rate: fraction of the packets of a container that are
+                dropped.
+            seed: seed of the random numbers, for repeatable runs.
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError('Unknown latency distribution ' +
+                             latency_distribution)
+        self.address = address
+        self.api_version = api_version
+        self._latency = latency
+        self._distribution = latency_distribution
+        self._endpoint_latency = dict(endpoint_latency or {})
+        self._failure_rate = failure_rate
+        self._endpoint_failure_rate = dict(endpoint_failure_rate or {})
+        self._counter_rate = counter_rate
+        self._drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._containers = {}
+        self._names = {}
+        self._execs = {}
+        self._subscribers = []
+        self._created = 0
+        # endpoint -> number of requests, and of injected failures
+        self.requests = collections.Counter()
+        self.failures = collections.Counter()
+        self.stopped = False
+        self._server = _Server((address, port), _Handler)
+        self._server.docker = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        """
+        Serves requests in a background thread.
+        """
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='docker-mock-' + self.address)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and ends the events streams.
+        """
+        self.stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def simulate(self, endpoint):
+        """
+        Sleeps for the latency of a request and decides whether it fails.
+
+        Raises:
+            MockAPIError if the request fails.
+        """
+        delay = draw_latency(self._random, self._distribution,
+                             self._endpoint_latency.get(endpoint,
+                                                        self._latency))
+        if delay > 0:
+            time.sleep(delay)
+        if endpoint in self._endpoint_failure_rate:
+            rate = self._endpoint_failure_rate[endpoint]
+        elif endpoint in LIFECYCLE_ENDPOINTS:
+            rate = self._failure_rate
+        else:
+            rate = 0
+        failed = rate > 0 and self._random.random() < rate
+        with self._lock:
+            self.requests[endpoint] += 1
+            if failed:
+                self.failures[endpoint] += 1
+        if failed:
+            raise MockAPIError(500, 'injected failure of ' + endpoint)
+
+    def request_counts(self):
+        """
+        Returns a dictionary with the number of requests and injected
+        failures per endpoint, under 'requests' and 'failures'.
+        """
+        with self._lock:
+            return {'requests': dict(self.requests),
+                    'failures': dict(self.failures)}
+
+    def subscribe(self):
+        events = Queue.Queue()
+        with self._lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def _publish(self, action, container):
+        # both the pre 1.22 and the current event format; the caller holds
+        # the lock
+        now = time.time()
+        event = {'status': action, 'id': container.id,
+                 'from': container.image, 'time': int(now),
+                 'timeNano': int(now * 1e9), 'Type': 'container',
+                 'Action': action,
+                 'Actor': {'ID': container.id,
+                           'Attributes': {'name': container.name,
+                                          'image': container.image}}}
+        for events in self._subscribers:
+            events.put(event)
+
+    def _lookup(self, name_or_id):
+        """
+        Resolves a container by ID, name or unique ID prefix; the caller
+        holds the lock.
+        """
+        container = self._containers.get(name_or_id)
+        if container is None:
+            cont_id = self._names.get(name_or_id.lstrip('/'))
+            if cont_id is None:
+                matches = [cont_id for cont_id in self._containers
+                           if cont_id.startswith(name_or_id)]
+                if len(matches) == 1:
+                    cont_id = matches[0]
+            container = self._containers.get(cont_id)
+        if container is None:
+            raise MockAPIError(404, 'No such container: ' + name_or_id)
+        return container
+
+    def _transition(self, name_or_id, action, status, allowed,
+                    unchanged=()):
+        with self._lock:
+            container = self._lookup(name_or_id)
+            if container.status in unchanged:
+                return 304, None
+            if container.status not in allowed:
+                raise MockAPIError(409, 'Cannot ' + action + ' container ' +
+                                   name_or_id + ': container is ' +
+                                   container.status)
+            container.set_status(status, time.time())
+            self._publish(action, container)
+        return 204, None
+
+    def _inspect_data(self, container):
+        running = container.status == 'running'
+        started = container.running_since or container.created
+        return {
+            'Id': container.id,
+            'Name': '/' + container.name,
+            'Image': container.image,
+            'Created': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                     time.gmtime(container.created)),
+            'State': {'Status': container.status,
+                      'Running': container.status in ('running', 'paused'),
+                      'Paused': container.status == 'paused',
+                      'Restarting': False,
+                      'Pid': 0,
+                      'ExitCode': 0,
+                      'StartedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                                 time.gmtime(started))},
+            'Config': {'Image': container.image},
+            'NetworkSettings': {'IPAddress': container.ip if running
+                                else ''},
+        }
+
+    def _version(self, params, body):
+        return 200, {'Version': 'mock', 'ApiVersion': self.api_version,
+                     'MinAPIVersion': '1.12', 'Os': 'linux',
+                     'Arch': platform.machine(),
+                     'KernelVersion': platform.release()}
+
+    def _ping(self, params, body):
+        return 200, 'OK'
+
+    def _list(self, params, body):
+        show_all = params.get('all') not in (None, '0', 'false', 'False')
+        listing = []
+        with self._lock:
+            for container in self._containers.values():
+                if not show_all and container.status != 'running':
+                    continue
+                if container.status in ('running', 'paused'):
+                    text = 'Up %d seconds' % container.running_time(
+                        time.time())
+                    if container.status == 'paused':
+                        text += ' (Paused)'
+                elif container.status == 'created':
+                    text = 'Created'
+                else:
+                    text = 'Exited (0) 1 second ago'
+                ip = container.ip if container.status == 'running' else ''
+                listing.append({
+                    'Id': container.id,
+                    'Names': ['/' + container.name],
+                    'Image': container.image,
+                    'Created': int(container.created),
+                    'State': container.status,
+                    'Status': text,
+                    'NetworkSettings': {'Networks': {'bridge': {
+                        'IPAddress': ip}}}})
+        return 200, listing
+
+    def _create(self, params, body):
+        name = params.get('name')
+        config = json.loads(body or '{}')
+        image = config.get('Image')
+        if not image:
+            raise MockAPIError(400, 'No image was specified')
+        with self._lock:
+            if name is None:
+                name = 'mock_%d' % (self._created + 1)
+            if name in self._names:
+                raise MockAPIError(409, 'Conflict. The name "/' + name +
+                                   '" is already in use')
+            self._created += 1
+            number = self._created
+            cont_id = '%064x' % self._random.getrandbits(256)
+            ip = '172.%d.%d.%d' % (17 + (number >> 16), (number >> 8) & 255,
+                                   number & 255)
+            container = _Container(
+                cont_id, name, image, ip,
+                self._counter_rate * self._random.uniform(0.5, 1.5))
+            self._containers[cont_id] = container
+            self._names[name] = cont_id
+            self._publish('create', container)
+        return 201, {'Id': cont_id, 'Warnings': None}
+
+    def _inspect(self, params, body, name_or_id):
+        with self._lock:
+            return 200, self._inspect_data(self._lookup(name_or_id))
+
+    def _start(self, params, body, name_or_id):
+        return self._transition(name_or_id, 'start', 'running',
+                                ('created', 'exited'), ('running',))
+
+    def _stop(self, params, body, name_or_id):
+        return self._transition(name_or_id, 'stop', 'exited',
+                                ('running', 'paused'), ('created', 'exited'))
+
+    def _restart(self, params, body, name_or_id):
+        return self._transition(name_or_id, 'restart', 'running',
+                                ('created', 'running', 'paused', 'exited'))
+
+    def _pause(self, params, body, name_or_id):
+        return self._transition(name_or_id, 'pause', 'paused', ('running',))
+
+    def _unpause(self, params, body, name_or_id):
+        return self._transition(name_or_id, 'unpause', 'running',
+                                ('paused',))
+
+    def _remove(self, params, body, name_or_id):
+        force = params.get('force') in ('1', 'true', 'True')
+        with self._lock:
+            container = self._lookup(name_or_id)
+            if container.status in ('running', 'paused') and not force:
+                raise MockAPIError(409, 'You cannot remove a running '
+                                   'container. Stop the container before '
+                                   'attempting removal or use -f')
+            del self._containers[container.id]
+            del self._names[container.name]
+            if container.status in ('running', 'paused'):
+                self._publish('die', container)
+            self._publish('destroy', container)
+        return 204, None
+
+    def _exec_create(self, params, body, name_or_id):
+        config = json.loads(body or '{}')
+        with self._lock:
+            container = self._lookup(name_or_id)
+            if container.status != 'running':
+                raise MockAPIError(409, 'Container ' + name_or_id +
+                                   ' is not running')
+            exec_id = binascii.hexlify(os.urandom(32))
+            self._execs[exec_id] = (container.id,
+                                    ' '.join(config.get('Cmd') or []))
+        return 201, {'Id': exec_id}
+
+    def _exec_start(self, params, body, exec_id):
+        with self._lock:
+            if exec_id not in self._execs:
+                raise MockAPIError(404, 'No such exec instance: ' + exec_id)
+            cont_id, command = self._execs.pop(exec_id)
+            container = self._containers.get(cont_id)
+            if container is None or container.status != 'running':
+                raise MockAPIError(409, 'Container ' + cont_id +
+                                   ' is not running')
+            transferred = container.rate * container.running_time(
+                time.time())
+        output = ''
+        if HypervisorBase.NET_STATS_FILES[0] in command:
+            dev, snmp = format_net_stats(transferred, self._drop_rate)
+            output = dev + HypervisorBase.NET_STATS_SEPARATOR + '\n' + snmp
+        if not output:
+            return 200, ''
+        return 200, struct.pack('>BxxxL', STDOUT, len(output)) + output
+
+
+def start_cluster(hosts, port=4444, **options):
+    """
+    Starts a daemon on each of hosts addresses, 127.0.0.1 and up, all on the
+    same port.
+
+    Args:
+        hosts: number of daemons.
+        port: port of the daemons, 0 for a free port of the first one.
+        options: keyword arguments of MockDockerDaemon.
+
+    Returns:
+        A list of started MockDockerDaemon objects.
+    """
+    daemons = []
+    seed = options.pop('seed', None)
+    try:
+        for i in range(hosts):
+            daemon = MockDockerDaemon(
+                '127.0.0.%d' % (i + 1), port,
+                seed=None if seed is None else seed + i, **options)
+            port = daemon.port
+            daemons.append(daemon.start())
+    except:
+        for daemon in daemons:
+            daemon.stop()
+        raise
+    return daemons
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Serves the Docker Remote API used by nf.io from memory')
+    arg_parser.add_argument(
+        '--hosts',
+        help='Number of daemons, listening on 127.0.0.1 and up',
+        type=int,
+        default=1)
+    arg_parser.add_argument(
+        '--port',
+        help='Port of the daemons, 0 for a free port',
+        type=int,
+        default=4444)
+    arg_parser.add_argument(
+        '--api_version',
+        help='Remote API version reported to clients',
+        default='1.24')
+    arg_parser.add_argument(
+        '--latency',
+        help='Mean seconds every request takes',
+        type=float,
+        default=0.0)
+    arg_parser.add_argument(
+        '--latency_distribution',
+        help='Distribution of the latency',
+        choices=LATENCY_DISTRIBUTIONS,
+        default='constant')
+    arg_parser.add_argument(
+        '--endpoint_latency',
+        help='Mean latency of individual endpoints, e.g., '
+             'create=0.05,inspect=0.001')
+    arg_parser.add_argument(
+        '--failure_rate',
+        help='Probability that a lifecycle or exec request fails',
+        type=float,
+        default=0.0)
+    arg_parser.add_argument(
+        '--endpoint_failure_rate',
+        help='Failure probability of individual endpoints, e.g., '
+             'start=0.1,inspect=0.01')
+    arg_parser.add_argument(
+        '--seed',
+        help='Seed of the random numbers, for repeatable runs',
+        type=int)
+    args = arg_parser.parse_args()
+    daemons = start_cluster(
+        args.hosts, args.port, api_version=args.api_version,
+        latency=args.latency, latency_distribution=args.latency_distribution,
+        endpoint_latency=parse_call_values(args.endpoint_latency),
+        failure_rate=args.failure_rate,
+        endpoint_failure_rate=parse_call_values(args.endpoint_failure_rate),
+        seed=args.seed)
+    print 'Serving the Docker Remote API on 127.0.0.1-%d port %d' % (
+        len(daemons), daemons[0].port)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for daemon in daemons:
+            daemon.stop()
+
+
+if __name__ == '__main__':
+    main()
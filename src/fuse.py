@@ -388,10 +388,16 @@ class FUSE(object):
         args = [arg.encode(encoding) for arg in args]
         argv = (c_char_p * len(args))(*args)
 
+        # an object with start(name) and finish(token, path, result) that
+        # every operation is reported to, see metrics.FuseMetrics
+        metrics = getattr(operations, 'metrics', None)
+
         fuse_ops = fuse_operations()
         for name, prototype in fuse_operations._fields_:
             if prototype != c_voidp and getattr(operations, name, None):
                 op = partial(self._wrapper, getattr(self, name))
+                if metrics is not None:
+                    op = partial(self._measured, metrics, name, op)
                 setattr(fuse_ops, name, prototype(op))
 
         try:
@@ -432,6 +438,16 @@ class FUSE(object):
             print_exc()
             return -EFAULT
 
+    @staticmethod
+    def _measured(metrics, name, op, *args):
+        'Reports an operation, and the result it returns to libfuse'
+
+        token = metrics.start(name)
+        result = op(*args)
+        path = args[0] if args and isinstance(args[0], bytes) else None
+        metrics.finish(token, path, result)
+        return result
+
     def getattr(self, path, buf):
         return self.fgetattr(path, buf, None)
 
@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+Microbenchmarks of the FUSE operations of nf.io.
+
+Mounts nf.io on a temporary directory with the Simulated hypervisor, creates
+and activates VNF instances through /.nfio/batch, and then drives one
+operation at a time from a number of threads, through the kernel like any
+other client:
+
+    getattr         stat() of the files of an instance
+    readdir         listdir() of an instance directory
+    read            open/read/close of a configuration file, machine/ip
+    read_special    open/read/close of the status file, which is answered by
+                    the middlebox module and the hypervisor driver
+    write_action    writes of stop and start to the action file
+    mkdir           creation of new instances
+
+The throughput and latency percentiles of every operation are printed as
+JSON, so that the results of two commits can be compared:
+
+    python fuse_bench.py --concurrency 8 --iterations 20000 > bench.json
+
+Options the benchmark does not know are passed on to nf.io, e.g.,
+--mount_profile monitoring or --sim_latency 0.001. Mounting needs /dev/fuse
+and fusermount, not root.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# the operations, in the order they are run. mkdir comes last as it adds
+# instances.
+OPS = ('getattr', 'readdir', 'read', 'read_special', 'write_action', 'mkdir')
+
+# percentiles of the report, as fractions
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p999', 0.999))
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(latencies, fraction):
+    """
+    Returns the nearest-rank percentile of a sorted list of latencies.
+    """
+    if not latencies:
+        return None
+    rank = int(math.ceil(fraction * len(latencies)))
+    return latencies[max(0, rank - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Summarizes the latencies, in seconds, of one operation.
+
+    Returns:
+        A dictionary with the number of calls and errors, the throughput in
+        calls per second and the percentiles and maximum in milliseconds.
+    """
+    latencies = sorted(latencies)
+    summary = {
+        'calls': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    for name, fraction in PERCENTILES + (('max', 1.0),):
+        value = percentile(latencies, fraction)
+        summary[name + '_ms'] = None if value is None else \
+            round(value * 1000, 3)
+    return summary
+
+
+def run_op(call, iterations, concurrency, failures=(EnvironmentError,)):
+    """
+    Calls call(i) for i in range(iterations) from concurrency threads.
+    Exceptions of the types in failures count as errors, others end the
+    thread that called.
+
+    Returns:
+        The summary of the calls, see summarize().
+    """
+    counter = itertools.count()
+    latencies = []
+    errors = []
+
+    def work():
+        while True:
+            i = next(counter)
+            if i >= iterations:
+                return
+            start = time.time()
+            try:
+                call(i)
+            except failures:
+                errors.append(i)
+            latencies.append(time.time() - start)
+
+    threads = [threading.Thread(target=work, name='bench-%d' % i)
+               for i in range(concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, len(errors), time.time() - start)
+
+
+class Workload(object):
+
+    """
+    The operations of the benchmark on a mounted nf.io.
+    """
+
+    def __init__(self, mountpoint, nf_type, instances):
+        self.type_dir = os.path.join(mountpoint, 'nf-types', nf_type)
+        self.nf_type = nf_type
+        self.instances = [os.path.join(self.type_dir, 'bench-%d' % i)
+                          for i in range(instances)]
+        self.batch_path = os.path.join(mountpoint, '.nfio', 'batch')
+        self.files = []
+        for instance in self.instances:
+            self.files.extend([instance,
+                               os.path.join(instance, 'status'),
+                               os.path.join(instance, 'action'),
+                               os.path.join(instance, 'machine', 'ip')])
+
+    def _batch(self, lines):
+        with open(self.batch_path, 'r+') as batch:
+            batch.write(''.join(line + '\n' for line in lines))
+            batch.flush()
+            batch.seek(0)
+            response = batch.read()
+        failed = [line for line in response.splitlines()
+                  if 'failed: ' in line]
+        if failed:
+            raise RuntimeError('%d batch operations failed, e.g., %s' %
+                               (len(failed), failed[0]))
+
+    def setup(self):
+        """
+        Creates and activates the instances, spread over 16 hosts.
+        """
+        lines = []
+        for i, instance in enumerate(self.instances):
+            name = self.nf_type + '/' + os.path.basename(instance)
+            lines.append('create %s ip=10.0.0.%d image=nfio/bench' %
+                         (name, i % 16 + 1))
+            lines.append('activate ' + name)
+        self._batch(lines)
+
+    def _read(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.read(fd, 4096)
+        finally:
+            os.close(fd)
+
+    def getattr(self, i):
+        os.lstat(self.files[i % len(self.files)])
+
+    def readdir(self, i):
+        os.listdir(self.instances[i % len(self.instances)])
+
+    def read(self, i):
+        self._read(os.path.join(self.instances[i % len(self.instances)],
+                                'machine', 'ip'))
+
+    def read_special(self, i):
+        self._read(os.path.join(self.instances[i % len(self.instances)],
+                                'status'))
+
+    def write_action(self, i):
+        instance = self.instances[i % len(self.instances)]
+        # the instances are running, every other round stops them
+        action = 'stop' if i / len(self.instances) % 2 == 0 else 'start'
+        fd = os.open(os.path.join(instance, 'action'), os.O_WRONLY)
+        try:
+            os.write(fd, action)
+        finally:
+            os.close(fd)
+
+    def mkdir(self, i):
+        os.mkdir(os.path.join(self.type_dir, 'bench-mkdir-%d' % i), 0o755)
+
+
+def mount(root, mountpoint, nfio_args, log_path, timeout):
+    """
+    Starts nf.io with the Simulated hypervisor and waits for the mount.
+
+    Returns:
+        The nf.io process.
+    """
+    command = [sys.executable, os.path.join(SRC_DIR, 'nfio.py'),
+               '--nfio_root', root, '--nfio_mount', mountpoint,
+               '--hypervisor', 'Simulated', '--reconcile_timeout', '0',
+               '--middlebox_reload_interval', '0', '--log_level', 'error']
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command + nfio_args, cwd=SRC_DIR,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while not os.path.ismount(mountpoint):
+        if process.poll() is not None or time.time() > deadline:
+            unmount(process, mountpoint)
+            with open(log_path) as log:
+                output = log.read()
+            raise RuntimeError('nf.io did not mount ' + mountpoint + ':\n' +
+                               output[-4096:])
+        time.sleep(0.05)
+    return process
+
+
+def unmount(process, mountpoint, timeout=10.0):
+    """
+    Stops nf.io, which unmounts the file system on SIGTERM.
+    """
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        deadline = time.time() + timeout
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    if os.path.ismount(mountpoint):
+        subprocess.call(['fusermount', '-u', '-z', mountpoint])
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd=SRC_DIR,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def new_report(ops, iterations, concurrency, instances, nf_type, nfio_args):
+    """
+    Returns a report with the settings of a run and no results yet.
+    """
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'instances': instances,
+        'nf_type': nf_type,
+        'nfio_args': list(nfio_args),
+        'ops': dict((op, None) for op in ops),
+    }
+
+
+def benchmark(ops=OPS, iterations=10000, concurrency=8, instances=100,
+              nf_type='firewall', nfio_args=(), mount_timeout=30.0):
+    """
+    Mounts nf.io on a temporary directory and runs the operations.
+
+    Returns:
+        The report, a dictionary with the settings of the run and, under
+        'ops', the summary of every operation.
+    """
+    work_dir = tempfile.mkdtemp(prefix='nfio-bench.')
+    root = os.path.join(work_dir, 'root')
+    mountpoint = os.path.join(work_dir, 'mnt')
+    os.makedirs(os.path.join(root, 'nf-types'))
+    os.mkdir(mountpoint)
+    report = new_report(ops, iterations, concurrency, instances, nf_type,
+                        nfio_args)
+    process = None
+    try:
+        process = mount(root, mountpoint, list(nfio_args),
+                        os.path.join(work_dir, 'nfio.log'), mount_timeout)
+        workload = Workload(mountpoint, nf_type, instances)
+        start = time.time()
+        workload.setup()
+        report['setup_seconds'] = round(time.time() - start, 3)
+        for op in ops:
+            report['ops'][op] = run_op(getattr(workload, op), iterations,
+                                       concurrency)
+    finally:
+        if process is not None:
+            unmount(process, mountpoint)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks the FUSE operations of nf.io. Unknown '
+                    'options are passed on to nf.io')
+    arg_parser.add_argument(
+        '--ops',
+        help='Comma separated operations to run (%s)' % ','.join(OPS),
+        default=','.join(OPS))
+    arg_parser.add_argument(
+        '--iterations',
+        help='Number of calls of every operation',
+        type=int,
+        default=10000)
+    arg_parser.add_argument(
+        '--concurrency',
+        help='Number of threads calling an operation at the same time',
+        type=int,
+        default=8)
+    arg_parser.add_argument(
+        '--instances',
+        help='Number of VNF instances created before the operations run',
+        type=int,
+        default=100)
+    arg_parser.add_argument(
+        '--nf_type',
+        help='VNF type of the instances',
+        default='firewall')
+    arg_parser.add_argument(
+        '--mount_timeout',
+        help='Seconds to wait for nf.io to mount',
+        type=float,
+        default=30.0)
+    arg_parser.add_argument(
+        '--output',
+        help='File to write the JSON report to, instead of stdout')
+    args, nfio_args = arg_parser.parse_known_args()
+    ops = [op.strip() for op in args.ops.split(',') if op.strip()]
+    unknown = [op for op in ops if op not in OPS]
+    if unknown:
+        arg_parser.error('unknown operations: ' + ', '.join(unknown))
+    # mkdir has to run last, whatever the order on the command line
+    ops = [op for op in OPS if op in ops]
+    report = benchmark(ops, args.iterations, max(1, args.concurrency),
+                       max(1, args.instances), args.nf_type, nfio_args,
+                       args.mount_timeout)
+    text = json.dumps(report, indent=1, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
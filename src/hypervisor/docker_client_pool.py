@@ -0,0 +1,308 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import docker
+
+import errors
+
+logger = logging.getLogger(__name__)
+
+# API version spoken by the oldest docker daemon nf.io supports. It is used
+# for the version handshake and as a fallback when negotiation fails.
+MIN_API_VERSION = '1.15'
+
+
+def _version_tuple(version):
+    """
+    @brief converts a docker API version string to a comparable tuple
+
+    @param version API version string, e.g., '1.24'
+
+    @returns tuple of integers, e.g., (1, 24)
+    """
+    return tuple(int(part) for part in str(version).split('.'))
+
+
+def version_lt(version, other):
+    """
+    @brief compares two docker API version strings
+
+    @returns True if version is strictly older than other
+    """
+    return _version_tuple(version) < _version_tuple(other)
+
+
+class _PooledClient(object):
+    """
+    @brief a docker client together with its bookkeeping timestamps
+    """
+    __slots__ = ('client', 'last_used', 'last_checked')
+
+    def __init__(self, client):
+        now = time.time()
+        self.client = client
+        self.last_used = now
+        self.last_checked = now
+
+
+class _HostPool(object):
+    """
+    @brief the idle clients and lease count of a single docker host
+    """
+    __slots__ = ('idle', 'leased', 'version')
+
+    def __init__(self):
+        self.idle = []
+        self.leased = 0
+        self.version = None
+
+
+class DockerClientPool(object):
+    """
+    @class DockerClientPool
+    @brief bounded, thread-safe pool of keep-alive docker clients per host.
+
+    A docker client wraps a requests session, so reusing a client reuses its
+    HTTP connection to the remote API. Each host gets at most max_size
+    clients; callers lease a client for the duration of one driver operation
+    and give it back afterwards.
+    """
+
+    def __init__(self, port, max_size=10, idle_timeout=60.0,
+                 health_check_interval=15.0, lease_timeout=30.0,
+                 max_version=None):
+        """
+        @brief Instantiates a DockerClientPool object.
+
+        @param port port number of the docker remote API on every host
+        @param max_size maximum number of clients per host. This should match
+            the number of threads issuing file system calls.
+        @param idle_timeout clients idle for longer than this many seconds
+            are closed instead of being reused
+        @param health_check_interval an idle client is pinged before reuse if
+            it has not been checked for this many seconds
+        @param lease_timeout seconds to wait for a free client before giving
+            up with HypervisorConnectionError
+        @param max_version newest API version the driver is prepared to
+            speak. Defaults to the newest version known to docker-py.
+        """
+        self.__port = port
+        self.__max_size = max(1, max_size)
+        self.__idle_timeout = idle_timeout
+        self.__health_check_interval = health_check_interval
+        self.__lease_timeout = lease_timeout
+        self.__max_version = max_version or \
+            docker.constants.DEFAULT_DOCKER_API_VERSION
+        self.__hosts = {}
+        self.__cond = threading.Condition()
+
+    def _base_url(self, host):
+        return "http://" + host + ":" + self.__port
+
+    def _negotiate_version(self, host):
+        """
+        @brief picks the newest API version both daemon and client support
+
+        @param host IP address or hostname of the docker host
+
+        @returns API version string, or None if the daemon could not be asked
+        """
+        try:
+            probe = docker.Client(base_url=self._base_url(host),
+                                  version=MIN_API_VERSION)
+            try:
+                server_version = probe.version()['ApiVersion']
+            finally:
+                probe.close()
+        except Exception, ex:
+            logger.warning('API version negotiation with ' + host +
+                           ' failed, using ' + MIN_API_VERSION + ': ' +
+                           str(ex))
+            return None
+        if version_lt(server_version, self.__max_version):
+            version = server_version
+        else:
+            version = self.__max_version
+        logger.info('Using docker API version ' + version + ' for ' + host)
+        return version
+
+    def _new_client(self, host, version):
+        return _PooledClient(docker.Client(base_url=self._base_url(host),
+                                           version=version))
+
+    def _is_healthy(self, pooled):
+        try:
+            pooled.client.ping()
+        except Exception:
+            return False
+        pooled.last_checked = time.time()
+        return True
+
+    def _close(self, pooled):
+        try:
+            pooled.client.close()
+        except Exception:
+            pass
+
+    def _acquire(self, host):
+        """
+        @brief takes an idle client or a free slot for a new one
+
+        @returns a _PooledClient, or None if the caller should create a new
+            client in the slot it now holds
+        """
+        deadline = time.time() + self.__lease_timeout
+        with self.__cond:
+            pool = self.__hosts.get(host)
+            if pool is None:
+                pool = self.__hosts[host] = _HostPool()
+            while not pool.idle and pool.leased >= self.__max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.error('Timed out waiting for a docker client for '
+                                 + host)
+                    raise errors.HypervisorConnectionError
+                self.__cond.wait(remaining)
+            pool.leased += 1
+            # LIFO reuse keeps the hottest connections alive and lets the
+            # rest age out through the idle timeout
+            if pool.idle:
+                return pool.idle.pop()
+            return None
+
+    def _release(self, host, pooled, reuse):
+        expired = []
+        with self.__cond:
+            pool = self.__hosts[host]
+            pool.leased -= 1
+            now = time.time()
+            if reuse:
+                pooled.last_used = now
+                pool.idle.append(pooled)
+            # the bottom of the stack holds the least recently used clients
+            while pool.idle and \
+                    now - pool.idle[0].last_used > self.__idle_timeout:
+                expired.append(pool.idle.pop(0))
+            self.__cond.notify()
+        if not reuse and pooled is not None:
+            expired.append(pooled)
+        for stale in expired:
+            self._close(stale)
+
+    def _host_version(self, host):
+        """
+        @brief the API version negotiated with host
+
+        A failed negotiation is not remembered, so that the next lease asks
+        the daemon again instead of speaking MIN_API_VERSION for good.
+
+        @returns API version string, or None if negotiation failed
+        """
+        with self.__cond:
+            pool = self.__hosts.get(host)
+            if pool is None:
+                pool = self.__hosts[host] = _HostPool()
+        if pool.version is None:
+            pool.version = self._negotiate_version(host)
+        return pool.version
+
+    def dedicated_client(self, host, timeout=None):
+        """
+        @brief creates a client for host that is not part of the pool
+
+        Long running requests such as the events stream hold their
+        connection indefinitely and must not take a slot from the pool.
+
+        @param host IP address or hostname of the docker host
+        @param timeout socket timeout in seconds, None to block forever
+
+        @returns a docker client speaking the negotiated API version
+        """
+        return docker.Client(base_url=self._base_url(host),
+                             version=self._host_version(host) or
+                             MIN_API_VERSION,
+                             timeout=timeout)
+
+    @contextmanager
+    def client(self, host):
+        """
+        @brief leases a docker client for host
+
+        The client is returned to the pool when the with block exits. If the
+        block raises a connection level error, i.e., anything but a docker
+        APIError or an nfioError other than HypervisorConnectionError, the
+        client is discarded. So is a client that speaks MIN_API_VERSION
+        because the version could not be negotiated.
+
+        @param host IP address or hostname of the docker host
+        """
+        pooled = self._acquire(host)
+        reuse = True
+        try:
+            now = time.time()
+            if pooled is not None and \
+                    now - pooled.last_used > self.__idle_timeout:
+                self._close(pooled)
+                pooled = None
+            if pooled is not None and \
+                    now - pooled.last_checked > self.__health_check_interval \
+                    and not self._is_healthy(pooled):
+                logger.info('Discarding unhealthy docker client for ' + host)
+                self._close(pooled)
+                pooled = None
+            if pooled is None:
+                version = self._host_version(host)
+                pooled = self._new_client(host, version or MIN_API_VERSION)
+                reuse = version is not None
+        except Exception, ex:
+            self._release(host, pooled, False)
+            if isinstance(ex, errors.nfioError):
+                raise
+            logger.error(str(ex), exc_info=False)
+            raise errors.HypervisorConnectionError
+        try:
+            yield pooled.client
+        except errors.HypervisorConnectionError:
+            self._release(host, pooled, False)
+            raise
+        except (docker.errors.APIError, errors.nfioError):
+            # the daemon answered, so the connection itself is fine
+            self._release(host, pooled, reuse)
+            raise
+        except Exception:
+            self._release(host, pooled, False)
+            raise
+        else:
+            self._release(host, pooled, reuse)
+
+    def evict_idle(self):
+        """
+        @brief closes every idle client that exceeded the idle timeout
+        """
+        expired = []
+        now = time.time()
+        with self.__cond:
+            for pool in self.__hosts.values():
+                keep = []
+                for pooled in pool.idle:
+                    if now - pooled.last_used > self.__idle_timeout:
+                        expired.append(pooled)
+                    else:
+                        keep.append(pooled)
+                pool.idle = keep
+        for pooled in expired:
+            self._close(pooled)
+
+    def close(self):
+        """
+        @brief closes all idle clients of all hosts
+        """
+        with self.__cond:
+            idle = [pooled for pool in self.__hosts.values()
+                    for pooled in pool.idle]
+            for pool in self.__hosts.values():
+                pool.idle = []
+        for pooled in idle:
+            self._close(pooled)
@@ -1,15 +1,49 @@
 import requests
 
+import functools
 import logging
+import socket
 from contextlib import contextmanager
 
 import docker
 
 from hypervisor_base import HypervisorBase
+from docker_client_pool import DockerClientPool, version_lt
+from inspect_cache import InspectCache
+from docker_events import DockerEventMonitor, _state_from_listing
+from host_health import HostHealth
 import errors
+import metrics
 
 logger = logging.getLogger(__name__)
 
+
+def _measured(method):
+    """
+    @brief records the calls of a driver method, by host, in the driver
+        metrics of the driver
+    """
+    @functools.wraps(method)
+    def measured(self, host, *args, **kwargs):
+        with self._driver_metrics.measure(method.__name__, host):
+            return method(self, host, *args, **kwargs)
+    return measured
+
+
+def _error_name(ex):
+    """
+    @brief names the error of a failed remote API call
+
+    @returns 'HTTP <status>' for errors the daemon answered with, the name
+        of the exception class otherwise
+    """
+    response = getattr(ex, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if isinstance(ex, docker.errors.APIError) and status is not None:
+        return 'HTTP %d' % status
+    return ex.__class__.__name__
+
+
 class DockerDriver(HypervisorBase):
     """
     @class DockerDriver
@@ -18,37 +52,116 @@ class DockerDriver(HypervisorBase):
     This class provides methods for managing docker containers.
     """
       
-    def __init__(self):
+    def __init__(self, pool_size=10, inspect_ttl=2.0, watch_events=True,
+                 port='4444', failure_threshold=3, retry_interval=10.0):
         """
         @brief Instantiates a DockerDriver object.
       
         @note This method initializes a set of values for configuring 
             the docker-py remote API client. 
 
+        @param pool_size maximum number of concurrent connections per docker
+            host. This should match the number of fuse worker threads.
+        @param inspect_ttl number of seconds a container inspect result is
+            reused before the daemon is asked again
+        @param watch_events if True the events stream of every host is
+            followed and container status/IP queries are answered from
+            memory
+        @param port port number of the docker remote API on every host
+        @param failure_threshold number of remote API calls to a host that
+            fail in a row, without an answer from the daemon, after which
+            the host is down and calls to it fail at once. 0 disables it.
+        @param retry_interval seconds between two calls that probe a host
+            that is down
+
         @property __port is the port number used for remote API invocation.
-        @property __version is the version number for the report API.
         @property __dns_list is the list of DNS server(s) used by each container.
+        @property __pool is the pool of keep-alive clients shared by all
+            driver calls. The remote API version is negotiated per host.
+        @property __inspect_cache caches inspect results and container IDs.
+            Every lifecycle operation invalidates the entry of its container.
+        @property __events follows the docker events of every host the
+            driver has talked to and keeps a live container state table.
+        @property _driver_metrics counts and times the calls of the driver
+            methods, per method and host.
+        @property __api_metrics counts and times the remote API calls, per
+            docker-py method and host, so that the time spent by the daemons
+            can be told from the time spent by nf.io.
+        @property __health decides which hosts are down from the outcome of
+            the remote API calls.
         """
-        self.__port = '4444'
-        self.__version = '1.15'
+        self.__port = str(port)
         self.__dns_list = ['8.8.8.8']
+        self.__pool = DockerClientPool(self.__port, max_size=pool_size)
+        self.__inspect_cache = InspectCache(inspect_ttl)
+        self.__local_hosts = {}
+        self._driver_metrics = metrics.OperationMetrics('driver calls',
+                                                        'host')
+        self.__api_metrics = metrics.OperationMetrics('docker API calls',
+                                                      'host')
+        self.__health = HostHealth(failure_threshold, retry_interval)
+        self.__events = None
+        if watch_events:
+            self.__events = DockerEventMonitor(self.__pool)
+
+    def close(self):
+        """
+        @brief stops following the events of the hosts and closes the idle
+            connections to them
+        """
+        if self.__events is not None:
+            self.__events.stop()
+        self.__pool.close()
+
+    def get_metrics(self):
+        """
+        @returns the metrics of the driver calls and of the remote API calls
+        """
+        return [('driver', self._driver_metrics),
+                ('docker_api', self.__api_metrics)]
+
+    def host_health(self):
+        """
+        @returns the HostHealth of the docker hosts
+        """
+        return self.__health
 
     @contextmanager
-    def _error_handling(self, nfioError):
+    def _error_handling(self, nfioError, host, call):
         """
         @beief convert docker-py exceptions to nfio exceptions
         
         This code block is used to catch docker-py docker-py exceptions 
         (from error.py), log them, and then raise nfio related 
-        exceptions. 
+        exceptions. The remote API call made in the block is recorded in
+        the API metrics and the health of host.
+
+        Connection errors and timeouts raise HypervisorConnectionError
+        instead of nfioError, so that the client pool discards the
+        connection.
 
         @param nfioError A Exception type from nfio's errors module 
+        @param host IP address or hostname of the docker host called
+        @param call name of the docker-py method called, e.g., start
         """
+        token = self.__api_metrics.start(call)
         try:
             yield
         except Exception, ex:
-            logger.error(ex.message, exc_info=False)
+            error = _error_name(ex)
+            elapsed = self.__api_metrics.finish(token, host, error)
+            if isinstance(ex, docker.errors.APIError):
+                self.__health.succeeded(host)
+            else:
+                self.__health.failed(host, error)
+            logger.error('%s on %s failed after %.1fms: %s: %s' % (
+                call, host, elapsed / 1000.0, error, ex), exc_info=False)
+            if isinstance(ex, (requests.exceptions.ConnectionError,
+                               requests.exceptions.Timeout)):
+                raise errors.HypervisorConnectionError
             raise nfioError
+        self.__health.succeeded(
+            host, self.__api_metrics.finish(token, host))
 
     def _is_empty(self, string):
         """
@@ -85,7 +198,10 @@ class DockerDriver(HypervisorBase):
 
     def _get_client(self, host):
         """
-        Returns a Docker client.
+        Leases a Docker client from the connection pool.
+
+        Use as a context manager; the client goes back to the pool when the
+        with block exits.
         
         @param host IP address or hostname of the host (physical/virtual) 
             where docker containers will be deployed
@@ -94,23 +210,108 @@ class DockerDriver(HypervisorBase):
             with the docker daemon on the host
         """
         self._validate_host(host)
-        with self._error_handling(errors.HypervisorConnectionError):
-          return docker.Client(
-            base_url="http://" +
-            host +
-            ":" +
-            self.__port,
-            version=self.__version)
-
-    def _lookup_vnf(self, host, user, vnf_name):
+        if not self.__health.allow(host):
+            logger.debug('Not calling ' + host + ', it is down')
+            raise errors.HypervisorConnectionError
+        if self.__events is not None:
+            self.__events.watch(host)
+        return self.__pool.client(host)
+
+    def _lookup_vnf(self, dcx, host, user, vnf_name):
+        """
+        Resolves a VNF to its container.
+
+        @param dcx docker client leased for host
+        @param host IP address or hostname of the docker host
+        @param user name of the user who owns the VNF
+        @param vnf_name name of the VNF instance
+
+        @returns a tuple of the container ID and the container's inspect
+            data. The inspect data comes from the cache if it is fresh.
+        """
+        vnf_fullname = user + '-' + vnf_name
+        self._validate_cont_name(vnf_fullname)
+        inspect_data = self.__inspect_cache.get(host, vnf_fullname)
+        if inspect_data is None:
+            # a lifecycle operation that completes while the daemon is asked
+            # bumps the generation, and the outdated answer is not cached
+            generation = self.__inspect_cache.generation(host, vnf_fullname)
+            cont_id = self.__inspect_cache.get_id(host, vnf_fullname)
+            try:
+                with self._error_handling(errors.VNFNotFoundError, host,
+                                          'inspect_container'):
+                    inspect_data = dcx.inspect_container(
+                        container=cont_id or vnf_fullname)
+            except errors.VNFNotFoundError:
+                self.__inspect_cache.forget(host, vnf_fullname)
+                if cont_id is None:
+                    raise
+                # the container was replaced behind our back, resolve the
+                # name again
+                generation = self.__inspect_cache.generation(host,
+                                                             vnf_fullname)
+                with self._error_handling(errors.VNFNotFoundError, host,
+                                          'inspect_container'):
+                    inspect_data = dcx.inspect_container(
+                        container=vnf_fullname)
+            self.__inspect_cache.put(host, vnf_fullname, inspect_data,
+                                     generation)
+        return inspect_data['Id'], inspect_data
+
+    def _inspect(self, host, user, vnf_name):
+        """
+        Returns the inspect data of a VNF's container.
+
+        A docker client is only leased, and the daemon only contacted, if the
+        inspect cache has no fresh entry for the container.
+        """
         self._validate_host(host)
         vnf_fullname = user + '-' + vnf_name
         self._validate_cont_name(vnf_fullname)
-        dcx = self._get_client(host)
-        with self._error_handling(errors.VNFNotFoundError):
-            inspect_data = dcx.inspect_container(container=vnf_fullname)
-            return dcx, vnf_fullname, inspect_data
+        inspect_data = self.__inspect_cache.get(host, vnf_fullname)
+        if inspect_data is None:
+            with self._get_client(host) as dcx:
+                cont_id, inspect_data = self._lookup_vnf(dcx, host, user,
+                                                         vnf_name)
+        return inspect_data
+
+    def _live_state(self, host, user, vnf_name):
+        """
+        Looks a VNF's container up in the live state table.
 
+        @returns a tuple (known, state). If known is False the table cannot
+            answer for host and the remote API has to be asked. Otherwise
+            state is the container's ContainerState, or None if the container
+            does not exist.
+        """
+        if self.__events is None:
+            return False, None
+        self._validate_host(host)
+        self.__events.watch(host)
+        return self.__events.table.lookup(host, user + '-' + vnf_name)
+
+    @contextmanager
+    def _changes_state(self, host, user, vnf_name, new_status=None):
+        """
+        Invalidates the cached inspect data of a VNF once the wrapped
+        lifecycle operation is done, whether it succeeded or not.
+
+        @param new_status the container state after the operation succeeds.
+            It is written through to the live state table so reads right
+            after the operation do not have to wait for the docker event.
+        """
+        vnf_fullname = user + '-' + vnf_name
+        try:
+            yield
+            if new_status is not None and self.__events is not None:
+                self.__events.table.write(
+                    host, vnf_fullname,
+                    self.__inspect_cache.get_id(host, vnf_fullname),
+                    new_status)
+        finally:
+            self.__inspect_cache.invalidate(host, vnf_fullname)
+
+    @_measured
     def get_id(self, host, user, vnf_name):
         """
         Returns a container's ID.
@@ -122,9 +323,13 @@ class DockerDriver(HypervisorBase):
           
           @return docker container ID.
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        return inspect_data['Id'].encode('ascii')
+        self._validate_host(host)
+        cont_id = self.__inspect_cache.get_id(host, user + '-' + vnf_name)
+        if cont_id is None:
+            cont_id = self._inspect(host, user, vnf_name)['Id']
+        return cont_id.encode('ascii')
 
+    @_measured
     def get_ip(self, host, user, vnf_name):
         """
         Returns a container's IP address.
@@ -136,11 +341,20 @@ class DockerDriver(HypervisorBase):
           
           @return docker container's IP.
         """
-        if self.guest_status(host, user, vnf_name) != 'running':
+        known, state = self._live_state(host, user, vnf_name)
+        if known:
+            if state is None:
+                raise errors.VNFNotFoundError
+            if state.status != 'running':
+                raise errors.VNFNotRunningError
+            if state.ip:
+                return state.ip.encode('ascii')
+        inspect_data = self._inspect(host, user, vnf_name)
+        if inspect_data['State']['Status'] != 'running':
             raise errors.VNFNotRunningError
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
         return inspect_data['NetworkSettings']['IPAddress'].encode('ascii')
 
+    @_measured
     def deploy(self, host, user, image_name, vnf_name, is_privileged=True):
         """
         Deploys a docker container.
@@ -160,18 +374,24 @@ class DockerDriver(HypervisorBase):
         self._validate_image_name(image_name)
         vnf_fullname = user + '-' + vnf_name
         self._validate_cont_name(vnf_fullname)
-        dcx = self._get_client(host)
         host_config = dict()
+        host_config['Dns'] = self.__dns_list
         if is_privileged:
             host_config['Privileged'] = True
-        with self._error_handling(errors.VNFDeployError):
-            container = dcx.create_container(
-                image=image_name,
-                hostname=host,
-                name=vnf_fullname,
-                host_config=host_config)
-            return container['Id']
-
+        with self._get_client(host) as dcx:
+            with self._changes_state(host, user, vnf_name, 'created'):
+                with self._error_handling(errors.VNFDeployError, host,
+                                          'create_container'):
+                    container = dcx.create_container(
+                        image=image_name,
+                        hostname=host,
+                        name=vnf_fullname,
+                        host_config=host_config)
+                self.__inspect_cache.set_id(host, vnf_fullname,
+                                            container['Id'])
+                return container['Id']
+
+    @_measured
     def start(self, host, user, vnf_name, is_privileged=True):
         """
         Starts a docker container.
@@ -182,13 +402,23 @@ class DockerDriver(HypervisorBase):
         @param vnf_name name of the VNF
         @param is_privileged if True then the container is started in 
             privileged mode
-        """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFStartError):
-            dcx.start(container=vnf_fullname,
-                dns=self.__dns_list,
-                privileged=is_privileged)
 
+        @note Remote API 1.24 and newer reject host configuration at start
+            time. For those daemons DNS and privileged mode are applied by
+            deploy when the container is created.
+        """
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name, 'running'):
+                with self._error_handling(errors.VNFStartError, host, 'start'):
+                    if version_lt(dcx.api_version, '1.24'):
+                        dcx.start(container=cont_id,
+                            dns=self.__dns_list,
+                            privileged=is_privileged)
+                    else:
+                        dcx.start(container=cont_id)
+
+    @_measured
     def restart(self, host, user, vnf_name):
         """
         Restarts a docker container.
@@ -198,10 +428,14 @@ class DockerDriver(HypervisorBase):
         @param user name of the user
         @param vnf_name name of the VNF
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFRestartError):
-            dcx.restart(container=vnf_fullname)
-
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name, 'running'):
+                with self._error_handling(errors.VNFRestartError, host,
+                                          'restart'):
+                    dcx.restart(container=cont_id)
+
+    @_measured
     def stop(self, host, user, vnf_name):
         """
         Stops a docker container.
@@ -211,10 +445,13 @@ class DockerDriver(HypervisorBase):
         @param user name of the user
         @param vnf_name name of the VNF
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFStopError):
-            dcx.stop(container=vnf_fullname)
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name, 'exited'):
+                with self._error_handling(errors.VNFStopError, host, 'stop'):
+                    dcx.stop(container=cont_id)
 
+    @_measured
     def pause(self, host, user, vnf_name):
         """
         Pauses a docker container.
@@ -224,10 +461,13 @@ class DockerDriver(HypervisorBase):
         @param user name of the user
         @param vnf_name name of the VNF
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFPauseError):
-            dcx.pause(container=vnf_fullname)
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name, 'paused'):
+                with self._error_handling(errors.VNFPauseError, host, 'pause'):
+                    dcx.pause(container=cont_id)
 
+    @_measured
     def unpause(self, host, user, vnf_name):
         """Unpauses a docker container.
 
@@ -236,10 +476,14 @@ class DockerDriver(HypervisorBase):
         @param user name of the user
         @param vnf_name name of the VNF
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFUnpauseError):
-            dcx.unpause(container=vnf_fullname)
-
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name, 'running'):
+                with self._error_handling(errors.VNFUnpauseError, host,
+                                          'unpause'):
+                    dcx.unpause(container=cont_id)
+
+    @_measured
     def destroy(self, host, user, vnf_name, force=True):
         """
         Destroys a docker container.
@@ -251,10 +495,47 @@ class DockerDriver(HypervisorBase):
         @param force if set to False then a running VNF will not 
               be destroyed. default is True
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        with self._error_handling(errors.VNFDestroyError):
-            dcx.remove_container(container=vnf_fullname, force=force)
+        with self._get_client(host) as dcx:
+            cont_id, inspect_data = self._lookup_vnf(dcx, host, user, vnf_name)
+            with self._changes_state(host, user, vnf_name):
+                with self._error_handling(errors.VNFDestroyError, host,
+                                          'remove_container'):
+                    dcx.remove_container(container=cont_id, force=force)
+                self.__inspect_cache.forget(host, user + '-' + vnf_name)
+                if self.__events is not None:
+                    self.__events.table.remove(host, user + '-' + vnf_name)
+
+    @_measured
+    def list_guests(self, host, user):
+        """
+        Lists the containers of a user on a host with a single remote API
+        call. The listing seeds the live state table of the host and the IDs
+        of the inspect cache, so that later lookups and operations do not
+        have to go back to the daemon.
+
+        @param host IP address or hostname of the machine/VM where
+              the docker containers are deployed
+        @param user name of the user
 
+        @returns dictionary of VNF name -> (container ID, state)
+        """
+        prefix = user + '-'
+        with self._get_client(host) as dcx:
+            with self._error_handling(errors.HypervisorConnectionError, host,
+                                      'containers'):
+                containers = dcx.containers(all=True)
+        states = [_state_from_listing(container) for container in containers]
+        if self.__events is not None:
+            self.__events.table.replace(host, states)
+            self.__events.watch(host)
+        guests = {}
+        for state in states:
+            if state.name.startswith(prefix):
+                self.__inspect_cache.set_id(host, state.name, state.id)
+                guests[state.name[len(prefix):]] = (state.id, state.status)
+        return guests
+
+    @_measured
     def execute_in_guest(self, host, user, vnf_name, cmd):
         """
         Executed commands inside a docker container.
@@ -267,14 +548,98 @@ class DockerDriver(HypervisorBase):
 
         @returns The output of the command passes as cmd
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
-        if self.guest_status(host, user, vnf_name) != 'running':
+        known, state = self._live_state(host, user, vnf_name)
+        if known and state is None:
+            raise errors.VNFNotFoundError
+        if known and state.id:
+            status, cont_id = state.status, state.id
+        else:
+            inspect_data = self._inspect(host, user, vnf_name)
+            status, cont_id = inspect_data['State']['Status'], \
+                inspect_data['Id']
+        if status != 'running':
             raise errors.VNFNotRunningError
-        with self._error_handling(errors.VNFCommandExecutionError):
-            response = dcx.execute(vnf_fullname, 
-                ["/bin/bash", "-c", cmd], stdout=True, stderr=False)
-            return response
+        with self._get_client(host) as dcx:
+            with self._error_handling(errors.VNFCommandExecutionError, host,
+                                      'execute'):
+                response = dcx.execute(cont_id, 
+                    ["/bin/bash", "-c", cmd], stdout=True, stderr=False)
+                return response
+
+    def _is_local_host(self, host):
+        """
+        Checks whether host is the machine nf.io is running on.
+
+        An address is local if a socket can be bound to it. The answer is
+        cached per host.
+        """
+        is_local = self.__local_hosts.get(host)
+        if is_local is None:
+            probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                probe.bind((socket.gethostbyname(host), 0))
+                is_local = True
+            except (socket.error, socket.gaierror):
+                is_local = False
+            finally:
+                probe.close()
+            self.__local_hosts[host] = is_local
+        return is_local
+
+    def _read_proc_net(self, pid, cont_id):
+        """
+        Reads the network statistics of a container from the host's procfs.
+
+        @param pid host PID of the container's main process
+        @param cont_id container ID, used to make sure the PID has not been
+            reused by another process
+
+        @returns a tuple with the content of the container's /proc/net/dev
+            and /proc/net/snmp
+        """
+        proc_path = '/proc/' + str(pid)
+        with open(proc_path + '/cgroup') as cgroup_fd:
+            if cont_id not in cgroup_fd.read():
+                raise IOError('PID ' + str(pid) + ' does not belong to '
+                              + cont_id)
+        with open(proc_path + '/net/dev') as dev_fd:
+            dev = dev_fd.read()
+        with open(proc_path + '/net/snmp') as snmp_fd:
+            snmp = snmp_fd.read()
+        return dev, snmp
+
+    @_measured
+    def guest_net_stats(self, host, user, vnf_name):
+        """
+        Returns the network statistics of a docker container.
 
+        For containers on the local host the statistics are read from
+        /proc/<container PID>/net without entering the container. Remote
+        containers, and local ones whose procfs entries cannot be read, fall
+        back to running a command inside the container.
+
+        @param host IP address or hostname of the machine/VM where 
+              the docker container is deployed
+        @param user name of the user
+        @param vnf_name name of the VNF
+
+        @returns a tuple with the content of the container's /proc/net/dev
+            and /proc/net/snmp
+        """
+        self._validate_host(host)
+        if self._is_local_host(host):
+            inspect_data = self._inspect(host, user, vnf_name)
+            if inspect_data['State']['Status'] != 'running':
+                raise errors.VNFNotRunningError
+            try:
+                return self._read_proc_net(inspect_data['State']['Pid'],
+                                           inspect_data['Id'])
+            except (IOError, OSError, KeyError), ex:
+                logger.debug('Falling back to docker exec for ' + vnf_name +
+                             ': ' + str(ex))
+        return super(DockerDriver, self).guest_net_stats(host, user, vnf_name)
+
+    @_measured
     def guest_status(self, host, user, vnf_name):
         """
         Returns the status of a docker container.
@@ -286,5 +651,10 @@ class DockerDriver(HypervisorBase):
 
         @returns current state of the docker container
         """
-        dcx, vnf_fullname, inspect_data = self._lookup_vnf(host, user, vnf_name)
+        known, state = self._live_state(host, user, vnf_name)
+        if known:
+            if state is None:
+                raise errors.VNFNotFoundError
+            return state.status.encode('ascii')
+        inspect_data = self._inspect(host, user, vnf_name)
         return inspect_data['State']['Status'].encode('ascii')
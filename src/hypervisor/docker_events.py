@@ -0,0 +1,336 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# container state reported after each docker event. Events not listed here,
+# e.g., exec_start or attach, do not change the state of a container.
+EVENT_STATES = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+}
+
+
+class ContainerState(object):
+    """
+    @class ContainerState
+    @brief what nf.io knows about one container without asking the daemon
+    """
+    __slots__ = ('name', 'id', 'status', 'ip', 'written')
+
+    def __init__(self, name, cont_id, status, ip=None):
+        self.name = name
+        self.id = cont_id
+        self.status = status
+        self.ip = ip
+        # True if the driver wrote the state through and the daemon has not
+        # confirmed it yet
+        self.written = False
+
+
+class ContainerStateTable(object):
+    """
+    @class ContainerStateTable
+    @brief in-memory table of container name -> ContainerState per host.
+
+    A host's entries are only authoritative while the host is live, i.e.,
+    while an events stream for that host is connected. Lookups for hosts
+    that are not live report the state as unknown and callers fall back to
+    the remote API.
+
+    The driver writes the state a lifecycle operation leads to through to
+    the table, and the events of the operation and of the ones before it
+    may arrive later, e.g., the create event of a container that was just
+    started, however far the events stream lags behind. Such an event must
+    not move the state back, so an event that contradicts a write the
+    daemon has not confirmed yet is not applied and the container is
+    inspected instead.
+    """
+
+    def __init__(self):
+        self.__hosts = {}
+        self.__live = set()
+        self.__lock = threading.Lock()
+
+    def is_live(self, host):
+        return host in self.__live
+
+    def set_live(self, host, live):
+        with self.__lock:
+            if live:
+                self.__live.add(host)
+            else:
+                self.__live.discard(host)
+
+    def replace(self, host, states):
+        """
+        @brief replaces all entries of a host, e.g., after a full listing
+
+        @param states iterable of ContainerState objects
+        """
+        table = dict((state.name, state) for state in states)
+        with self.__lock:
+            self.__hosts[host] = table
+
+    def lookup(self, host, name):
+        """
+        @brief returns the state of a container
+
+        @returns a tuple (known, state). known is False if the host is not
+            live and the table cannot answer. Otherwise state is the
+            ContainerState of the container, or None if it does not exist.
+        """
+        if host not in self.__live:
+            return False, None
+        table = self.__hosts.get(host)
+        if table is None:
+            return False, None
+        return True, table.get(name)
+
+    def find_by_id(self, host, cont_id):
+        with self.__lock:
+            for state in self.__hosts.get(host, {}).values():
+                if state.id == cont_id:
+                    return state
+        return None
+
+    def update(self, host, name, cont_id, status, ip=None):
+        """
+        @brief records the new state of a container, as read from the
+            remote API
+        """
+        self._update(host, name, cont_id, status, ip)
+
+    def write(self, host, name, cont_id, status):
+        """
+        @brief records the state a lifecycle operation of the driver leads
+            to, before its docker event arrives
+        """
+        self._update(host, name, cont_id, status, written=True)
+
+    def apply_event(self, host, name, cont_id, status):
+        """
+        @brief records the state reported by a docker event
+
+        @returns False if the event contradicts a state written through that
+            no event or inspect has confirmed yet, and was not applied. The
+            event may be older than the write, the caller has to inspect the
+            container.
+        """
+        with self.__lock:
+            state = self.__hosts.get(host, {}).get(name)
+            if state is not None and state.written and \
+                    status != state.status:
+                return False
+        self._update(host, name, cont_id, status)
+        return True
+
+    def _update(self, host, name, cont_id, status, ip=None, written=False):
+        with self.__lock:
+            table = self.__hosts.setdefault(host, {})
+            state = table.get(name)
+            if state is None:
+                state = table[name] = ContainerState(name, cont_id, status,
+                                                     ip)
+            state.written = written
+            if cont_id:
+                state.id = cont_id
+            state.status = status
+            if status == 'running':
+                if ip:
+                    state.ip = ip
+            else:
+                state.ip = None
+
+    def remove(self, host, name):
+        with self.__lock:
+            self.__hosts.get(host, {}).pop(name, None)
+
+
+def _state_from_inspect(inspect_data):
+    """
+    @brief builds a ContainerState from container inspect data
+    """
+    status = inspect_data['State']['Status']
+    ip = None
+    if status == 'running':
+        ip = inspect_data['NetworkSettings']['IPAddress'] or None
+    return ContainerState(inspect_data['Name'].lstrip('/'),
+                          inspect_data['Id'], status, ip)
+
+
+def _state_from_listing(container):
+    """
+    @brief builds a ContainerState from an entry of a container listing
+
+    Daemons older than API 1.23 only report a human readable status, e.g.,
+    'Up 2 minutes (Paused)', which is mapped to the inspect state names.
+    """
+    status = container.get('State')
+    if not status:
+        text = container.get('Status', '')
+        if text.startswith('Up'):
+            status = 'paused' if '(Paused)' in text else 'running'
+        elif text.startswith('Created') or text == '':
+            status = 'created'
+        else:
+            status = 'exited'
+    ip = None
+    if status == 'running':
+        networks = container.get('NetworkSettings', {}).get('Networks', {})
+        for network in networks.values():
+            if network.get('IPAddress'):
+                ip = network['IPAddress']
+                break
+    return ContainerState(container['Names'][0].lstrip('/'),
+                          container['Id'], status, ip)
+
+
+class DockerEventWatcher(threading.Thread):
+    """
+    @class DockerEventWatcher
+    @brief background thread that keeps the state table of one host current.
+
+    The watcher seeds the table with a full container listing and then
+    follows the daemon's /events stream. If the stream breaks the host is
+    marked as not live until the watcher has reconnected and reseeded the
+    table, so no stale state is served in between.
+    """
+
+    def __init__(self, pool, host, table, retry_interval=5.0):
+        """
+        @brief Instantiates a DockerEventWatcher object.
+
+        @param pool DockerClientPool used to talk to the host
+        @param host IP address or hostname of the docker host to watch
+        @param table ContainerStateTable to keep up to date
+        @param retry_interval seconds to wait before reconnecting a broken
+            events stream
+        """
+        super(DockerEventWatcher, self).__init__(
+            name='docker-events-' + host)
+        self.daemon = True
+        self.__pool = pool
+        self.__host = host
+        self.__table = table
+        self.__retry_interval = retry_interval
+        self.__stopped = threading.Event()
+
+    def stop(self):
+        self.__stopped.set()
+
+    def _seed(self):
+        """
+        @brief loads the state of every container on the host with a single
+            listing call
+        """
+        with self.__pool.client(self.__host) as dcx:
+            containers = dcx.containers(all=True)
+        self.__table.replace(self.__host,
+                             [_state_from_listing(container)
+                              for container in containers])
+
+    def _refresh(self, cont_id):
+        """
+        @brief re-inspects a single container after an event changed it
+        """
+        with self.__pool.client(self.__host) as dcx:
+            state = _state_from_inspect(
+                dcx.inspect_container(container=cont_id))
+        self.__table.update(self.__host, state.name, state.id, state.status,
+                            state.ip)
+
+    def _handle(self, event):
+        """
+        @brief applies one docker event to the state table
+
+        Handles both the pre 1.22 event format (status, id) and the newer
+        one (Type, Action, Actor).
+        """
+        if event.get('Type', 'container') != 'container':
+            return
+        action = event.get('Action') or event.get('status') or ''
+        # exec events look like 'exec_start: /bin/bash -c ...'
+        action = action.split(':')[0]
+        cont_id = event.get('id') or event.get('Actor', {}).get('ID')
+        name = event.get('Actor', {}).get('Attributes', {}).get('name')
+        if name is None:
+            state = self.__table.find_by_id(self.__host, cont_id)
+            name = state.name if state is not None else None
+        if action == 'destroy':
+            if name is not None:
+                self.__table.remove(self.__host, name)
+            return
+        if action not in EVENT_STATES:
+            return
+        if name is None or action in ('start', 'restart', 'unpause'):
+            # the container IP and, for old daemons, the name of a new
+            # container are not part of the event
+            self._refresh(cont_id)
+            return
+        if not self.__table.apply_event(self.__host, name, cont_id,
+                                        EVENT_STATES[action]):
+            self._refresh(cont_id)
+
+    def run(self):
+        while not self.__stopped.is_set():
+            try:
+                dcx = self.__pool.dedicated_client(self.__host)
+                try:
+                    # subscribe before seeding so that no event between the
+                    # listing and the subscription is lost
+                    stream = dcx.events(decode=True)
+                    self._seed()
+                    self.__table.set_live(self.__host, True)
+                    logger.info('Watching docker events on ' + self.__host)
+                    for event in stream:
+                        if self.__stopped.is_set():
+                            break
+                        try:
+                            self._handle(event)
+                        except Exception, ex:
+                            logger.warning('Failed to apply docker event on '
+                                           + self.__host + ': ' + str(ex))
+                finally:
+                    self.__table.set_live(self.__host, False)
+                    dcx.close()
+            except Exception, ex:
+                logger.warning('Docker events stream of ' + self.__host +
+                               ' broke: ' + str(ex))
+            self.__stopped.wait(self.__retry_interval)
+
+
+class DockerEventMonitor(object):
+    """
+    @class DockerEventMonitor
+    @brief starts one DockerEventWatcher per host on first use.
+    """
+
+    def __init__(self, pool):
+        self.__pool = pool
+        self.__watchers = {}
+        self.__lock = threading.Lock()
+        self.table = ContainerStateTable()
+
+    def watch(self, host):
+        """
+        @brief makes sure the events of host are being followed
+        """
+        if host in self.__watchers:
+            return
+        with self.__lock:
+            if host in self.__watchers:
+                return
+            watcher = DockerEventWatcher(self.__pool, host, self.table)
+            self.__watchers[host] = watcher
+            watcher.start()
+
+    def stop(self):
+        with self.__lock:
+            for watcher in self.__watchers.values():
+                watcher.stop()
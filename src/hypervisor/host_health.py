@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# weight of the latest call in the moving average of the latency of a host
+LATENCY_WEIGHT = 0.2
+
+
+class _HostState(object):
+    """
+    @brief outcome of the recent remote API calls to a single host
+    """
+    __slots__ = ('calls', 'failures', 'consecutive_failures', 'last_error',
+                 'down_since', 'retry_at', 'latency_us')
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.down_since = None
+        self.retry_at = None
+        self.latency_us = None
+
+
+class HostHealth(object):
+    """
+    @class HostHealth
+    @brief tracks which hypervisor hosts answer their remote API.
+
+    A host that fails failure_threshold calls in a row at the transport
+    level, e.g., connection refused or timed out, is down: calls to it fail
+    at once instead of each waiting for its own timeout. Every
+    retry_interval seconds one call is let through to probe the host, and
+    the first call that succeeds brings it back up. Errors the daemon
+    answers with, e.g., 404, show that the host is up.
+    """
+
+    def __init__(self, failure_threshold=3, retry_interval=10.0):
+        """
+        @brief Instantiates a HostHealth object.
+
+        @param failure_threshold number of failures in a row after which a
+            host is down. 0 never takes a host down.
+        @param retry_interval seconds between two probes of a host that is
+            down
+        """
+        self.__failure_threshold = failure_threshold
+        self.__retry_interval = retry_interval
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+
+    def _state(self, host):
+        # called with the lock held
+        state = self.__hosts.get(host)
+        if state is None:
+            state = self.__hosts[host] = _HostState()
+        return state
+
+    def allow(self, host):
+        """
+        @brief decides whether a call to host should be made
+
+        @returns False if host is down and not due to be probed
+        """
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is None or state.retry_at is None:
+                return True
+            now = time.time()
+            if now < state.retry_at:
+                return False
+            # one probe per interval
+            state.retry_at = now + self.__retry_interval
+            return True
+
+    def succeeded(self, host, elapsed_us=None):
+        """
+        @brief records a call the daemon of host answered
+
+        @param elapsed_us how long the call took in microseconds, None if
+            it should not count towards the latency of the host
+        """
+        with self.__lock:
+            state = self._state(host)
+            state.calls += 1
+            state.consecutive_failures = 0
+            if elapsed_us is not None:
+                if state.latency_us is None:
+                    state.latency_us = float(elapsed_us)
+                else:
+                    state.latency_us += LATENCY_WEIGHT * \
+                        (elapsed_us - state.latency_us)
+            if state.down_since is not None:
+                logger.warning('Hypervisor host ' + host + ' is back up '
+                               'after %.1fs' % (time.time() -
+                                                state.down_since))
+                state.down_since = None
+                state.retry_at = None
+
+    def failed(self, host, error):
+        """
+        @brief records a call to host that got no answer
+
+        @param error name of the error the call failed with
+        """
+        with self.__lock:
+            state = self._state(host)
+            state.calls += 1
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = error
+            now = time.time()
+            if state.down_since is not None:
+                state.retry_at = now + self.__retry_interval
+            elif self.__failure_threshold > 0 and \
+                    state.consecutive_failures >= self.__failure_threshold:
+                state.down_since = now
+                state.retry_at = now + self.__retry_interval
+                logger.error('Hypervisor host ' + host + ' is down after %d '
+                             'failed calls (%s), probing it every %gs' %
+                             (state.consecutive_failures, error,
+                              self.__retry_interval))
+
+    def snapshot(self):
+        """
+        @returns dictionary of host -> dictionary with its status, 'up' or
+            'down', the number of calls and failures, the failures in a row,
+            the last error and the moving average of the latency
+        """
+        with self.__lock:
+            return dict((host, {
+                'status': 'up' if state.down_since is None else 'down',
+                'down_since': state.down_since,
+                'calls': state.calls,
+                'failures': state.failures,
+                'consecutive_failures': state.consecutive_failures,
+                'last_error': state.last_error,
+                'latency_us': None if state.latency_us is None
+                              else int(state.latency_us),
+            }) for host, state in self.__hosts.items())
+
+    def format(self):
+        """
+        @returns the health of the hosts as a table, a line per host
+        """
+        lines = ['hosts',
+                 '%-16s %-6s %9s %9s %8s %11s  %s' % (
+                     'host', 'status', 'calls', 'failures', 'in_row',
+                     'latency_us', 'last_error')]
+        for host, state in sorted(self.snapshot().items()):
+            lines.append('%-16s %-6s %9d %9d %8d %11s  %s' % (
+                host, state['status'], state['calls'], state['failures'],
+                state['consecutive_failures'],
+                '-' if state['latency_us'] is None else state['latency_us'],
+                state['last_error'] or '-'))
+        return '\n'.join(lines) + '\n'
@@ -78,3 +78,64 @@ class HypervisorBase(object):
         Current status of a VM or container.
       """ 
       pass
+
+    # guest files read by the default implementation of guest_net_stats
+    NET_STATS_FILES = ('/proc/net/dev', '/proc/net/snmp')
+    NET_STATS_SEPARATOR = '--'
+
+    def guest_net_stats(self, host, user, vnf_name):
+      """Returns the raw network statistics of a VM or container.
+
+      The default implementation runs a single command inside the guest.
+      Drivers that can read the statistics without entering the guest
+      should override it.
+
+      Args:
+        host: IP address or hostname of the machine hosting the guest.
+        user: name of the user who owns the VNF.
+        vnf_name: name of the VNF instance.
+
+      Returns:
+        A tuple with the content of the guest's /proc/net/dev and
+        /proc/net/snmp.
+      """
+      command = ("; echo '" + self.NET_STATS_SEPARATOR + "'; ").join(
+          'cat ' + path for path in self.NET_STATS_FILES)
+      output = self.execute_in_guest(host, user, vnf_name, command)
+      dev, _, snmp = output.partition('\n' + self.NET_STATS_SEPARATOR + '\n')
+      return dev, snmp
+
+    def list_guests(self, host, user):
+      """Lists the VMs or containers of a user on a host.
+
+      Used to reconcile the nf.io root with the hypervisor when nf.io is
+      mounted. Drivers that cannot list their guests cheaply do not
+      override it.
+
+      Args:
+        host: IP address or hostname of the machine hosting the guests.
+        user: name of the user who owns the VNFs.
+
+      Returns:
+        A dictionary of VNF name -> (hypervisor specific ID, status), or None
+        if the driver cannot list its guests.
+      """
+      return None
+
+    def get_metrics(self):
+      """Returns the metrics the driver keeps of its calls.
+
+      Returns:
+        A list of (name, metrics.OperationMetrics) tuples, empty if the
+        driver does not record its calls.
+      """
+      return []
+
+    def host_health(self):
+      """Returns what the driver knows of the health of its hosts.
+
+      Returns:
+        A host_health.HostHealth, or None if the driver does not track the
+        health of its hosts.
+      """
+      return None
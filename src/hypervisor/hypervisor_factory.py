@@ -1,5 +1,46 @@
-from docker_driver import DockerDriver
-from libvirt_driver import Libvirt
+import importlib
+
+# hypervisor type -> (module in this package, driver class). A driver module
+# is only imported when its hypervisor type is used, so that e.g. docker-py
+# and requests are not loaded for other hypervisors.
+DRIVERS = {
+    'DockerDriver': ('docker_driver', 'DockerDriver'),
+    'Libvirt': ('libvirt_driver', 'Libvirt'),
+    'Simulated': ('simulated_driver', 'Simulated'),
+}
+
+
+def register_driver(hypervisor_type, module_name, class_name):
+    """
+    Makes a driver available under a hypervisor type.
+
+    Args:
+        hypervisor_type: name of the hypervisor type, e.g., DockerDriver.
+        module_name: name of the driver module in the hypervisor package.
+        class_name: name of the driver class in that module.
+    """
+    DRIVERS[hypervisor_type] = (module_name, class_name)
+
+
+def load_driver(hypervisor_type):
+    """
+    Imports the driver module of a hypervisor type.
+
+    Returns:
+        The driver class.
+
+    Raises:
+        TypeError if the hypervisor type is not registered.
+    """
+    if hypervisor_type not in DRIVERS:
+        raise TypeError(
+            "Invalid hypervisor type. Valid types are: " +
+            ", ".join(sorted(DRIVERS)))
+    module_name, class_name = DRIVERS[hypervisor_type]
+    package = __name__.rpartition('.')[0]
+    if package:
+        module_name = package + '.' + module_name
+    return getattr(importlib.import_module(module_name), class_name)
 
 
 class HypervisorFactory(object):
@@ -12,13 +53,16 @@ class HypervisorFactory(object):
     __hyp_instance = None
     __hyp_instance_type = None
 
-    def __init__(self, hypervisor_type="DockerDriver"):
+    def __init__(self, hypervisor_type="DockerDriver", **driver_options):
         """
         Instantiates a HypervisorFactory object.
 
         Args:
             hypervisor_type: The type of hypervisor object to instantiate. Valid
-                hypervisor types are 'DockerDriver' and 'Libvirt' for the time being.
+                hypervisor types are the keys of DRIVERS, 'DockerDriver',
+                'Libvirt' and 'Simulated' for the time being.
+            driver_options: Keyword arguments passed on to the constructor of
+                the hypervisor driver, e.g., pool_size for DockerDriver.
 
         Returns:
             Nothing. Initializaes the factory object.
@@ -27,19 +71,13 @@ class HypervisorFactory(object):
             If this factory class is instantiated multiple times with different
             types of hypervisor_type argument then it raises a ValueError.
 
-            If this factory class is instantiated with a hypervisor type other
-            than Docker or Libvirt it raises a TypeError.
+            If this factory class is instantiated with a hypervisor type that
+            is not in DRIVERS it raises a TypeError.
         """
         if not HypervisorFactory.__hyp_instance:
-            if hypervisor_type == "DockerDriver":
-                HypervisorFactory.__hyp_instance_type = hypervisor_type
-                HypervisorFactory.__hyp_instance = DockerDriver()
-            elif hypervisor_type == "Libvirt":
-                HypervisorFactory.__hyp_instance_type = hypervisor_type
-                HypervisorFactory.__hyp_instance = Libvirt()
-            else:
-                raise TypeError(
-                    "Invalid hypervisor type. Valid types are: Docker, Libvirt")
+            driver_class = load_driver(hypervisor_type)
+            HypervisorFactory.__hyp_instance_type = hypervisor_type
+            HypervisorFactory.__hyp_instance = driver_class(**driver_options)
         elif HypervisorFactory.__hyp_instance_type != hypervisor_type:
             raise ValueError(
                 "An instantiation of type " +
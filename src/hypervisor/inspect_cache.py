@@ -0,0 +1,116 @@
+import threading
+import time
+
+
+class InspectCache(object):
+    """
+    @class InspectCache
+    @brief short lived cache of container inspect results.
+
+    Entries are keyed by (host, container name). Besides the inspect data the
+    cache remembers the container ID of every container it has seen, so that
+    later remote API calls can address the container directly instead of
+    having the daemon resolve its name. IDs outlive the inspect TTL and are
+    only dropped when the container is destroyed or can no longer be found.
+
+    Every key has a generation that invalidate and forget bump. A reader
+    takes the generation before it asks the daemon and passes it to put, so
+    that an inspect result that raced with a lifecycle operation is dropped
+    instead of serving the state from before the operation.
+    """
+
+    def __init__(self, ttl=2.0):
+        """
+        @brief Instantiates an InspectCache object.
+
+        @param ttl number of seconds an inspect result is served from the
+            cache. A ttl of 0 disables caching of inspect results.
+        """
+        self.__ttl = ttl
+        self.__entries = {}
+        self.__ids = {}
+        # (host, name) -> number of invalidations. Kept when a container is
+        # forgotten, so a read that started before is still recognized.
+        self.__generations = {}
+        self.__lock = threading.Lock()
+
+    def get(self, host, name):
+        """
+        @brief returns the cached inspect data of a container
+
+        @returns inspect data, or None if nothing fresh is cached
+        """
+        key = (host, name)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            data, expires = entry
+            if time.time() >= expires:
+                del self.__entries[key]
+                return None
+            return data
+
+    def generation(self, host, name):
+        """
+        @brief returns the generation of a container's entry, to be passed to
+            put with the inspect data read afterwards
+        """
+        with self.__lock:
+            return self.__generations.get((host, name), 0)
+
+    def put(self, host, name, data, generation=None):
+        """
+        @brief caches the inspect data of a container and remembers its ID
+
+        @param generation the generation of the entry before the data was
+            read. If the entry has been invalidated since, the data is
+            dropped. None always caches the data.
+        """
+        with self.__lock:
+            if generation is not None and \
+                    self.__generations.get((host, name), 0) != generation:
+                return
+            if self.__ttl > 0:
+                self.__entries[(host, name)] = (data, time.time() + self.__ttl)
+            if data.get('Id'):
+                self.__ids[(host, name)] = data['Id']
+
+    def get_id(self, host, name):
+        """
+        @brief returns the remembered container ID, or None
+        """
+        with self.__lock:
+            return self.__ids.get((host, name))
+
+    def set_id(self, host, name, cont_id):
+        """
+        @brief remembers the ID of a newly created container
+        """
+        with self.__lock:
+            self.__ids[(host, name)] = cont_id
+
+    def invalidate(self, host, name):
+        """
+        @brief drops the cached inspect data of a container
+
+        Called after every operation that changes the state of a container.
+        The container ID is kept.
+        """
+        with self.__lock:
+            self.__entries.pop((host, name), None)
+            self._bump(host, name)
+
+    def forget(self, host, name):
+        """
+        @brief drops everything known about a container
+        """
+        with self.__lock:
+            self.__entries.pop((host, name), None)
+            self.__ids.pop((host, name), None)
+            self._bump(host, name)
+
+    def _bump(self, host, name):
+        # called with the lock held
+        key = (host, name)
+        self.__generations[key] = self.__generations.get(key, 0) + 1
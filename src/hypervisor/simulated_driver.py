@@ -0,0 +1,404 @@
+import random
+import threading
+import time
+
+from hypervisor_base import HypervisorBase
+import errors
+
+# shapes of the simulated call latency, each parameterized by its mean
+LATENCY_DISTRIBUTIONS = ('constant', 'uniform', 'exponential')
+
+# driver call -> error raised when the call fails. Calls not listed only fail
+# if a failure rate is set for them explicitly, see Simulated.__init__.
+CALL_ERRORS = {
+    'deploy': errors.VNFDeployError,
+    'start': errors.VNFStartError,
+    'restart': errors.VNFRestartError,
+    'stop': errors.VNFStopError,
+    'pause': errors.VNFPauseError,
+    'unpause': errors.VNFUnpauseError,
+    'destroy': errors.VNFDestroyError,
+    'execute_in_guest': errors.VNFCommandExecutionError,
+}
+
+# interfaces of every simulated guest
+INTERFACES = ('lo', 'eth0')
+
+# average size of a simulated packet in bytes
+PACKET_SIZE = 800
+
+
+def parse_call_values(text):
+    """
+    @brief parses a per call setting of the command line
+
+    @param text comma separated list of <call>=<number>, e.g.,
+        deploy=0.5,start=0.2
+
+    @returns dictionary of call -> float
+    """
+    values = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        call, _, value = item.partition('=')
+        values[call.strip()] = float(value)
+    return values
+
+
+def draw_latency(rng, distribution, mean):
+    """
+    @brief draws a call latency
+
+    @param rng random.Random to draw from
+    @param distribution one of LATENCY_DISTRIBUTIONS
+    @param mean mean latency in seconds
+
+    @returns latency in seconds
+    """
+    if mean <= 0:
+        return 0.0
+    if distribution == 'uniform':
+        return rng.uniform(0, 2 * mean)
+    if distribution == 'exponential':
+        return rng.expovariate(1.0 / mean)
+    return mean
+
+
+def format_net_stats(transferred, drop_rate):
+    """
+    @brief generates the network statistics of a simulated guest, in the
+        format of /proc/net/dev and /proc/net/snmp. eth0 has received and
+        sent transferred bytes, lo a hundredth of that.
+
+    @param transferred number of bytes received and sent on eth0
+    @param drop_rate fraction of the packets that were dropped
+
+    @returns a tuple with the content of /proc/net/dev and /proc/net/snmp
+    """
+    dev = ['Inter-|   Receive                                            '
+           '    |  Transmit',
+           ' face |bytes    packets errs drop fifo frame compressed '
+           'multicast|bytes    packets errs drop fifo colls carrier '
+           'compressed']
+    total_packets = 0
+    total_dropped = 0
+    for iface in INTERFACES:
+        nbytes = int(transferred / 100 if iface == 'lo' else transferred)
+        packets = nbytes / PACKET_SIZE
+        dropped = int(packets * drop_rate)
+        total_packets += packets
+        total_dropped += dropped
+        dev.append('%6s: %d %d 0 %d 0 0 0 0 %d %d 0 0 0 0 0 0' %
+                   (iface, nbytes, packets, dropped, nbytes, packets))
+    received = total_packets - total_dropped
+    snmp = ['Ip: Forwarding DefaultTTL InReceives InHdrErrors '
+            'InAddrErrors ForwDatagrams InUnknownProtos InDiscards '
+            'InDelivers OutRequests',
+            'Ip: 1 64 %d 0 0 0 0 %d %d %d' %
+            (total_packets, total_dropped, received, total_packets),
+            'Udp: InDatagrams NoPorts InErrors OutDatagrams',
+            'Udp: %d 0 0 %d' % (received, total_packets)]
+    return '\n'.join(dev) + '\n', '\n'.join(snmp) + '\n'
+
+
+class _Guest(object):
+    """
+    @class _Guest
+    @brief a simulated container
+    """
+    __slots__ = ('id', 'image', 'status', 'ip', 'rate', 'uptime',
+                 'running_since')
+
+    def __init__(self, cont_id, image, ip, rate):
+        self.id = cont_id
+        self.image = image
+        self.status = 'created'
+        self.ip = ip
+        # bytes per second the guest receives and sends on eth0
+        self.rate = rate
+        # seconds the guest ran before it was last started
+        self.uptime = 0.0
+        self.running_since = None
+
+    def set_status(self, status, now):
+        if self.running_since is not None:
+            self.uptime += now - self.running_since
+            self.running_since = None
+        if status == 'running':
+            self.running_since = now
+        self.status = status
+
+    def running_time(self, now):
+        if self.running_since is None:
+            return self.uptime
+        return self.uptime + now - self.running_since
+
+
+class Simulated(HypervisorBase):
+    """
+    @class Simulated
+    @brief in-process hypervisor driver for benchmarks and scale tests.
+
+    The containers only exist in memory, so nf.io can be run against tens of
+    thousands of VNFs without a docker daemon, and its own overhead measured.
+    Every call sleeps for a latency drawn from a configurable distribution,
+    and fails at a configurable rate with the error the docker driver raises
+    for that call. The network counters of a running guest grow with its
+    running time.
+    """
+
+    def __init__(self, latency=0.0, latency_distribution='constant',
+                 call_latency=None, failure_rate=0.0, call_failure_rate=None,
+                 counter_rate=125000.0, drop_rate=0.001, seed=None):
+        """
+        @brief Instantiates a Simulated driver.
+
+        @param latency mean number of seconds every driver call takes
+        @param latency_distribution one of LATENCY_DISTRIBUTIONS
+        @param call_latency dictionary of driver call, e.g., deploy -> mean
+            latency of that call, overriding latency
+        @param failure_rate probability that a call listed in CALL_ERRORS
+            fails
+        @param call_failure_rate dictionary of driver call -> probability
+            that it fails, overriding failure_rate. Calls that are not in
+            CALL_ERRORS fail with HypervisorConnectionError.
+        @param counter_rate mean number of bytes per second a running guest
+            receives and sends. The rate of each guest is drawn between half
+            and one and a half times the mean.
+        @param drop_rate fraction of the packets of a guest that are dropped
+        @param seed seed of the random numbers, for repeatable runs
+        """
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError('Unknown latency distribution ' +
+                             latency_distribution + '. Valid distributions '
+                             'are: ' + ', '.join(LATENCY_DISTRIBUTIONS))
+        self.__latency = latency
+        self.__distribution = latency_distribution
+        self.__call_latency = dict(call_latency or {})
+        self.__failure_rate = failure_rate
+        self.__call_failure_rate = dict(call_failure_rate or {})
+        self.__counter_rate = counter_rate
+        self.__drop_rate = drop_rate
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        # host -> container name -> _Guest
+        self.__hosts = {}
+        self.__deployed = 0
+
+    def _simulate_call(self, call):
+        """
+        @brief sleeps for the latency of a call and decides whether it fails
+
+        Runs outside the driver's lock, so that concurrent calls overlap
+        like remote calls do.
+        """
+        delay = draw_latency(self.__random, self.__distribution,
+                             self.__call_latency.get(call, self.__latency))
+        if delay > 0:
+            time.sleep(delay)
+        if call in self.__call_failure_rate:
+            rate = self.__call_failure_rate[call]
+        elif call in CALL_ERRORS:
+            rate = self.__failure_rate
+        else:
+            return
+        if rate > 0 and self.__random.random() < rate:
+            raise CALL_ERRORS.get(call, errors.HypervisorConnectionError)
+
+    def _validate(self, host, vnf_name):
+        if host is None or host.strip() == '':
+            raise errors.VNFHostNameIsEmptyError
+        if vnf_name is None or vnf_name.strip() == '':
+            raise errors.VNFNameIsEmptyError
+
+    def _guest(self, host, user, vnf_name):
+        """
+        @brief looks a guest up; the caller holds the lock
+
+        @returns the _Guest
+        """
+        guest = self.__hosts.get(host, {}).get(user + '-' + vnf_name)
+        if guest is None:
+            raise errors.VNFNotFoundError
+        return guest
+
+    def _transition(self, call, host, user, vnf_name, status,
+                    allowed=None):
+        """
+        @brief changes the status of a guest
+
+        @param allowed statuses the guest may be in, None for any. Otherwise
+            the call fails with its error from CALL_ERRORS.
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call(call)
+        with self.__lock:
+            guest = self._guest(host, user, vnf_name)
+            if allowed is not None and guest.status not in allowed:
+                raise CALL_ERRORS[call]
+            guest.set_status(status, time.time())
+
+    def get_id(self, host, user, vnf_name):
+        """
+        @brief Returns a container's ID.
+
+        @param host IP address or hostname of the simulated machine
+        @param user name of the user who owns the VNF
+        @param vnf_name name of the VNF instance
+
+        @returns container ID
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('get_id')
+        with self.__lock:
+            return self._guest(host, user, vnf_name).id
+
+    def get_ip(self, host, user, vnf_name):
+        """
+        @brief Returns a running container's IP address.
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('get_ip')
+        with self.__lock:
+            guest = self._guest(host, user, vnf_name)
+            if guest.status != 'running':
+                raise errors.VNFNotRunningError
+            return guest.ip
+
+    def deploy(self, host, user, image_name, vnf_name, is_privileged=True):
+        """
+        @brief Deploys a container.
+
+        @param host IP address or hostname of the simulated machine
+        @param user name of the user who owns the VNF
+        @param image_name image name for the VNF
+        @param vnf_name name of the VNF instance
+        @param is_privileged ignored
+
+        @returns container ID
+        """
+        self._validate(host, vnf_name)
+        if image_name is None or image_name.strip() == '':
+            raise errors.VNFImageNameIsEmptyError
+        self._simulate_call('deploy')
+        with self.__lock:
+            guests = self.__hosts.setdefault(host, {})
+            vnf_fullname = user + '-' + vnf_name
+            if vnf_fullname in guests:
+                # docker refuses to create a second container of that name
+                raise errors.VNFDeployError
+            self.__deployed += 1
+            number = self.__deployed
+            # addresses after docker's default bridge network, 172.17.0.0/16
+            ip = '172.%d.%d.%d' % (17 + (number >> 16), (number >> 8) & 255,
+                                   number & 255)
+            cont_id = '%064x' % self.__random.getrandbits(256)
+            rate = self.__counter_rate * self.__random.uniform(0.5, 1.5)
+            guests[vnf_fullname] = _Guest(cont_id, image_name, ip, rate)
+        return cont_id
+
+    def start(self, host, user, vnf_name, is_privileged=True):
+        """
+        @brief Starts a container. Starting a running container does
+            nothing, a paused one has to be unpaused.
+        """
+        self._transition('start', host, user, vnf_name, 'running',
+                         ('created', 'exited', 'running'))
+
+    def restart(self, host, user, vnf_name):
+        """
+        @brief Restarts a container.
+        """
+        self._transition('restart', host, user, vnf_name, 'running')
+
+    def stop(self, host, user, vnf_name):
+        """
+        @brief Stops a container.
+        """
+        self._transition('stop', host, user, vnf_name, 'exited')
+
+    def pause(self, host, user, vnf_name):
+        """
+        @brief Pauses a running container.
+        """
+        self._transition('pause', host, user, vnf_name, 'paused',
+                         ('running',))
+
+    def unpause(self, host, user, vnf_name):
+        """
+        @brief Unpauses a paused container.
+        """
+        self._transition('unpause', host, user, vnf_name, 'running',
+                         ('paused',))
+
+    def destroy(self, host, user, vnf_name, force=True):
+        """
+        @brief Destroys a container.
+
+        @param force if set to False then a running VNF will not
+              be destroyed. default is True
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('destroy')
+        with self.__lock:
+            guest = self._guest(host, user, vnf_name)
+            if guest.status == 'running' and not force:
+                raise errors.VNFDestroyError
+            del self.__hosts[host][user + '-' + vnf_name]
+
+    def list_guests(self, host, user):
+        """
+        @brief Lists the containers of a user on a host.
+
+        @returns dictionary of VNF name -> (container ID, state)
+        """
+        self._simulate_call('list_guests')
+        prefix = user + '-'
+        with self.__lock:
+            return dict((name[len(prefix):], (guest.id, guest.status))
+                        for name, guest in self.__hosts.get(host, {}).items()
+                        if name.startswith(prefix))
+
+    def execute_in_guest(self, host, user, vnf_name, cmd):
+        """
+        @brief Executes a command inside a running container. Commands
+            are not run; the output is always empty.
+
+        @returns the output of the command
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('execute_in_guest')
+        with self.__lock:
+            if self._guest(host, user, vnf_name).status != 'running':
+                raise errors.VNFNotRunningError
+        return ''
+
+    def guest_status(self, host, user, vnf_name):
+        """
+        @brief Returns the status of a container.
+
+        @returns created, running, paused or exited
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('guest_status')
+        with self.__lock:
+            return self._guest(host, user, vnf_name).status
+
+    def guest_net_stats(self, host, user, vnf_name):
+        """
+        @brief Returns synthetic network statistics of a running
+            container, see format_net_stats. eth0 receives and sends the
+            rate of the guest for as long as it has been running.
+
+        @returns a tuple with the content of the container's /proc/net/dev
+            and /proc/net/snmp
+        """
+        self._validate(host, vnf_name)
+        self._simulate_call('guest_net_stats')
+        with self.__lock:
+            guest = self._guest(host, user, vnf_name)
+            if guest.status != 'running':
+                raise errors.VNFNotRunningError
+            transferred = guest.rate * guest.running_time(time.time())
+        return format_net_stats(transferred, self.__drop_rate)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+In-memory registry of VNF instances.
+
+The configuration of a VNF instance, e.g., the host it is deployed on and its
+image, lives in files under machine/ in the instance directory. Instead of
+reading these files on every access to a special file, the registry loads
+them once, when nf.io is mounted or when an instance is first used, and
+updates a record whenever one of them is written through the mount. Changes
+made to these files directly in the nf.io root, bypassing the mount, are not
+seen until the instance is reloaded.
+"""
+
+import os
+import threading
+
+import instance_template
+
+# configuration files of an instance -> VNFInstance attribute
+CONFIG_FILES = {
+    'machine/ip': 'host',
+    'machine/vm.image': 'image',
+    'machine/vm.vcpu': 'vcpu',
+    'machine/vm.memory': 'memory',
+}
+
+# attributes that are parsed as integers
+INT_ATTRIBUTES = ('vcpu', 'memory')
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(root=None):
+    """
+    Returns the process wide registry. The registry is created and loaded on
+    the first call, which has to provide the nf.io root.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = InstanceRegistry(root)
+            _registry.load()
+    return _registry
+
+
+class VNFInstance(object):
+
+    """
+    The configuration of one VNF instance.
+
+    Attributes:
+        name: name of the instance, i.e., of its directory.
+        nf_type: type of the VNF, e.g., firewall.
+        host: IP address of the machine the VNF is deployed on.
+        image: name of the VM/container image of the VNF.
+        cont_id: ID of the VM/container, or None if the VNF is not deployed
+            or nf.io has not deployed it since it was mounted.
+        vcpu: number of virtual CPUs, or None if not configured.
+        memory: memory size, or None if not configured.
+    """
+    __slots__ = ('name', 'nf_type', 'host', 'image', 'cont_id', 'vcpu',
+                 'memory')
+
+    def __init__(self, name, nf_type, host='', image='', cont_id=None,
+                 vcpu=None, memory=None):
+        self.name = name
+        self.nf_type = nf_type
+        self.host = host
+        self.image = image
+        self.cont_id = cont_id
+        self.vcpu = vcpu
+        self.memory = memory
+
+
+def _parse(attribute, value):
+    if attribute in INT_ATTRIBUTES:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return value
+
+
+class InstanceRegistry(object):
+
+    """
+    Maps (nf_type, instance name) to the VNFInstance of every instance under
+    the nf-types directory of an nf.io root.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root: the nf.io root directory.
+        """
+        self._root = root
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def _instance_dir(self, nf_type, name):
+        return os.path.join(self._root, 'nf-types', nf_type, name)
+
+    def _read_config(self, instance_dir, config_file):
+        try:
+            with open(os.path.join(instance_dir, config_file)) as config_fd:
+                return config_fd.readline().rstrip('\n')
+        except IOError:
+            return ''
+
+    def _load_instance(self, nf_type, name):
+        instance_dir = self._instance_dir(nf_type, name)
+        if not os.path.isdir(instance_dir):
+            return None
+        instance = VNFInstance(name, nf_type)
+        for config_file, attribute in CONFIG_FILES.items():
+            setattr(instance, attribute,
+                    _parse(attribute, self._read_config(instance_dir,
+                                                        config_file)))
+        return instance
+
+    def load(self):
+        """
+        Loads every instance found under the nf-types directory.
+        """
+        types_dir = os.path.join(self._root, 'nf-types')
+        instances = {}
+        if os.path.isdir(types_dir):
+            for nf_type in os.listdir(types_dir):
+                type_dir = os.path.join(types_dir, nf_type)
+                if not os.path.isdir(type_dir):
+                    continue
+                for name in os.listdir(type_dir):
+                    if instance_template.is_partial(name):
+                        continue
+                    instance = self._load_instance(nf_type, name)
+                    if instance is not None:
+                        instances[(nf_type, name)] = instance
+        with self._lock:
+            self._instances = instances
+        return len(instances)
+
+    def instances(self):
+        """
+        Returns the VNFInstance of every known instance.
+        """
+        with self._lock:
+            return self._instances.values()
+
+    def get(self, nf_type, name):
+        """
+        Returns the VNFInstance of an instance, loading it if it is not yet
+        known, or None if the instance does not exist.
+        """
+        instance = self._instances.get((nf_type, name))
+        if instance is not None:
+            return instance
+        return self.reload(nf_type, name)
+
+    def reload(self, nf_type, name):
+        """
+        Reads the configuration of an instance from disk again, e.g., after
+        its directory was created. The container ID is kept.
+        """
+        instance = self._load_instance(nf_type, name)
+        with self._lock:
+            previous = self._instances.pop((nf_type, name), None)
+            if instance is not None:
+                if previous is not None:
+                    instance.cont_id = previous.cont_id
+                self._instances[(nf_type, name)] = instance
+        return instance
+
+    def update(self, nf_type, name, config_file):
+        """
+        Re-reads one configuration file of an instance after it was written.
+
+        Args:
+            config_file: path of the file relative to the instance directory,
+                one of CONFIG_FILES.
+        """
+        instance = self.get(nf_type, name)
+        if instance is None:
+            return
+        attribute = CONFIG_FILES[config_file]
+        setattr(instance, attribute,
+                _parse(attribute, self._read_config(
+                    self._instance_dir(nf_type, name), config_file)))
+
+    def set_container_id(self, nf_type, name, cont_id):
+        instance = self.get(nf_type, name)
+        if instance is not None:
+            instance.cont_id = cont_id
+
+    def remove(self, nf_type, name):
+        with self._lock:
+            self._instances.pop((nf_type, name), None)
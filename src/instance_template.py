@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Declarative skeletons of VNF instance directories.
+
+The directories and files of a new VNF instance are declared once per VNF
+type as an InstanceTemplate. Creating an instance builds the skeleton in a
+hidden temporary directory next to the instance and renames it into place,
+so an instance directory either appears complete or not at all, and every
+file descriptor opened while building it is closed. The directories being
+built are hidden from listings of nf.io, see is_partial(). template_bench.py
+measures the instance creation throughput.
+"""
+
+import binascii
+import errno
+import os
+import shutil
+
+# prefix of the temporary directories instances are built in
+PARTIAL_PREFIX = '.partial.'
+
+
+class InstanceTemplate(object):
+
+    """
+    The directories and empty files of a VNF instance.
+    """
+
+    def __init__(self, directories=(), files=()):
+        """
+        Args:
+            directories: paths of the directories of an instance, relative to
+                the instance directory. They are created with the mode passed
+                to create().
+            files: list of (path, mode) tuples of the files of an instance,
+                relative to the instance directory. A mode of None uses the
+                mode passed to create().
+        """
+        # parents are created before their children
+        self._directories = sorted(directories,
+                                   key=lambda path: path.count('/'))
+        self._files = list(files)
+
+    def directories(self):
+        return list(self._directories)
+
+    def files(self):
+        return list(self._files)
+
+    def create(self, path, mode):
+        """
+        Creates an instance directory from the template.
+
+        Args:
+            path: absolute path of the instance directory to create.
+            mode: mode of the instance directory and its subdirectories.
+
+        Raises:
+            OSError with errno EEXIST if path exists, or the error that
+            prevented the skeleton from being built.
+        """
+        if os.path.lexists(path):
+            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+        parent, name = os.path.split(path)
+        partial_path = os.path.join(parent, PARTIAL_PREFIX + name + '.' +
+                                    binascii.hexlify(os.urandom(4)))
+        os.mkdir(partial_path, mode)
+        try:
+            for directory in self._directories:
+                os.mkdir(os.path.join(partial_path, directory), mode)
+            for file_path, file_mode in self._files:
+                if file_mode is None:
+                    file_mode = mode
+                fd = os.open(os.path.join(partial_path, file_path),
+                             os.O_WRONLY | os.O_CREAT | os.O_EXCL, file_mode)
+                os.close(fd)
+            # renaming onto an existing empty directory would succeed
+            if os.path.lexists(path):
+                raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+            os.rename(partial_path, path)
+        except:
+            shutil.rmtree(partial_path, ignore_errors=True)
+            raise
+
+
+# the skeleton shared by the middlebox VNF types
+DEFAULT_TEMPLATE = InstanceTemplate(
+    directories=['config', 'machine', 'stats'],
+    files=[('status', 0o644),
+           ('config/boot.conf', 0o644),
+           ('config/nf_conf', 0o644),
+           ('machine/ip', 0o644),
+           ('machine/vm.vcpu', 0o644),
+           ('machine/vm.memory', 0o644),
+           ('machine/vm.image', 0o644),
+           ('machine/vm.ip', 0o644),
+           ('action', 0o644),
+           ('command', 0o644),
+           ('stats/rx_bytes', 0o444),
+           ('stats/tx_bytes', 0o444),
+           ('stats/pkt_drops', 0o444)])
+
+
+def is_partial(name):
+    """
+    Returns True if name is the name of an instance that is being built.
+    """
+    return name.startswith(PARTIAL_PREFIX)
+
+
+def remove_partial_instances(root):
+    """
+    Removes instances that were left half built, e.g., by a crash, under the
+    nf-types directory of an nf.io root.
+
+    Returns:
+        The number of removed directories.
+    """
+    types_dir = os.path.join(root, 'nf-types')
+    removed = 0
+    if not os.path.isdir(types_dir):
+        return removed
+    for nf_type in os.listdir(types_dir):
+        type_dir = os.path.join(types_dir, nf_type)
+        if not os.path.isdir(type_dir):
+            continue
+        for name in os.listdir(type_dir):
+            if is_partial(name):
+                shutil.rmtree(os.path.join(type_dir, name), ignore_errors=True)
+                removed += 1
+    return removed
+
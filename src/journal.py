@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""
+Write-ahead journal of lifecycle actions.
+
+If nf.io died while an action was running, e.g., between deploying and
+starting the container of an activate, nothing recorded it and the only way
+to find what was left behind was to scan every host. Every action is now
+recorded in an append-only journal in the nf.io root: an intent record
+before the action touches the hypervisor, and a complete record after it.
+When nf.io is mounted again, only the actions without a complete record are
+recovered, so recovery time depends on the number of actions that were in
+flight, not on the number of instances.
+
+Records are JSON lines. Intent records are durable before the action runs.
+Writers hand their records to a single writer thread, which writes and
+fsyncs everything that was queued in one go (group commit), so concurrent
+actions share fsyncs. The journal is truncated whenever no action is in
+flight and it has grown past a size limit.
+
+Recovery rolls an interrupted activate back by destroying whatever was
+deployed, and replays every other action, as start, stop and destroy can
+safely be run again. Because a rollback undoes an action that may have
+succeeded, the complete records of such actions are durable before the
+action is reported as done. An action whose recovery fails stays in the
+journal and is recovered again at the next mount.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import control_files
+
+logger = logging.getLogger(__name__)
+
+# name of the journal in the nf.io root
+JOURNAL_NAME = '.nfio.journal'
+
+# interrupted action -> action that rolls it back. Actions not listed are
+# replayed.
+ROLLBACK = {
+    'activate': 'destroy',
+}
+
+
+def _scan(path):
+    intents = {}
+    last_seq = 0
+    try:
+        journal_file = open(path)
+    except IOError:
+        return [], last_seq
+    with journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last record may have been torn by the crash
+                continue
+            last_seq = max(last_seq, record.get('seq', 0))
+            if record.get('op') == 'intent':
+                intents[record['seq']] = record
+            elif record.get('op') == 'complete':
+                intents.pop(record.get('intent'), None)
+    return [intents[seq] for seq in sorted(intents)], last_seq
+
+
+def read_incomplete(path):
+    """
+    Reads the intent records of a journal that have no complete record.
+
+    Args:
+        path: path of the journal. A missing journal has no records.
+
+    Returns:
+        A list of intent records, dictionaries with the keys seq, type,
+        name, host and action, in the order they were written.
+    """
+    return _scan(path)[0]
+
+
+class Journal(object):
+
+    """
+    An append-only journal file with group commit.
+    """
+
+    def __init__(self, path, compact_size=1 << 20, first_seq=1,
+                 incomplete=()):
+        """
+        Args:
+            path: path of the journal file, created if it does not exist.
+            compact_size: size in bytes past which the journal is truncated
+                once no action is in flight.
+            first_seq: sequence number of the first record; it has to be
+                larger than those of the records already in the file.
+            incomplete: intent records already in the file that have no
+                complete record. They count as in flight until they are
+                completed, so that truncating the journal does not lose
+                them.
+        """
+        self._path = path
+        self._compact_size = compact_size
+        self._file = open(path, 'a')
+        self._end_torn_record()
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._queued = []
+        self._next_seq = first_seq
+        # sequence number of the last record that is on disk
+        self._durable_seq = first_seq - 1
+        # sequence number of each intent in flight -> its action
+        self._in_flight = dict((record['seq'], record['action'])
+                               for record in incomplete)
+        self._failure = None
+        thread = threading.Thread(target=self._write, name='journal')
+        thread.daemon = True
+        thread.start()
+
+    def _end_torn_record(self):
+        # a record torn by a crash must not swallow the next one
+        with open(self._path) as journal_file:
+            journal_file.seek(0, os.SEEK_END)
+            if journal_file.tell() == 0:
+                return
+            journal_file.seek(-1, os.SEEK_END)
+            if journal_file.read(1) == '\n':
+                return
+        self._file.write('\n')
+        self._file.flush()
+
+    def _append(self, record, in_flight=False):
+        with self._lock:
+            if self._failure is not None:
+                raise self._failure
+            seq = self._next_seq
+            self._next_seq += 1
+            record['seq'] = seq
+            self._queued.append(json.dumps(record) + '\n')
+            # an intent must be in flight before the writer can see it, or
+            # it could be compacted away
+            if in_flight:
+                self._in_flight[seq] = record['action']
+            self._written.notify_all()
+            return seq
+
+    def _wait(self, seq):
+        with self._lock:
+            while self._durable_seq < seq and self._failure is None:
+                self._written.wait()
+            if self._durable_seq < seq:
+                raise self._failure
+
+    def intent(self, key, host, action):
+        """
+        Records that an action is about to run and waits until the record
+        is on disk.
+
+        Returns:
+            The sequence number of the intent record, to be passed to
+            complete().
+
+        Raises:
+            IOError if the journal cannot be written.
+        """
+        seq = self._append({'op': 'intent', 'type': key[0], 'name': key[1],
+                            'host': host, 'action': action}, in_flight=True)
+        self._wait(seq)
+        return seq
+
+    def complete(self, intent_seq, failure=None):
+        """
+        Records that an action has completed. Waits for the record to be on
+        disk only if recovery would roll the action back, e.g., destroy the
+        VNF of an activate that succeeded; a lost record of any other action
+        only makes recovery replay it.
+
+        Raises:
+            IOError if the record of an action in ROLLBACK cannot be
+            written.
+        """
+        with self._lock:
+            action = self._in_flight.pop(intent_seq, None)
+        seq = self._append({'op': 'complete', 'intent': intent_seq,
+                            'failure': failure})
+        if action in ROLLBACK:
+            self._wait(seq)
+
+    def sync(self):
+        """
+        Waits until every record appended so far is on disk.
+        """
+        with self._lock:
+            seq = self._next_seq - 1
+        self._wait(seq)
+
+    def _write(self):
+        while True:
+            with self._lock:
+                while not self._queued:
+                    self._written.wait()
+                records = self._queued
+                self._queued = []
+                last_seq = self._next_seq - 1
+            try:
+                self._file.write(''.join(records))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                with self._lock:
+                    if not self._in_flight and not self._queued and \
+                            self._file.tell() > self._compact_size:
+                        self._file.seek(0)
+                        self._file.truncate()
+                        os.fsync(self._file.fileno())
+            except (IOError, OSError), ex:
+                logger.error('Failed to write the journal ' + self._path +
+                             ': ' + str(ex))
+                with self._lock:
+                    self._failure = IOError(ex.errno, ex.strerror,
+                                            self._path)
+                    self._written.notify_all()
+                return
+            with self._lock:
+                self._durable_seq = last_seq
+                self._written.notify_all()
+
+
+def open_journal(root, compact_size=1 << 20):
+    """
+    Opens the journal of an nf.io root.
+
+    Returns:
+        A tuple (journal, incomplete): the Journal, and the intent records
+        of the actions that were interrupted before it was opened.
+    """
+    path = os.path.join(root, JOURNAL_NAME)
+    incomplete, last_seq = _scan(path)
+    return Journal(path, compact_size, last_seq + 1, incomplete), incomplete
+
+
+def recover(operations, journal, incomplete):
+    """
+    Rolls back or replays the actions that were interrupted, and waits for
+    them to complete.
+
+    Args:
+        operations: the Nfio object serving the mount.
+        journal: the Journal, which records the recovery actions as usual.
+        incomplete: the intent records returned by open_journal().
+
+    Actions whose recovery did not succeed are not completed in the journal
+    and are recovered again at the next mount.
+
+    Returns:
+        A list of (intent record, recovery action, result) tuples.
+    """
+    if not incomplete:
+        return []
+    logger.info('Recovering %d interrupted lifecycle actions' %
+                len(incomplete))
+    recovery = []
+    for record in incomplete:
+        action = ROLLBACK.get(record['action'], record['action'])
+        recovery.append(control_files.Operation(
+            action, record['type'], record['name']))
+    batch = control_files.BatchFile(operations)
+    batch.run([operation for operation in recovery if operation.validate()])
+    results = []
+    for record, operation in zip(incomplete, recovery):
+        logger.info('Recovered ' + record['action'] + ' of ' +
+                    record['type'] + '/' + record['name'] + ' by ' +
+                    operation.op + ': ' + str(operation.result))
+        if operation.result == 'ok':
+            journal.complete(record['seq'], 'recovered')
+        results.append((record, operation.op, operation.result))
+    journal.sync()
+    return results
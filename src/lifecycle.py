@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+Asynchronous lifecycle actions of VNF instances.
+
+Writing an action such as 'activate' to the action file of an instance used
+to deploy and start the VNF inside the write system call, blocking the writer
+and a fuse thread until the hypervisor was done. Actions are now queued and
+run in the background by a bounded pool of worker threads, and the write
+returns at once. The actions of one instance run one after the other, in the
+order they were written, while actions of different instances run in
+parallel. The number of actions running against one hypervisor host at a
+time is capped, so that a burst of actions cannot flood a single daemon.
+
+While an action is queued or running, the status file of the instance reports
+a transitional state, e.g., 'deploying'. If the action fails, it reports
+'failed: <reason>' until the next action is written. Clients that want to
+wait for an action to complete can either fsync the action file or open it
+with O_SYNC; both block until all actions written so far have completed and
+fail with EIO if the last one failed.
+
+If a journal is given, every action is recorded in it before it runs and
+after it completes, see journal.py.
+"""
+
+import collections
+import logging
+import threading
+import Queue
+
+logger = logging.getLogger(__name__)
+
+# status reported while an action is queued or running
+TRANSITIONAL_STATES = {
+    'activate': 'deploying',
+    'start': 'starting',
+    'stop': 'stopping',
+    'destroy': 'destroying',
+}
+
+FAILED_PREFIX = 'failed: '
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def init_manager(workers=8, per_host=2, journal=None):
+    """
+    Creates and starts the process wide LifecycleManager.
+
+    Args:
+        workers: number of actions that run at the same time.
+        per_host: number of actions that run at the same time against one
+            hypervisor host.
+        journal: the journal.Journal actions are recorded in, or None.
+    """
+    global _manager
+    with _manager_lock:
+        _manager = LifecycleManager(workers, per_host, journal)
+        _manager.start()
+    return _manager
+
+
+def get_manager():
+    """
+    Returns the process wide LifecycleManager, starting it with the default
+    settings on first use.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = LifecycleManager()
+            _manager.start()
+    return _manager
+
+
+def instance_key(nf_config):
+    """
+    Returns the key of the instance described by an nf_config dictionary.
+    """
+    return (nf_config['nf_type'], nf_config['nf_instance_name'])
+
+
+def submit(key, host, action, function, *args):
+    return get_manager().submit(key, host, action, function, *args)
+
+
+def status(key):
+    return get_manager().status(key)
+
+
+def set_status(key, state):
+    get_manager().set_status(key, state)
+
+
+def wait(key, timeout=None):
+    return get_manager().wait(key, timeout)
+
+
+def is_failed(state):
+    return state is not None and state.startswith(FAILED_PREFIX)
+
+
+class _InstanceState(object):
+
+    """
+    Actions of one instance that have not completed yet.
+    """
+    __slots__ = ('status', 'pending', 'idle')
+
+    def __init__(self):
+        self.status = None
+        self.pending = 0
+        self.idle = threading.Event()
+        self.idle.set()
+
+
+class Action(object):
+
+    """
+    A submitted lifecycle action.
+
+    Attributes:
+        key: (nf_type, instance name) of the instance.
+        host: the hypervisor host of the instance.
+        action: name of the action, e.g., activate.
+        done: Event that is set once the action has completed.
+        failure: None if the action succeeded, otherwise the reason it
+            failed. Only meaningful once done is set.
+    """
+    __slots__ = ('key', 'host', 'action', 'function', 'args', 'done',
+                 'failure')
+
+    def __init__(self, key, host, action, function, args):
+        self.key = key
+        self.host = host
+        self.action = action
+        self.function = function
+        self.args = args
+        self.done = threading.Event()
+        self.failure = None
+
+
+class LifecycleManager(object):
+
+    """
+    Runs lifecycle actions on a pool of worker threads and tracks the state
+    of every instance with pending actions.
+
+    Each instance has a FIFO queue of actions of which only the head is
+    scheduled. An action that is scheduled runs as soon as its host has a
+    free slot; otherwise it waits in the host's FIFO queue, behind the
+    actions of other instances on that host.
+    """
+
+    def __init__(self, workers=8, per_host=2, journal=None):
+        self._workers = max(1, workers)
+        self._journal = journal
+        self._per_host = max(1, per_host)
+        self._states = {}
+        # instance key -> deque of its Actions, the head is scheduled
+        self._actions = {}
+        # host -> number of running or ready actions
+        self._host_slots = collections.defaultdict(int)
+        # host -> deque of scheduled Actions waiting for a slot
+        self._host_waiting = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._ready = Queue.Queue()
+
+    def start(self):
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._work,
+                                      name='lifecycle-%d' % i)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, key, host, action, function, *args):
+        """
+        Queues an action.
+
+        Args:
+            key: (nf_type, instance name) of the instance.
+            host: the hypervisor host of the instance.
+            action: name of the action, e.g., activate.
+            function: the function that performs the action.
+            args: arguments of function.
+
+        Returns:
+            The Action.
+        """
+        queued = Action(key, host, action, function, args)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _InstanceState()
+            state.pending += 1
+            state.idle.clear()
+            state.status = TRANSITIONAL_STATES.get(action)
+            actions = self._actions.get(key)
+            if actions is None:
+                actions = self._actions[key] = collections.deque()
+            actions.append(queued)
+            if len(actions) == 1:
+                self._schedule(queued)
+        return queued
+
+    def _schedule(self, queued):
+        # called with the lock held
+        if queued.host in self._host_waiting or \
+                self._host_slots[queued.host] >= self._per_host:
+            self._host_waiting[queued.host].append(queued)
+            return
+        self._host_slots[queued.host] += 1
+        self._ready.put(queued)
+
+    def _release(self, queued):
+        # called with the lock held, after queued has completed
+        host = queued.host
+        self._host_slots[host] -= 1
+        actions = self._actions[queued.key]
+        actions.popleft()
+        if actions:
+            self._schedule(actions[0])
+        else:
+            del self._actions[queued.key]
+        waiting = self._host_waiting.get(host)
+        while waiting and self._host_slots[host] < self._per_host:
+            self._host_slots[host] += 1
+            self._ready.put(waiting.popleft())
+        if waiting is not None and not waiting:
+            del self._host_waiting[host]
+        if not self._host_slots[host]:
+            del self._host_slots[host]
+
+    def status(self, key):
+        """
+        Returns the transitional or failed state of an instance, or None if
+        it has no pending actions and the last one succeeded.
+        """
+        state = self._states.get(key)
+        if state is None:
+            return None
+        return state.status
+
+    def set_status(self, key, status):
+        """
+        Reports the progress of a running action, e.g., 'starting' once an
+        activated VNF has been deployed.
+        """
+        state = self._states.get(key)
+        if state is not None:
+            state.status = status
+
+    def wait(self, key, timeout=None):
+        """
+        Blocks until all actions submitted for an instance have completed.
+
+        Returns:
+            The status of the instance afterwards, i.e., None or
+            'failed: <reason>'. If the timeout expires, the transitional state.
+        """
+        state = self._states.get(key)
+        if state is None:
+            return None
+        state.idle.wait(timeout)
+        return state.status
+
+    def _complete(self, queued, state, failure):
+        key = queued.key
+        with self._lock:
+            self._release(queued)
+            state.pending -= 1
+            if failure is not None:
+                state.status = FAILED_PREFIX + failure
+            elif state.pending == 0:
+                state.status = None
+            if state.pending == 0:
+                state.idle.set()
+                if state.status is None:
+                    del self._states[key]
+        queued.failure = failure
+        queued.done.set()
+
+    def _work(self):
+        while True:
+            queued = self._ready.get()
+            key = queued.key
+            state = self._states[key]
+            state.status = TRANSITIONAL_STATES.get(queued.action)
+            failure = None
+            intent = None
+            try:
+                if self._journal is not None:
+                    intent = self._journal.intent(key, queued.host,
+                                                  queued.action)
+                queued.function(*queued.args)
+            except Exception, ex:
+                failure = ex.__class__.__name__
+                logger.error('Action ' + queued.action + ' of ' + key[1] +
+                             ' (' + key[0] + ') failed: ' + failure)
+            if intent is not None:
+                try:
+                    self._journal.complete(intent, failure)
+                except IOError:
+                    # recovery replays or rolls back the action
+                    pass
+            self._complete(queued, state, failure)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Benchmark of the docker driver against mock docker daemons.
+
+Starts a MockDockerDaemon per host in a separate process, see
+docker_mock.py, and drives the DockerDriver from a number of threads through the phases of the life of a
+set of VNFs:
+
+    activate    deploy and start every VNF
+    status      guest_status reads
+    ip          get_ip reads
+    net_stats   guest_net_stats reads, the network counters
+    stop        stop every VNF
+    destroy     destroy every VNF
+
+The driver, docker-py and requests run unmodified, so changes to the
+connection pool, the inspect cache or the events stream show up in the
+rates. For every phase the report has the throughput and latency
+percentiles of the driver calls, the latency of the remote API calls they
+made as seen by the driver, and the number of requests the daemons received
+per endpoint, e.g., how many inspects the status reads cost:
+
+    python lifecycle_bench.py --vnfs 2000 --hosts 8 --latency 0.002
+
+Options the benchmark does not know, e.g., --latency, are passed on to
+docker_mock.py. The report is JSON, see fuse_bench.py. The driver needs
+docker-py.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import urllib2
+
+import errors
+import fuse_bench
+from hypervisor.docker_driver import DockerDriver
+
+PHASES = ('activate', 'status', 'ip', 'net_stats', 'stop', 'destroy')
+
+# phases that are repeated --reads times per VNF
+READ_PHASES = ('status', 'ip', 'net_stats')
+
+USER = 'bench'
+IMAGE = 'nfio/bench'
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Lifecycle(object):
+
+    """
+    The driver calls of each phase, for VNF number i.
+    """
+
+    def __init__(self, driver, hosts, vnfs):
+        self.driver = driver
+        self.hosts = hosts
+        self.vnfs = vnfs
+
+    def _vnf(self, i):
+        i %= self.vnfs
+        return self.hosts[i % len(self.hosts)], 'vnf-%d' % i
+
+    def activate(self, i):
+        host, name = self._vnf(i)
+        self.driver.deploy(host, USER, IMAGE, name)
+        self.driver.start(host, USER, name)
+
+    def status(self, i):
+        host, name = self._vnf(i)
+        self.driver.guest_status(host, USER, name)
+
+    def ip(self, i):
+        host, name = self._vnf(i)
+        self.driver.get_ip(host, USER, name)
+
+    def net_stats(self, i):
+        host, name = self._vnf(i)
+        self.driver.guest_net_stats(host, USER, name)
+
+    def stop(self, i):
+        host, name = self._vnf(i)
+        self.driver.stop(host, USER, name)
+
+    def destroy(self, i):
+        host, name = self._vnf(i)
+        self.driver.destroy(host, USER, name)
+
+
+def start_daemons(hosts, daemon_args):
+    """
+    Starts the mock daemons in a process of their own, so that they do not
+    compete with the driver for the interpreter lock.
+
+    Returns:
+        A tuple (process, addresses, port).
+    """
+    command = [sys.executable, os.path.join(SRC_DIR, 'docker_mock.py'),
+               '--hosts', str(hosts), '--port', '0'] + list(daemon_args)
+    process = subprocess.Popen(command, cwd=SRC_DIR, stdout=subprocess.PIPE)
+    line = process.stdout.readline().strip()
+    match = re.search(r'port (\d+)$', line)
+    if match is None:
+        if process.poll() is None:
+            process.kill()
+        raise RuntimeError('The mock docker daemons did not start: ' + line)
+    addresses = ['127.0.0.%d' % (i + 1) for i in range(hosts)]
+    return process, addresses, int(match.group(1))
+
+
+def requests_of(addresses, port):
+    """
+    Returns the number of requests all daemons received, per endpoint.
+    """
+    total = collections.Counter()
+    for address in addresses:
+        response = urllib2.urlopen('http://%s:%d/mock/requests' %
+                                   (address, port))
+        try:
+            total.update(json.load(response)['requests'])
+        finally:
+            response.close()
+    return total
+
+
+def benchmark(vnfs=1000, hosts=4, concurrency=16, reads=5, pool_size=10,
+              inspect_ttl=2.0, watch_events=True, daemon_args=()):
+    """
+    Runs the phases against a cluster of mock daemons.
+
+    Args:
+        daemon_args: command line options of docker_mock.py, e.g., to
+            inject latency.
+
+    Returns:
+        The report, a dictionary with the settings of the run and, under
+        'phases', the summary of every phase with the requests it caused.
+    """
+    report = {
+        'commit': fuse_bench.git_commit(),
+        'vnfs': vnfs,
+        'hosts': hosts,
+        'concurrency': concurrency,
+        'reads': reads,
+        'pool_size': pool_size,
+        'inspect_ttl': inspect_ttl,
+        'watch_events': watch_events,
+        'daemon_args': list(daemon_args),
+        'phases': collections.OrderedDict(),
+    }
+    process, addresses, port = start_daemons(hosts, daemon_args)
+    driver = None
+    try:
+        driver = DockerDriver(pool_size, inspect_ttl, watch_events, port)
+        lifecycle = Lifecycle(driver, addresses, vnfs)
+        api_metrics = dict(driver.get_metrics())['docker_api']
+        for phase in PHASES:
+            before = requests_of(addresses, port)
+            api_metrics.reset()
+            iterations = vnfs * reads if phase in READ_PHASES else vnfs
+            summary = fuse_bench.run_op(getattr(lifecycle, phase),
+                                        iterations, concurrency,
+                                        (errors.nfioError,))
+            summary['requests'] = dict(requests_of(addresses, port) - before)
+            summary['api_calls'] = dict(
+                (call, stats['latency']) for call, stats in
+                api_metrics.snapshot()['operations'].items()
+                if stats['calls'])
+            report['phases'][phase] = summary
+    finally:
+        if driver is not None:
+            driver.close()
+        process.terminate()
+        process.wait()
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks the docker driver against mock docker '
+                    'daemons. Unknown options are passed on to '
+                    'docker_mock.py')
+    arg_parser.add_argument(
+        '--vnfs',
+        help='Number of VNFs',
+        type=int,
+        default=1000)
+    arg_parser.add_argument(
+        '--hosts',
+        help='Number of mock daemons, on 127.0.0.1 and up',
+        type=int,
+        default=4)
+    arg_parser.add_argument(
+        '--concurrency',
+        help='Number of threads calling the driver at the same time',
+        type=int,
+        default=16)
+    arg_parser.add_argument(
+        '--reads',
+        help='Number of status, IP and counter reads per VNF',
+        type=int,
+        default=5)
+    arg_parser.add_argument(
+        '--pool_size',
+        help='Maximum number of connections of the driver per host',
+        type=int,
+        default=10)
+    arg_parser.add_argument(
+        '--cache_ttl',
+        help='Seconds the driver reuses an inspect result',
+        type=float,
+        default=2.0)
+    arg_parser.add_argument(
+        '--no_events',
+        help='Do not follow the events of the daemons',
+        action='store_true')
+    arg_parser.add_argument(
+        '--output',
+        help='File to write the JSON report to, instead of stdout')
+    args, daemon_args = arg_parser.parse_known_args()
+    # injected failures are logged by the driver
+    logging.basicConfig(level=logging.CRITICAL)
+    report = benchmark(
+        max(1, args.vnfs), max(1, args.hosts), max(1, args.concurrency),
+        max(0, args.reads), args.pool_size, args.cache_ttl,
+        not args.no_events, daemon_args)
+    text = json.dumps(report, indent=1) + '\n'
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
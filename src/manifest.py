@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Desired state manifests of VNF instances.
+
+A manifest is a JSON document listing the VNF instances that should exist,
+their configuration and the state their VNF should be in:
+
+    {"instances": [
+        {"type": "firewall", "name": "fw1", "host": "10.0.0.1",
+         "image": "nfio/firewall", "status": "running"},
+        {"type": "nginx", "name": "web1", "status": "absent"}]}
+
+A bare list of instances is accepted as well. Besides type and name, an
+instance may set host (or ip), image, vcpu and memory; configuration that is
+not set is left alone. status is one of
+    running     the VNF is deployed and running, the default.
+    stopped     the VNF is deployed but not running.
+    destroyed   the instance exists but its VNF is not deployed.
+    absent      the instance and its VNF do not exist.
+Instances that are not listed are left alone.
+
+plan() compares a manifest with the instance registry and the state of the
+VMs/containers and returns, for each instance, the operations that bring it
+to its desired state. They are run through the batch control file, see
+control_files.py.
+"""
+
+import json
+
+RUNNING = 'running'
+STOPPED = 'stopped'
+DESTROYED = 'destroyed'
+ABSENT = 'absent'
+STATUSES = (RUNNING, STOPPED, DESTROYED, ABSENT)
+
+# configuration of an instance, see instance_registry.VNFInstance
+CONFIG_ATTRIBUTES = ('host', 'image', 'vcpu', 'memory')
+# a deployed VNF has to be redeployed when these change
+REDEPLOY_ATTRIBUTES = ('host', 'image')
+
+# (actual state, desired state) -> actions
+TRANSITIONS = {
+    (DESTROYED, RUNNING): ['activate'],
+    (DESTROYED, STOPPED): ['activate', 'stop'],
+    (STOPPED, RUNNING): ['start'],
+    (STOPPED, DESTROYED): ['destroy'],
+    (RUNNING, STOPPED): ['stop'],
+    (RUNNING, DESTROYED): ['destroy'],
+}
+
+# container states that count as running
+RUNNING_STATES = ('running', 'paused', 'restarting')
+
+
+class DesiredInstance(object):
+
+    """
+    An instance listed in a manifest.
+
+    Attributes:
+        nf_type: type of the VNF, e.g., firewall.
+        name: name of the instance.
+        config: dictionary of VNFInstance attribute -> desired value as a
+            string, for the configuration the manifest sets.
+        status: one of STATUSES.
+    """
+    __slots__ = ('nf_type', 'name', 'config', 'status')
+
+    def __init__(self, nf_type, name, config=None, status=RUNNING):
+        self.nf_type = nf_type
+        self.name = name
+        self.config = config or {}
+        self.status = status
+
+
+def parse_manifest(text):
+    """
+    Parses a manifest.
+
+    Returns:
+        A list of DesiredInstance objects.
+
+    Raises:
+        ValueError if the manifest is not valid.
+    """
+    document = json.loads(text)
+    if isinstance(document, dict):
+        document = document.get('instances')
+    if not isinstance(document, list):
+        raise ValueError('manifest has no list of instances')
+    desired = []
+    seen = set()
+    for item in document:
+        if not isinstance(item, dict) or not item.get('type') or \
+                not item.get('name'):
+            raise ValueError('instance without type or name: ' + repr(item))
+        nf_type = str(item['type'])
+        name = str(item['name'])
+        if (nf_type, name) in seen:
+            raise ValueError('instance listed twice: ' + nf_type + '/' + name)
+        seen.add((nf_type, name))
+        status = str(item.get('status', RUNNING))
+        if status not in STATUSES:
+            raise ValueError('unknown status ' + status + ' of ' + nf_type +
+                             '/' + name)
+        config = {}
+        for key, value in item.items():
+            if key in ('type', 'name', 'status'):
+                continue
+            attribute = 'host' if key == 'ip' else str(key)
+            if attribute not in CONFIG_ATTRIBUTES:
+                raise ValueError('unknown key ' + key + ' of ' + nf_type +
+                                 '/' + name)
+            config[attribute] = str(value)
+        desired.append(DesiredInstance(nf_type, name, config, status))
+    return desired
+
+
+def actual_status(container_status):
+    """
+    Maps the hypervisor's status of a VM/container, '' if it does not exist,
+    to one of RUNNING, STOPPED and DESTROYED.
+    """
+    if not container_status:
+        return DESTROYED
+    if container_status in RUNNING_STATES:
+        return RUNNING
+    return STOPPED
+
+
+def plan_instance(desired, instance, container_status):
+    """
+    Returns the operations that bring one instance to its desired state.
+
+    Args:
+        desired: the DesiredInstance.
+        instance: the instance_registry.VNFInstance, or None if the instance
+            does not exist.
+        container_status: a function returning the hypervisor's status of
+            the VM/container of the instance. It is only called if the
+            instance exists.
+
+    Returns:
+        A list of (op, config) tuples, where op is a batch operation and
+        config the configuration it writes, or an empty list if the instance
+        is in its desired state.
+    """
+    if instance is None:
+        if desired.status == ABSENT:
+            return []
+        steps = [('create', desired.config)]
+        actual = DESTROYED
+    else:
+        actual = actual_status(container_status())
+        if desired.status == ABSENT:
+            return [(op, {}) for op in
+                    TRANSITIONS.get((actual, DESTROYED), [])] + \
+                [('remove', {})]
+        steps = []
+        changed = {}
+        for attribute, value in desired.config.items():
+            current = getattr(instance, attribute)
+            if value != ('' if current is None else str(current)):
+                changed[attribute] = value
+        if changed:
+            if actual != DESTROYED and \
+                    set(changed).intersection(REDEPLOY_ATTRIBUTES):
+                steps.append(('destroy', {}))
+                actual = DESTROYED
+            steps.append(('configure', changed))
+    steps.extend((op, {}) for op in TRANSITIONS.get((actual, desired.status),
+                                                    []))
+    return steps
+
+
+def plan(desired, instances, container_status):
+    """
+    Returns the operations that bring the instances of a manifest to their
+    desired state.
+
+    Args:
+        desired: list of DesiredInstance objects.
+        instances: the instance_registry.InstanceRegistry.
+        container_status: a function (nf_type, name) returning the
+            hypervisor's status of the VM/container of an instance.
+
+    Returns:
+        A list with a plan for every desired instance, in the same order.
+        A plan is a list of (op, nf_type, name, config) tuples.
+    """
+    plans = []
+    for instance in desired:
+        nf_type, name = instance.nf_type, instance.name
+        steps = plan_instance(
+            instance, instances.get(nf_type, name),
+            lambda: container_status(nf_type, name))
+        plans.append([(op, nf_type, name, config) for op, config in steps])
+    return plans
+
+
+def interleave(plans):
+    """
+    Merges the plans of several instances into one list of operations: the
+    first operation of every plan, then the second one, and so on. Running
+    the list in order then queues the first action of every instance before
+    waiting for any of them.
+    """
+    merged = []
+    for depth in range(max([len(steps) for steps in plans] or [0])):
+        merged.extend(steps[depth] for steps in plans if depth < len(steps))
+    return merged
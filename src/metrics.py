@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+"""
+Latency histograms and call counters of nf.io's operations.
+
+Every FUSE upcall is timed where fuse.py dispatches it, so that a slow ls or
+cat can be traced to the upcall, e.g., getattr or readdir, and the VNF type
+responsible. For every operation nf.io counts the calls, the errors by errno
+and the calls in flight, and keeps a latency histogram per operation and per
+VNF type. The numbers can be read from /.nfio/metrics, and are written to
+stderr when nf.io receives SIGUSR1. The hypervisor driver keeps the same
+metrics of its own calls per host, see /.nfio/hypervisor.
+
+The histograms are log-linear, like HdrHistogram: latencies are recorded in
+microseconds into buckets that are exact up to 32us and then split every
+power of two into 16 buckets, so a percentile is within 6.25% of the
+recorded latency whatever its magnitude. Recording a latency costs a few
+integer operations and a dictionary update.
+"""
+
+import errno
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import middlebox_registry
+
+# every power of two is split into 1 << SUB_BUCKET_BITS buckets
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+# percentiles reported, as (name, fraction)
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+# label of calls that do not belong to a VNF type or host
+NO_LABEL = '-'
+
+_fuse_metrics = None
+
+
+def bucket_index(value):
+    """
+    Returns the index of the histogram bucket of a non-negative integer.
+    """
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return ((shift + 1) << SUB_BUCKET_BITS) + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_bounds(index):
+    """
+    Returns the smallest and largest value of a histogram bucket.
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index, index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = (index & (SUB_BUCKETS - 1)) + SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+
+    """
+    A log-linear histogram of latencies in microseconds. Not thread safe;
+    OperationMetrics serializes the updates.
+    """
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """
+        Returns the latency below which a fraction of the recorded latencies
+        fall, as the largest value of its bucket, or 0 if the histogram is
+        empty.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, int(fraction * self.count + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(bucket_bounds(index)[1], self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns a dictionary with the count, mean, percentiles and maximum
+        in microseconds.
+        """
+        summary = {'count': self.count,
+                   'mean_us': self.total / self.count if self.count else 0,
+                   'max_us': self.max}
+        for name, fraction in PERCENTILES:
+            summary[name + '_us'] = self.percentile(fraction)
+        return summary
+
+
+class _OperationStats(object):
+
+    """
+    Counters and histograms of one operation.
+    """
+    __slots__ = ('calls', 'in_flight', 'errors', 'latency', 'by_label')
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        # error name -> number of calls that failed with it
+        self.errors = {}
+        self.latency = LatencyHistogram()
+        # label -> (calls, errors, LatencyHistogram)
+        self.by_label = {}
+
+
+class OperationMetrics(object):
+
+    """
+    Call counts, errors, calls in flight and latency histograms of a set of
+    operations, broken down by a label such as the VNF type.
+    """
+
+    def __init__(self, title, label_name):
+        """
+        Args:
+            title: what the operations are, the first line of format().
+            label_name: what the label of a call is, e.g., type.
+        """
+        self._title = title
+        self._label_name = label_name
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._since = time.time()
+
+    def start(self, op):
+        """
+        Records that a call has started.
+
+        Returns:
+            A token to pass to finish().
+        """
+        with self._lock:
+            stats = self._operations.get(op)
+            if stats is None:
+                stats = self._operations[op] = _OperationStats()
+            stats.in_flight += 1
+        return op, time.time()
+
+    def finish(self, token, label=None, error=None):
+        """
+        Records that a call has finished.
+
+        Args:
+            token: the token returned by start().
+            label: the label of the call, e.g., the VNF type it was for.
+            error: name of the error the call failed with, None if it
+                succeeded.
+
+        Returns:
+            How long the call took, in microseconds.
+        """
+        op, started = token
+        elapsed = int((time.time() - started) * 1000000)
+        if elapsed < 0:
+            elapsed = 0
+        label = label or NO_LABEL
+        with self._lock:
+            stats = self._operations[op]
+            stats.in_flight -= 1
+            stats.calls += 1
+            stats.latency.record(elapsed)
+            by_label = stats.by_label.get(label)
+            if by_label is None:
+                by_label = stats.by_label[label] = [0, 0, LatencyHistogram()]
+            by_label[0] += 1
+            by_label[2].record(elapsed)
+            if error is not None:
+                stats.errors[error] = stats.errors.get(error, 0) + 1
+                by_label[1] += 1
+        return elapsed
+
+    @contextmanager
+    def measure(self, op, label=None):
+        """
+        Records the call made in a with block. An exception the block raises
+        counts as an error named after its class.
+        """
+        token = self.start(op)
+        try:
+            yield
+        except Exception, ex:
+            self.finish(token, label, ex.__class__.__name__)
+            raise
+        self.finish(token, label)
+
+    def reset(self):
+        """
+        Forgets every call that has finished. Calls in flight are kept.
+        """
+        with self._lock:
+            for op, stats in self._operations.items():
+                fresh = self._operations[op] = _OperationStats()
+                fresh.in_flight = stats.in_flight
+            self._since = time.time()
+
+    def snapshot(self):
+        """
+        Returns the metrics as a dictionary that can be serialized as JSON:
+        the start of the period they cover, and for every operation its
+        calls, calls in flight, errors by name, latency summary and, per
+        label, calls, errors and latency summary.
+        """
+        with self._lock:
+            operations = {}
+            for op, stats in self._operations.items():
+                operations[op] = {
+                    'calls': stats.calls,
+                    'in_flight': stats.in_flight,
+                    'errors': dict(stats.errors),
+                    'latency': stats.latency.summary(),
+                    self._label_name: dict(
+                        (label, {'calls': calls, 'errors': errors,
+                                 'latency': latency.summary()})
+                        for label, (calls, errors, latency)
+                        in stats.by_label.items()),
+                }
+            return {'since': self._since, 'operations': operations}
+
+    def format(self):
+        """
+        Returns the metrics as a table: a line per operation, followed by a
+        line per label of the operation and a line per error.
+        """
+        snapshot = self.snapshot()
+        lines = ['%s since %s (%.1fs)' % (
+            self._title,
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                          time.localtime(snapshot['since'])),
+            time.time() - snapshot['since'])]
+        columns = ['%-17s %-16s %9s %7s %8s' % (
+            'op', self._label_name, 'calls', 'errors', 'inflight')]
+        columns.extend('%9s' % (name + '_us') for name, fraction in
+                       PERCENTILES + (('max', 1.0),))
+        lines.append(''.join(columns))
+
+        def row(op, label, calls, errors, in_flight, latency):
+            return '%-17s %-16s %9d %7d %8s' % (
+                op, label, calls, errors, in_flight) + ''.join(
+                    '%9d' % latency[name + '_us'] for name, fraction in
+                    PERCENTILES + (('max', 1.0),))
+
+        for op, stats in sorted(snapshot['operations'].items()):
+            lines.append(row(op, '*', stats['calls'],
+                             sum(stats['errors'].values()),
+                             stats['in_flight'], stats['latency']))
+            for label, by_label in sorted(
+                    stats[self._label_name].items()):
+                lines.append(row('', label, by_label['calls'],
+                                 by_label['errors'], '',
+                                 by_label['latency']))
+        errors = [(op, error, count)
+                  for op, stats in snapshot['operations'].items()
+                  for error, count in stats['errors'].items()]
+        if errors:
+            lines.append('errors:')
+            for op, error, count in sorted(errors):
+                lines.append('%-17s %9d  %s' % (op, count, error))
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True) + '\n'
+
+
+class FuseMetrics(OperationMetrics):
+
+    """
+    Metrics of the FUSE upcalls, labeled with the VNF type of their path.
+    Only types with a middlebox module get a label of their own, so that
+    paths under nf-types cannot add labels without bound. fuse.FUSE reports
+    every upcall to start() and finish() when it is passed an Operations
+    object with a metrics attribute.
+    """
+
+    def __init__(self):
+        super(FuseMetrics, self).__init__('fuse operations', 'type')
+
+    def finish(self, token, path=None, result=0):
+        """
+        Records that an upcall has finished.
+
+        Args:
+            token: the token returned by start().
+            path: the path of the upcall, if it has one.
+            result: the return value passed to libfuse, a negative errno if
+                the upcall failed.
+        """
+        label = None
+        if path:
+            # /nf-types/<type>/... and /.nfio/...
+            tokens = path.split('/', 3)
+            if len(tokens) > 2 and tokens[1] == 'nf-types':
+                if middlebox_registry.get_module(tokens[2]) is not None:
+                    label = tokens[2]
+            elif tokens[1] == '.nfio':
+                label = tokens[1]
+        error = None
+        if isinstance(result, (int, long)) and result < 0:
+            error = errno.errorcode.get(-result, str(-result))
+        return super(FuseMetrics, self).finish(token, label, error)
+
+
+def init_fuse_metrics(enabled=True):
+    """
+    Creates the process wide FuseMetrics, or disables them.
+    """
+    global _fuse_metrics
+    _fuse_metrics = FuseMetrics() if enabled else None
+    return _fuse_metrics
+
+
+def get_fuse_metrics():
+    """
+    Returns the process wide FuseMetrics, or None if they are disabled.
+    """
+    return _fuse_metrics
+
+
+def dump(signum=None, frame=None):
+    """
+    Writes the FUSE metrics to stderr. Installed as the SIGUSR1 handler.
+    """
+    fuse_metrics = _fuse_metrics
+    if fuse_metrics is not None:
+        sys.stderr.write(fuse_metrics.format())
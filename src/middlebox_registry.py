@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Registry of the middlebox modules.
+
+All modules under the middlebox module root are imported and validated once,
+when nf.io is mounted. File system calls then find the module of a VNF type
+with a dictionary lookup instead of importing it by name on every call.
+
+The registry can be reloaded while nf.io is mounted, on SIGHUP or when a
+module file changes, so that new or updated VNF types can be rolled out
+without remounting. A module that fails to load or to validate is left out;
+on reload, the previous version of such a module is kept.
+"""
+
+import importlib
+import logging
+import os
+import pkgutil
+import sys
+import threading
+
+import path_router
+
+logger = logging.getLogger(__name__)
+
+# functions every middlebox module has to provide, see middleboxes/__init__.py
+REQUIRED_FUNCTIONS = ('_getattr', '_read', '_write')
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(module_root='middleboxes'):
+    """
+    Returns the process wide registry. The registry is created and loaded on
+    the first call, from module_root.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MiddleboxRegistry(module_root)
+            _registry.load()
+    return _registry
+
+
+def get_module(nf_type):
+    """
+    Returns the middlebox module of a VNF type, or None.
+    """
+    return get_registry().get(nf_type)
+
+
+class MiddleboxRegistry(object):
+
+    """
+    Loads and validates the middlebox modules of a package and maps each VNF
+    type to its module.
+    """
+
+    def __init__(self, module_root='middleboxes'):
+        """
+        Args:
+            module_root: package containing the middlebox modules. The name of
+                each module is the VNF type it implements.
+        """
+        self._module_root = module_root
+        self._modules = {}
+        self._mtimes = {}
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._stopped = threading.Event()
+
+    def get(self, nf_type):
+        return self._modules.get(nf_type)
+
+    def nf_types(self):
+        return sorted(self._modules)
+
+    def _package_paths(self):
+        package = importlib.import_module(self._module_root)
+        return list(getattr(package, '__path__', []))
+
+    def _source_mtimes(self):
+        mtimes = {}
+        for path in self._package_paths():
+            for file_name in os.listdir(path):
+                if file_name.endswith('.py'):
+                    file_path = os.path.join(path, file_name)
+                    try:
+                        mtimes[file_path] = os.stat(file_path).st_mtime
+                    except OSError:
+                        pass
+        return mtimes
+
+    def _validate(self, name, module):
+        missing = [function for function in REQUIRED_FUNCTIONS
+                   if not callable(getattr(module, function, None))]
+        # an instance skeleton is either declared or built by _mkdir
+        if getattr(module, 'template', None) is None and \
+                not callable(getattr(module, '_mkdir', None)):
+            missing.insert(0, 'template or _mkdir')
+        if missing:
+            logger.error('Middlebox module ' + name + ' does not provide ' +
+                         ', '.join(missing) + '. VNF type ' + name +
+                         ' is not available.')
+            return False
+        return True
+
+    def load(self):
+        """
+        Discovers, imports and validates the modules of the module root.
+        Modules that were loaded before are reloaded from their source.
+
+        Returns:
+            The list of VNF types that are available.
+        """
+        with self._load_lock:
+            mtimes = self._source_mtimes()
+            modules = {}
+            for loader, name, is_package in pkgutil.iter_modules(
+                    self._package_paths()):
+                if is_package or name.startswith('_'):
+                    continue
+                qualified_name = self._module_root + '.' + name
+                previous = self._modules.get(name)
+                try:
+                    if qualified_name in sys.modules:
+                        module = reload(sys.modules[qualified_name])
+                    else:
+                        module = importlib.import_module(qualified_name)
+                except Exception, ex:
+                    logger.error('Failed to load middlebox module ' + name +
+                                 ': ' + str(ex))
+                    if previous is not None:
+                        modules[name] = previous
+                    continue
+                if self._validate(name, module):
+                    modules[name] = module
+                elif previous is not None:
+                    modules[name] = previous
+            self._modules = modules
+            self._mtimes = mtimes
+        # special file handlers of the cached routes may have changed
+        path_router.clear()
+        logger.info('Loaded middlebox modules: ' + ', '.join(sorted(modules)))
+        return sorted(modules)
+
+    def reload(self):
+        """
+        Reloads all modules, e.g., on SIGHUP.
+        """
+        logger.info('Reloading middlebox modules from ' + self._module_root)
+        try:
+            return self.load()
+        except Exception, ex:
+            logger.error('Failed to reload middlebox modules: ' + str(ex))
+            return self.nf_types()
+
+    def changed(self):
+        """
+        Returns True if a module file was added, removed or modified since
+        the last load.
+        """
+        return self._source_mtimes() != self._mtimes
+
+    def watch(self, interval=5.0):
+        """
+        Starts a thread that reloads the modules when their files change.
+
+        Args:
+            interval: seconds between two checks for changed files. An
+                interval of 0 disables watching.
+        """
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch,
+                                         args=(interval,),
+                                         name='middlebox-watcher')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                if self.changed():
+                    self.reload()
+            except Exception, ex:
+                logger.warning('Checking middlebox modules for changes '
+                               'failed: ' + str(ex))
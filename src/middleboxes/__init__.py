@@ -1,10 +1,12 @@
 """
 Each module provides VNF specific implementations for select system calls. Each
 module should provide implementation for the following methods:
-    _mkdir(root, path, mode): Provides implementation of mkdir system call. We
-        redefined mkdir's semantics to create the file/directory structure of a
-        new VNF. A VNF specific implementaion of _mkdir will create that VNF
-        specific file/directory structure.
+    template: An instance_template.InstanceTemplate declaring the
+        file/directory structure of a new VNF. We redefined mkdir's semantics
+        to create that structure; nf.io builds it from the template. Modules
+        that need more control can instead provide
+        _mkdir(root, path, mode), which creates the VNF specific
+        file/directory structure itself.
     _getattr(root, path, fh): Provides implementation of getattr system call. If
         there are any VNF specific special cases for setting attribute of
         certain files that should be handled here.
@@ -15,4 +17,26 @@ module should provide implementation for the following methods:
         call. It implements write operation for VNF specific special files and
         special commands. e.g., writing 'stop' to 'action' file of a VNF stops
         the VNF instance.
+
+All modules of this package are loaded by middlebox_registry when nf.io is
+mounted. A module that lacks one of the methods above is not loaded. Modules
+are reloaded on SIGHUP and when their files change, so module level state
+should not be relied upon across reloads.
+
+A module can optionally provide:
+    _snapshot(root, path): Returns the complete content of a special file as
+        a string, or None if path is not a special file. nf.io calls it once
+        when a special file is opened for reading and serves every read on
+        that file handle from the returned string.
+    _submit_action(root, path, action): Submits a lifecycle action, e.g.,
+        activate, for the instance of the action file path, as writing the
+        action to that file does, and returns the lifecycle.Action. Used by
+        /.nfio/batch to wait for the actions it submits.
+
+Paths should be parsed with path_router.route(path), which returns the VNF
+type, instance and special file handler of a path from a cache.
+
+Statistics files such as rx_bytes should be read through stats_sampler.read
+so that they are served from background samples instead of querying the VNF
+on every read system call.
 """
@@ -1,8 +1,12 @@
-from vnfs_operations import VNFSOperations
+from vnfs_operations import get_vnfs_operations
 import os
+import instance_template
+import lifecycle
+import path_router
 
 special_files = ['rx_bytes', 'tx_bytes', 'pkt_drops', 'status']
 action_files = ['action']
+template = instance_template.DEFAULT_TEMPLATE
 
 
 def full_path(root, partial_path):
@@ -11,17 +15,9 @@ def full_path(root, partial_path):
     return os.path.join(root, partial_path)
 
 
-def _mkdir(root, path, mode):
-    vnfs_ops = VNFSOperations(root)
-    result = vnfs_ops.vnfs_create_vnf_instance(path, mode)
-    return result
-
-
 def _getattr(root, path, fh=None):
-    vnfs_ops = VNFSOperations(root)
     f_path = full_path(root, path)
     st = os.lstat(f_path)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
     return_dictionary = dict()
     return_dictionary['st_atime'] = st.st_atime
     return_dictionary['st_ctime'] = st.st_ctime
@@ -31,57 +27,64 @@ def _getattr(root, path, fh=None):
     return_dictionary['st_nlink'] = st.st_nlink
     return_dictionary['st_size'] = st.st_size
     return_dictionary['st_uid'] = st.st_uid
-    if file_name in special_files:
-        return_dictionary['st_size'] = 1000
+    if path_router.route(path).handler is not None:
+        return_dictionary['st_size'] = 0
     return return_dictionary
 
 
-def _read(root, path, length, offset, fh):
-    f_path = full_path(root, path)
-    vnfs_ops = VNFSOperations(root)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
-    nf_path = ''
-    if file_name in special_files:
-        tokens = f_path.encode('ascii').split('/')
-        last_index_to_keep = tokens.index('nf-types') + 3
-        nf_path = "/".join(tokens[0:last_index_to_keep])
+def _snapshot(root, path):
+    route = path_router.route(path)
+    if route.handler is None:
+        return None
+    vnfs_ops = get_vnfs_operations(root)
+    file_name = route.file_name
+    nf_path = full_path(root, route.instance_path)
     if file_name == "rx_bytes":
         ret_str = vnfs_ops.vnfs_get_rx_bytes(nf_path)
-        if offset >= len(ret_str):
-            ret_str = ''
     elif file_name == 'tx_bytes':
         ret_str = vnfs_ops.vnfs_get_tx_bytes(nf_path)
-        if offset >= len(ret_str):
-            ret_str = ''
     elif file_name == 'pkt_drops':
         ret_str = vnfs_ops.vnfs_get_pkt_drops(nf_path)
-        if offset >= len(ret_str):
-            ret_str = ''
     elif file_name == 'status':
         ret_str = vnfs_ops.vnfs_get_status(nf_path)
-        if offset >= len(ret_str):
-            ret_str = ''
-    else:
+    return ret_str
+
+
+def _read(root, path, length, offset, fh):
+    ret_str = _snapshot(root, path)
+    if ret_str is None:
         os.lseek(fh, offset, os.SEEK_SET)
         ret_str = os.read(fh, length)
+    else:
+        ret_str = ret_str[offset:offset + length]
     return ret_str
 
 
+def _run_action(vnfs_ops, nf_path, action):
+    if action == "activate":
+        vnfs_ops.vnfs_deploy_nf(nf_path)
+    elif action == "stop":
+        vnfs_ops.vnfs_stop_vnf(nf_path)
+    elif action == "start":
+        vnfs_ops.vnfs_start_vnf(nf_path)
+    elif action == "destroy":
+        vnfs_ops.vnfs_destroy_vnf(nf_path)
+
+
+def _submit_action(root, path, action):
+    route = path_router.route(path)
+    vnfs_ops = get_vnfs_operations(root)
+    nf_path = full_path(root, route.instance_path)
+    host = vnfs_ops.vnfs_get_instance(nf_path).host
+    # the action runs in the background, status reports its progress
+    return lifecycle.submit((route.nf_type, route.instance), host, action,
+                            _run_action, vnfs_ops, nf_path, action)
+
+
 def _write(root, path, buf, offset, fh):
-    f_path = full_path(root, path)
-    vnfs_ops = VNFSOperations(root)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
-    if file_name == "action":
-        path_tokens = f_path.split("/")
-        nf_path = "/".join(path_tokens[0:path_tokens.index("nf-types") + 3])
-        if buf.rstrip("\n") == "activate":
-            vnfs_ops.vnfs_deploy_nf(nf_path)
-        elif buf.rstrip("\n") == "stop":
-            vnfs_ops.vnfs_stop_vnf(nf_path)
-        elif buf.rstrip("\n") == "start":
-            vnfs_ops.vnfs_start_vnf(nf_path)
-        elif buf.rstrip("\n") == "destroy":
-            vnfs_ops.vnfs_destroy_vnf(nf_path)
+    route = path_router.route(path)
+    if route.file_name == "action" and route.instance_path is not None:
+        _submit_action(root, path, buf.rstrip("\n"))
         os.lseek(fh, offset, os.SEEK_SET)
         os.write(fh, buf.rstrip("\n"))
         return len(buf)
@@ -3,12 +3,17 @@ Check the documentation in __init__.py for more information on the methods in
 this module.
 """
 
-from vnfs_operations import VNFSOperations
+from vnfs_operations import get_vnfs_operations
 import os
 import logging
 import getpass
 import errno
 import errors
+import instance_registry
+import instance_template
+import lifecycle
+import net_counters
+import path_router
 """
 special_files is a list of files specific to this VNF that requires special
 handling while reading. For example, if a read system call is issued for
@@ -29,6 +34,14 @@ special_files = { 'rx_bytes':'rx_bytes',
                   'command': 'command',
                   'nf_conf': 'nf_conf'}
 
+# statistics files whose values come from the background network counter
+# snapshot (see net_counters). Their st_mtime reports the time of the last
+# snapshot. The per interface files under stats/<interface>/ behave the same.
+sampled_files = ['rx_bytes', 'tx_bytes', 'pkt_drops']
+
+# skeleton of a new instance directory
+template = instance_template.DEFAULT_TEMPLATE
+
 logger = logging.getLogger(__name__)
 
 def full_path(root, partial_path):
@@ -36,30 +49,22 @@ def full_path(root, partial_path):
         partial_path = partial_path[1:]
     return os.path.join(root, partial_path)
 
-def get_nf_config(vnfs_ops, full_nf_path):
-    # nf_path for calling vnfs_op function
-    tokens = full_nf_path.encode('ascii').split('/')
-    last_index_to_keep = tokens.index('nf-types') + 3
-    nf_path = "/".join(tokens[0:last_index_to_keep])
-
-    # get info about nf
-    nf_instance_name, nf_type, host, nf_image_name = vnfs_ops.vnfs_get_instance_configuration(nf_path)
-    return {'nf_image_name':nf_image_name,
-            'nf_instance_name':nf_instance_name,
-            'host':host,
+def get_nf_config(vnfs_ops, route):
+    # get info about nf from the instance registry
+    instance = vnfs_ops.vnfs_get_instance(route.instance_path)
+    return {'nf_image_name':instance.image,
+            'nf_instance_name':instance.name,
+            'nf_type':instance.nf_type,
+            'host':instance.host,
             'username':getpass.getuser()
             }
 
-def _mkdir(root, path, mode):
-    vnfs_ops = VNFSOperations(root)
-    result = vnfs_ops.vnfs_create_vnf_instance(path, mode)
-    return result
-
 def _getattr(root, path, fh=None):
-    vnfs_ops = VNFSOperations(root)
+    vnfs_ops = get_vnfs_operations(root)
+    route = path_router.route(path)
     f_path = full_path(root, path)
     st = os.lstat(f_path)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
+    file_name = route.file_name
     return_dictionary = dict()
     return_dictionary['st_atime'] = st.st_atime
     return_dictionary['st_ctime'] = st.st_ctime
@@ -69,24 +74,41 @@ def _getattr(root, path, fh=None):
     return_dictionary['st_nlink'] = st.st_nlink
     return_dictionary['st_size'] = st.st_size
     return_dictionary['st_uid'] = st.st_uid
-    if file_name in special_files:
-       return_dictionary['st_size'] = 1000
+    is_counter = route.counter is not None
+    # generated files are opened with direct_io; nf.io reports the size of
+    # their last generated content
+    if is_counter or (route.handler is not None and
+            route.handler+'_read' in globals()):
+       return_dictionary['st_size'] = 0
+    if file_name in sampled_files or is_counter:
+        sampled_at = net_counters.sample_time(get_nf_config(vnfs_ops, route))
+        if sampled_at is not None:
+            return_dictionary['st_mtime'] = sampled_at
     return return_dictionary
 
-def _read(root, path, length, offset, fh):
-    f_path = full_path(root, path)
-    vnfs_ops = VNFSOperations(root)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
-    nf_path = ''
+def _snapshot(root, path):
+    route = path_router.route(path)
+    vnfs_ops = get_vnfs_operations(root)
+    file_name = route.file_name
     ret_str = ''
-    if file_name in special_files and special_files[file_name]+'_read' in globals():
+    counter = route.counter
+    if counter is not None:
+        try:
+            nf_config = get_nf_config(vnfs_ops, route)
+            ret_str = net_counters.read_counter(vnfs_ops._hypervisor,
+                nf_config, counter[0], counter[1])
+        except errors.nfioError, ex:
+            logger.error('Failed to read ' + counter[0] + '/' + counter[1] +
+                ' from ' + nf_config['nf_instance_name'] + '@' + nf_config['host'] +
+                ' : ' + ex.__class__.__name__)
+    elif route.handler is not None and route.handler+'_read' in globals():
 
         try:
-            nf_config = get_nf_config(vnfs_ops, f_path)
+            nf_config = get_nf_config(vnfs_ops, route)
             # call the custom read function
             logger.info('Reading ' + file_name  + ' from ' +
                 nf_config['nf_instance_name'] + '@' + nf_config['host'])
-            ret_str = globals()[special_files[file_name]+'_read'](vnfs_ops._hypervisor,
+            ret_str = globals()[route.handler+'_read'](vnfs_ops._hypervisor,
                 nf_config)
             logger.info('Successfully read ' + file_name +
                 ' from ' + nf_config['nf_instance_name'] + '@' + nf_config['host'])
@@ -95,25 +117,31 @@ def _read(root, path, length, offset, fh):
                 ' from ' + nf_config['nf_instance_name'] + '@' + nf_config['host'] +
                 ' : ' + ex.__class__.__name__)
             #raise OSError(ex.errno, os.strerror(ex.errno))
-        if offset >= len(ret_str):
-            ret_str = ''
     else:
+        return None
+    return ret_str
+
+def _read(root, path, length, offset, fh):
+    ret_str = _snapshot(root, path)
+    if ret_str is None:
         os.lseek(fh, offset, os.SEEK_SET)
         ret_str = os.read(fh, length)
+    else:
+        ret_str = ret_str[offset:offset + length]
     return ret_str
 
 def _write(root, path, buf, offset, fh):
-    f_path = full_path(root, path)
-    vnfs_ops = VNFSOperations(root)
-    file_name = vnfs_ops.vnfs_get_file_name(f_path)
+    route = path_router.route(path)
+    vnfs_ops = get_vnfs_operations(root)
+    file_name = route.file_name
     #if file_name == "action":
-    if file_name in special_files and special_files[file_name]+'_write' in globals():
+    if route.handler is not None and route.handler+'_write' in globals():
         try:
-            nf_config = get_nf_config(vnfs_ops, f_path)
+            nf_config = get_nf_config(vnfs_ops, route)
             # call the custom write function
             logger.info('Writing to ' + file_name  + ' in ' +
                 nf_config['nf_instance_name'] + '@' + nf_config['host'])
-            ret_str = globals()[special_files[file_name]+'_write'](vnfs_ops._hypervisor,
+            ret_str = globals()[route.handler+'_write'](vnfs_ops._hypervisor,
                 nf_config, buf.rstrip("\n"))
             logger.info('Successfully wrote ' + file_name +
                 ' in ' + nf_config['nf_instance_name'] + '@' + nf_config['host'])
@@ -130,21 +158,22 @@ def _write(root, path, buf, offset, fh):
         return os.write(fh, buf)
 
 def rx_bytes_read(hypervisor_driver, nf_config):
-    command = "ifconfig eth0 | grep -Eo 'RX bytes:[0-9]+' | cut -d':' -f 2"
-    return hypervisor_driver.execute_in_guest(nf_config['host'],
-              nf_config['username'], nf_config['nf_instance_name'], command)
+    return net_counters.read_counter(hypervisor_driver, nf_config, 'eth0',
+              'rx_bytes')
 
 def tx_bytes_read(hypervisor_driver, nf_config):
-    command = "ifconfig eth0 | grep -Eo 'TX bytes:[0-9]+' | cut -d':' -f 2"
-    return hypervisor_driver.execute_in_guest(nf_config['host'],
-              nf_config['username'], nf_config['nf_instance_name'], command)
+    return net_counters.read_counter(hypervisor_driver, nf_config, 'eth0',
+              'tx_bytes')
 
 def pkt_drops_read(hypervisor_driver, nf_config):
-    command = "ifconfig eth0 | grep -Eo 'RX .* dropped:[0-9]+' | cut -d':' -f 4"
-    return hypervisor_driver.execute_in_guest(nf_config['host'],
-              nf_config['username'], nf_config['nf_instance_name'], command)
+    return net_counters.read_counter(hypervisor_driver, nf_config, 'eth0',
+              'rx_dropped')
 
 def status_read(hypervisor_driver, nf_config):
+    # a pending or failed lifecycle action takes precedence
+    state = lifecycle.status(lifecycle.instance_key(nf_config))
+    if state is not None:
+        return state
     return hypervisor_driver.guest_status(nf_config['host'],
               nf_config['username'], nf_config['nf_instance_name'])
 
@@ -195,27 +224,47 @@ def _nginx_signal(hypervisor_driver, nf_config, signal):
 
 
 def action_write(hypervisor_driver, nf_config, data):
+    # the action runs in the background, status reports its progress
+    return lifecycle.submit(lifecycle.instance_key(nf_config),
+        nf_config['host'], data, run_action, hypervisor_driver, nf_config,
+        data)
+
+def _submit_action(root, path, action):
+    # submits action for the instance of path and returns the lifecycle
+    # Action, like a write of action to the action file
+    vnfs_ops = get_vnfs_operations(root)
+    return action_write(vnfs_ops._hypervisor,
+        get_nf_config(vnfs_ops, path_router.route(path)), action)
+
+def run_action(hypervisor_driver, nf_config, data):
     if data == "activate":
         logger.info('Deploying new VNF instance ' + nf_config['nf_instance_name'] +
             ' @ ' + nf_config['host'])
         nf_id = hypervisor_driver.deploy(nf_config['host'], nf_config['username'],
             nf_config['nf_image_name'], nf_config['nf_instance_name'])
+        instance_registry.get_registry().set_container_id(nf_config['nf_type'],
+            nf_config['nf_instance_name'], nf_id)
         logger.info('VNF deployed, now starting VNF instance ' +
             nf_config['nf_instance_name'] + ' @ ' + nf_config['host'])
+        lifecycle.set_status(lifecycle.instance_key(nf_config), 'starting')
         try:
             hypervisor_driver.start(nf_config['host'], nf_config['username'], nf_config['nf_instance_name'])
             logger.info('Successfully started VNF instance ' +
                 nf_config['nf_instance_name'] + ' @ ' + nf_config['host'])
-        except errors.VNFStartError:
+        except (errors.VNFStartError, errors.HypervisorConnectionError):
+            # a start that timed out or was not attempted because the host is
+            # down leaves the deployed VNF behind just the same
             logger.error('Attempt to start ' + nf_config['nf_instance_name'] +
                 '@' + nf_config['host'] + ' failed. Destroying depoyed VNF.')
             try:
                 hypervisor_driver.destroy(nf_config['host'], nf_config['username'], nf_config['nf_instance_name'])
+                instance_registry.get_registry().set_container_id(
+                    nf_config['nf_type'], nf_config['nf_instance_name'], None)
                 logger.info('Successfully destroyed ' +
                     nf_config['nf_instance_name'] + '@' + nf_config['host'])
                 # the VNF was deployed, but failed to start so...
-                raise errors.VNFDeploymentError
-            except errors.VNFDestroyError:
+                raise errors.VNFDeployError
+            except (errors.VNFDestroyError, errors.HypervisorConnectionError):
               logger.error('Failed to destroy partially activated VNF instance ' +
                   nf_config['nf_instance_name'] + '@' + nf_config['host'] +
                   '. VNF is in inconsistent state.')
@@ -239,6 +288,8 @@ def action_write(hypervisor_driver, nf_config, data):
             '@' + nf_config['host'])
         hypervisor_driver.destroy(nf_config['host'], nf_config['username'],
             nf_config['nf_instance_name'])
+        instance_registry.get_registry().set_container_id(nf_config['nf_type'],
+            nf_config['nf_instance_name'], None)
         logger.info(nf_config['nf_instance_name'] + '@' + nf_config['host'] +
             ' successfully destroyed')
 
@@ -1,5 +1,10 @@
 import os
 import random
+import instance_template
+
+template = instance_template.InstanceTemplate(
+    files=[(file_name, None) for file_name in
+           ['alpha', 'beta', 'gamma', 'kappa', 'omega', 'theta']])
 
 
 def full_path(root, partial):
@@ -8,15 +13,6 @@ def full_path(root, partial):
     return os.path.join(root, partial)
 
 
-def _mkdir(root, path, mode):
-    f_path = full_path(root, path)
-    result = os.mkdir(f_path)
-    file_names = ['alpha', 'beta', 'gamma', 'kappa', 'omega', 'theta']
-    [os.open(f_path + "/" + file_name, os.O_WRONLY | os.O_CREAT, mode) for
-     file_name in file_names]
-    return result
-
-
 def _getattr(root, path, fh=None):
     st = os.lstat(full_path(root, path))
     return_dictionary = dict()
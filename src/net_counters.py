@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Network counters of a VNF from a single snapshot of /proc/net/dev and
+/proc/net/snmp.
+
+The hypervisor driver returns both files unmodified (see
+HypervisorBase.guest_net_stats), either from a single command inside the VNF
+or, for local containers, straight from the host's procfs. They are parsed on
+the host, and every counter of every interface is served from that snapshot,
+so reading all counters of a VNF costs at most one call into the VNF
+regardless of the number of interfaces and counters.
+
+The counters are exposed as a tree under the stats directory of a VNF
+instance:
+    stats/<interface>/<counter>, e.g., stats/eth1/rx_dropped
+    stats/snmp/<protocol>.<counter>, e.g., stats/snmp/Ip.InDiscards
+The tree is built when the stats directory is listed, and the stats sampler
+then keeps it in line with every new snapshot, so looking files up never
+queries the VNF.
+"""
+
+import functools
+import os
+import errno
+import shutil
+
+import stats_sampler
+
+# column names of /proc/net/dev, using the names of the kernel's per
+# interface statistics in /sys/class/net/<interface>/statistics
+DEV_COUNTERS = ['rx_bytes', 'rx_packets', 'rx_errors', 'rx_dropped',
+                'rx_fifo_errors', 'rx_frame_errors', 'rx_compressed',
+                'multicast', 'tx_bytes', 'tx_packets', 'tx_errors',
+                'tx_dropped', 'tx_fifo_errors', 'collisions',
+                'tx_carrier_errors', 'tx_compressed']
+
+SNMP_GROUP = 'snmp'
+
+# name of the sample in stats_sampler shared by all network counters
+SAMPLE_NAME = 'net'
+
+
+def parse_net_dev(text):
+    """
+    Parses the content of /proc/net/dev.
+
+    Returns:
+        A dictionary of interface name -> dictionary of counter name -> int.
+    """
+    interfaces = {}
+    for line in text.splitlines():
+        if ':' not in line:
+            continue
+        iface, values = line.split(':', 1)
+        values = values.split()
+        if len(values) != len(DEV_COUNTERS):
+            continue
+        interfaces[iface.strip()] = dict(zip(DEV_COUNTERS,
+                                             [int(v) for v in values]))
+    return interfaces
+
+
+def parse_snmp(text):
+    """
+    Parses the content of /proc/net/snmp. The file consists of pairs of lines,
+    the first naming the counters of a protocol and the second holding their
+    values.
+
+    Returns:
+        A dictionary of '<protocol>.<counter>' -> int.
+    """
+    counters = {}
+    names = {}
+    for line in text.splitlines():
+        if ':' not in line:
+            continue
+        proto, fields = line.split(':', 1)
+        fields = fields.split()
+        if proto not in names:
+            names[proto] = fields
+            continue
+        for name, value in zip(names.pop(proto), fields):
+            try:
+                counters[proto + '.' + name] = int(value)
+            except ValueError:
+                pass
+    return counters
+
+
+def parse(dev, snmp):
+    """
+    Parses the content of /proc/net/dev and /proc/net/snmp.
+
+    Returns:
+        A dictionary mapping each interface name, and 'snmp', to a dictionary
+        of counter name -> int.
+    """
+    snapshot = parse_net_dev(dev)
+    snapshot[SNMP_GROUP] = parse_snmp(snmp)
+    return snapshot
+
+
+def sample(hypervisor_driver, nf_config):
+    """
+    Takes a counter snapshot of a VNF.
+    """
+    dev, snmp = hypervisor_driver.guest_net_stats(nf_config['host'],
+        nf_config['username'], nf_config['nf_instance_name'])
+    return parse(dev, snmp)
+
+
+def snapshot(hypervisor_driver, nf_config):
+    """
+    Returns the last counter snapshot of a VNF from the stats sampler.
+    """
+    return stats_sampler.read(hypervisor_driver, nf_config, SAMPLE_NAME,
+                              sample)
+
+
+def sample_time(nf_config):
+    return stats_sampler.sample_time(nf_config, SAMPLE_NAME)
+
+
+def read_counter(hypervisor_driver, nf_config, group, counter):
+    """
+    Returns a single counter as the content of its statistics file.
+
+    Args:
+        group: interface name, or 'snmp'.
+        counter: name of the counter within the group.
+
+    Returns:
+        The counter value followed by a newline, or an empty string if the
+        VNF has no such counter.
+    """
+    value = snapshot(hypervisor_driver, nf_config).get(group, {}).get(counter)
+    if value is None:
+        return ''
+    return '%d\n' % value
+
+
+def sync_tree(stats_path, counters, dir_mode=0o755, file_mode=0o444):
+    """
+    Brings the placeholder directories and files of the counter tree in line
+    with a snapshot: creates those of new interfaces and counters, and
+    removes those of interfaces and counters that are gone. Files directly
+    in the stats directory, e.g., rx_bytes, are left alone.
+
+    Args:
+        stats_path: absolute path of the stats directory of an instance.
+        counters: a snapshot as returned by parse().
+    """
+    try:
+        existing = os.listdir(stats_path)
+    except OSError, ex:
+        if ex.errno == errno.ENOENT:
+            # the instance was removed
+            return
+        raise
+    for name in existing:
+        path = os.path.join(stats_path, name)
+        if name not in counters and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+    for group, values in counters.items():
+        group_path = os.path.join(stats_path, group)
+        try:
+            os.mkdir(group_path, dir_mode)
+            present = set()
+        except OSError, ex:
+            if ex.errno != errno.EEXIST:
+                raise
+            present = set(os.listdir(group_path))
+        for counter in present.difference(values):
+            os.remove(os.path.join(group_path, counter))
+        for counter in set(values).difference(present):
+            fd = os.open(os.path.join(group_path, counter),
+                         os.O_WRONLY | os.O_CREAT, file_mode)
+            os.close(fd)
+
+
+def watch_tree(hypervisor_driver, nf_config, stats_path):
+    """
+    Builds the counter tree of a VNF from its last snapshot and has the stats
+    sampler update it with every new snapshot. Called when the stats
+    directory is listed.
+
+    Without a running sampler the VNF is sampled right away. With one, a VNF
+    that has no snapshot yet is sampled in the background and its tree shows
+    up at the next listing.
+    """
+    if stats_sampler.get_sampler() is None:
+        counters = sample(hypervisor_driver, nf_config)
+    else:
+        counters = stats_sampler.watch(
+            nf_config, SAMPLE_NAME, sample,
+            functools.partial(sync_tree, stats_path))
+    if counters is not None:
+        sync_tree(stats_path, counters)
@@ -2,23 +2,94 @@
 
 from __future__ import with_statement
 
+import time
+# startup begins with importing the modules of nf.io, see --startup_trace
+_STARTED = time.time()
+
 import os
 import sys
 import errno
+import signal
+import subprocess
+import threading
 
 import logging
 
 from fuse import FUSE, FuseOSError, Operations
 from hypervisor import hypervisor_factory as hyp_factory
-from vnfs_operations import VNFSOperations
+from vnfs_operations import VNFSOperations, get_vnfs_operations
+import control_files
+import instance_registry
+import instance_template
+import journal
+import lifecycle
+import metrics
+import middlebox_registry
+import path_router
+import reconcile
+import startup_trace
+import stats_sampler
 
 import getpass
 import re
-import importlib
 import argparse
 
 logger = logging.getLogger(__name__)
 
+# Named sets of fuse mount options. The kernel caches the attributes and
+# directory entries returned by getattr/lookup for attr_timeout and
+# entry_timeout seconds, and failed lookups for negative_timeout seconds.
+#   default: libfuse defaults, every stat reaches nf.io after one second.
+#   monitoring: many readers repeatedly stat the mostly static skeleton
+#       files of instances, e.g., ls -l in a polling loop.
+#   provisioning: instances are created and configured at a high rate, so
+#       new entries must show up at once and large config writes should not
+#       be split into page sized requests.
+# Contents of special files are not affected by these timeouts, as they are
+# opened with direct_io, but the kernel keeps serving the cached attributes of
+# e.g. status for up to attr_timeout seconds after an action. Only options
+# libfuse 2 accepts can be used.
+MOUNT_PROFILES = {
+    'default': {},
+    'monitoring': {
+        'attr_timeout': 30.0,
+        'entry_timeout': 30.0,
+        'negative_timeout': 5.0,
+        'max_read': 131072,
+    },
+    'provisioning': {
+        'attr_timeout': 1.0,
+        'entry_timeout': 1.0,
+        'negative_timeout': 0.0,
+        'big_writes': True,
+        'max_write': 131072,
+    },
+}
+
+# files of a VNF instance whose attributes change with the state of the VNF
+LIFECYCLE_FILES = ['', 'status', 'action', 'machine/vm.ip', 'stats',
+                   'stats/rx_bytes', 'stats/tx_bytes', 'stats/pkt_drops']
+
+
+def mount_options(profile, **overrides):
+    """Returns the fuse mount options of a profile.
+
+    Args:
+        profile: name of a profile in MOUNT_PROFILES.
+        overrides: options that take precedence over the profile. Options
+            that are None are ignored.
+
+    Returns:
+        A dictionary of fuse mount options, passed to FUSE() as keyword
+        arguments.
+    """
+    options = dict(MOUNT_PROFILES[profile])
+    for key, value in overrides.items():
+        if value is not None:
+            options[key] = value
+    return options
+
+
 class Nfio(Operations):
 
     def __init__(
@@ -52,8 +123,23 @@ class Nfio(Operations):
         self.root = root
         self.mountpoint = mountpoint
         self.hypervisor = hypervisor
-        self.vnfs_ops = VNFSOperations(root)
         self.module_root = module_root
+        self.middleboxes = middlebox_registry.get_registry(module_root)
+        self.instances = instance_registry.get_registry(root)
+        # content of special files, generated once when the file is opened,
+        # keyed by file handle
+        self._snapshots = {}
+        # size of the last snapshot of each special file, reported by getattr;
+        # entries are dropped when their file is removed or renamed
+        self._content_sizes = {}
+        # the /.nfio directory
+        self.control = control_files.get_control_files(self)
+        # reported every FUSE operation by fuse.FUSE, None if disabled
+        self.metrics = metrics.get_fuse_metrics()
+
+    @property
+    def vnfs_ops(self):
+        return get_vnfs_operations(self.root)
 
     # Helpers
     # =======
@@ -76,10 +162,68 @@ class Nfio(Operations):
         path = os.path.join(self.root, partial)
         return path
 
+    def _middlebox(self, nf_type):
+        """Returns the middlebox module of a VNF type.
+
+        Raises:
+            FuseOSError(ENOSYS) if no valid module implements the VNF type.
+        """
+        mbox_module = self.middleboxes.get(nf_type)
+        if mbox_module is None:
+            logger.error('VNF module file missing. Add "' + nf_type
+                + '.py" under the directory ' + self.module_root)
+            raise FuseOSError(errno.ENOSYS)
+        return mbox_module
+
+    def _update_instance(self, route):
+        """Updates the in-memory record of a VNF instance after one of its
+        configuration files, e.g., machine/ip, was modified.
+        """
+        if route.file in instance_registry.CONFIG_FILES:
+            self.instances.update(route.nf_type, route.instance, route.file)
+
+    def _wait_for_actions(self, route):
+        """Blocks until all lifecycle actions written to an instance so far
+        have completed.
+
+        Raises:
+            FuseOSError(EIO) if the last action failed.
+        """
+        state = lifecycle.wait((route.nf_type, route.instance))
+        if lifecycle.is_failed(state):
+            raise FuseOSError(errno.EIO)
+
+    def _forget_content_sizes(self, path):
+        """Drops the recorded snapshot sizes of a file, or of a directory and
+        every file below it.
+        """
+        prefix = path.rstrip('/') + '/'
+        for known in self._content_sizes.keys():
+            if known == path or known.startswith(prefix):
+                self._content_sizes.pop(known, None)
+
+    def _forget_instance_sizes(self, path):
+        """Drops the recorded snapshot sizes of the files of a VNF instance
+        that a lifecycle action changes, so that the next stat does not
+        report the size of content generated before the action.
+
+        Args:
+            path: path of any file of the instance.
+        """
+        instance_path = path_router.route(path).instance_path
+        for name in LIFECYCLE_FILES:
+            self._content_sizes.pop(
+                os.path.join(instance_path, name).rstrip('/'), None)
+
     # Filesystem methods
     # ==================
 
+    def init(self, path):
+        startup_trace.finish('mount')
+
     def access(self, path, mode):
+        if path_router.route(path).opcode == path_router.OP_CONTROL:
+            return 0
         full_path = self._full_path(path)
         if not os.access(full_path, mode):
             raise FuseOSError(errno.EACCES)
@@ -110,29 +254,27 @@ class Nfio(Operations):
                 st_size:    Size of the file in bytes
                 st_uid:     User id of the file owner
         Note:
-            For special placeholder files for VNFs, st_size is set to a
-            constant 1000. This is to make sure read utilities such as cat work
-            for these special placeholder files.
+            Special placeholder files for VNFs are opened with direct_io, so
+            their st_size does not limit reads. It reports the size of the
+            content of the open file handle fh, or else the size of the
+            content generated the last time the file was opened, or 0.
         """
-        opcode = self.vnfs_ops.vnfs_get_opcode(path)
-        if opcode == VNFSOperations.OP_NF:
-            nf_type = self.vnfs_ops.vnfs_get_nf_type(path)
+        route = path_router.route(path)
+        if route.opcode == path_router.OP_CONTROL:
+            return self.control.getattr(route)
+        if route.opcode == VNFSOperations.OP_NF:
+            nf_type = route.nf_type
             if len(nf_type) > 0:
-                try:
-                    mbox_module = importlib.import_module(
-                        self.module_root +
-                        "." +
-                        nf_type)
-                except ImportError:
-                    logger.error('VNF module file missing. Add "' + nf_type 
-                        + '.py" under the directory ' + self.module_root)
-                    ## TODO: raise an custom exception and handle it in a OS 
-                    ## specific way
-                    raise OSError(errno.ENOSYS)
-                return mbox_module._getattr(self.root, path, fh)
+                mbox_module = self._middlebox(nf_type)
+                attrs = mbox_module._getattr(self.root, path, fh)
+                content = self._snapshots.get(fh)
+                if content is not None:
+                    attrs['st_size'] = len(content)
+                elif path in self._content_sizes:
+                    attrs['st_size'] = self._content_sizes[path]
+                return attrs
         full_path = self._full_path(path)
         st = os.lstat(full_path)
-        file_name = self.vnfs_ops.vnfs_get_file_name(full_path)
         return dict(
             (key,
              getattr(
@@ -148,12 +290,31 @@ class Nfio(Operations):
                 'st_uid'))
 
     def readdir(self, path, fh):
+        route = path_router.route(path)
+        if route.opcode == path_router.OP_CONTROL:
+            for entry in self.control.readdir(route):
+                yield entry
+            return
         full_path = self._full_path(path)
+        if route.file == 'stats':
+            # the stats/<interface>/ directories follow the last counter
+            # snapshot; lookups under stats/ never query the VNF
+            try:
+                self.vnfs_ops.vnfs_watch_net_counters(route.instance_path)
+            except Exception, ex:
+                logger.debug('No network counters for ' + path + ' : ' +
+                             ex.__class__.__name__)
         dirents = ['.', '..']
+        if path == '/':
+            dirents.append(path_router.CONTROL_DIR)
         if os.path.isdir(full_path):
             dirents.extend(os.listdir(full_path))
+        if path == '/' and journal.JOURNAL_NAME in dirents:
+            dirents.remove(journal.JOURNAL_NAME)
         for entry in dirents:
-            yield entry
+            # instances that are still being built
+            if not instance_template.is_partial(entry):
+                yield entry
 
     def readlink(self, path):
         pathname = os.readlink(self._full_path(path))
@@ -166,7 +327,12 @@ class Nfio(Operations):
 
     def rmdir(self, path):
         full_path = self._full_path(path)
-        return os.rmdir(full_path)
+        result = os.rmdir(full_path)
+        self._forget_content_sizes(path)
+        route = path_router.route(path)
+        if route.is_instance_dir():
+            self.instances.remove(route.nf_type, route.instance)
+        return result
 
     def mkdir(self, path, mode):
         """
@@ -182,24 +348,31 @@ class Nfio(Operations):
             directory then errno.EPERM is returned. Otherwise the return code is
             same as os.mkdir()'s return code.
         """
-        opcode = self.vnfs_ops.vnfs_get_opcode(path)
+        route = path_router.route(path)
+        opcode = route.opcode
         if opcode == VNFSOperations.OP_NF:
-            nf_type = self.vnfs_ops.vnfs_get_nf_type(path)
+            nf_type = route.nf_type
             # Check if this directory is an instance directory or a type
             # directory
-            path_tokens = path.split("/")
-            if path_tokens.index("nf-types") == len(path_tokens) - 2:
+            if route.instance_path is None:
                 return os.mkdir(self._full_path(path), mode)
-            mbox_module = importlib.import_module(
-                self.module_root +
-                "." +
-                nf_type)
-            result = mbox_module._mkdir(self.root, path, mode)
+            mbox_module = self._middlebox(nf_type)
+            template = getattr(mbox_module, 'template', None)
+            if template is not None:
+                result = template.create(self._full_path(path), mode)
+            else:
+                result = mbox_module._mkdir(self.root, path, mode)
+            if route.is_instance_dir():
+                self.instances.reload(nf_type, route.instance)
         elif opcode == VNFSOperations.OP_UNDEFINED:
             result = errno.EPERM
+        else:
+            raise FuseOSError(errno.EPERM)
         return result
 
     def statfs(self, path):
+        if path_router.route(path).opcode == path_router.OP_CONTROL:
+            path = '/'
         full_path = self._full_path(path)
         stv = os.statvfs(full_path)
         return dict(
@@ -219,13 +392,23 @@ class Nfio(Operations):
                 'f_namemax'))
 
     def unlink(self, path):
-        return os.unlink(self._full_path(path))
+        result = os.unlink(self._full_path(path))
+        self._forget_content_sizes(path)
+        return result
 
     def symlink(self, name, target):
         return os.symlink(self._full_path(target), name)
 
     def rename(self, old, new):
-        return os.rename(self._full_path(old), self._full_path(new))
+        result = os.rename(self._full_path(old), self._full_path(new))
+        for path in (old, new):
+            self._forget_content_sizes(path)
+            route = path_router.route(path)
+            if route.is_instance_dir():
+                self.instances.reload(route.nf_type, route.instance)
+            elif route.instance_path is not None:
+                self._update_instance(route)
+        return result
 
     def link(self, target, name):
         return os.link(self._full_path(target), self._full_path(name))
@@ -236,15 +419,63 @@ class Nfio(Operations):
     # File methods
     # ============
 
-    def open(self, path, flags):
-        full_path = self._full_path(path)
-        return os.open(full_path, flags)
+    def open(self, path, fi):
+        """
+        Opens a file. If the file is a special file of a VNF and is opened for
+        reading, its content is generated once by the VNF module's _snapshot
+        function and kept with the file handle until the file is released.
+        All reads on the handle are served from that snapshot.
 
-    def create(self, path, mode, fi=None):
+        Special files are opened with direct_io so that the kernel neither
+        caches their content nor limits reads to their reported size. All
+        other files are opened with keep_cache, so repeated reads of e.g.
+        config/boot.conf are served from the kernel's page cache.
+
+        Args:
+            path: path of the file to open
+            fi: fuse_file_info of the open request. fi.flags holds the open
+                flags; fi.fh, fi.direct_io and fi.keep_cache are set here.
+
+        Returns:
+            0. The file descriptor of the backing file is stored in fi.fh.
+        """
+        route = path_router.route(path)
+        if route.opcode == path_router.OP_CONTROL:
+            return self.control.open(route, fi)
+        full_path = self._full_path(path)
+        fh = os.open(full_path, fi.flags)
+        fi.fh = fh
+        is_special = False
+        nf_type = route.nf_type
+        if route.opcode == VNFSOperations.OP_NF and len(nf_type) > 0:
+            mbox_module = self._middlebox(nf_type)
+            is_special = route.handler is not None
+            if hasattr(mbox_module, '_snapshot') and \
+                    fi.flags & (os.O_WRONLY | os.O_RDWR) != os.O_WRONLY:
+                try:
+                    content = mbox_module._snapshot(self.root, path)
+                except:
+                    os.close(fh)
+                    raise
+                if content is not None:
+                    is_special = True
+                    self._snapshots[fh] = content
+                    self._content_sizes[path] = len(content)
+        if is_special:
+            fi.direct_io = 1
+        else:
+            fi.keep_cache = 1
+        return 0
+
+    def create(self, path, mode, fi):
+        route = path_router.route(path)
+        if route.opcode == path_router.OP_CONTROL:
+            return self.control.open(route, fi)
         full_path = self._full_path(path)
-        return os.open(full_path, os.O_WRONLY | os.O_CREAT, mode)
+        fi.fh = os.open(full_path, os.O_WRONLY | os.O_CREAT, mode)
+        return 0
 
-    def read(self, path, length, offset, fh):
+    def read(self, path, length, offset, fi):
         """
         Reads an open file. This nfio specific implementation parses path to see
         if the read is from any VNF or not. In case the read is from a VNF, the
@@ -255,7 +486,8 @@ class Nfio(Operations):
             path: path represents the path of the file to read from
             length: number of bytes to read from the file
             offset: byte offset indicating the starting byte to read from
-            fh: file descriptor of the open file represented by path
+            fi: fuse_file_info of the open file represented by path. fi.fh
+                is the file descriptor of the backing file.
 
         Returns:
             length bytes from offset byte of the file represented by fh and path
@@ -264,22 +496,25 @@ class Nfio(Operations):
             VNFs can have special files which are placeholders for statistics
             such as number of received/sent bytes etc. VNFs provide their own
             implementation of read and handle reading of these special
-            placeholder files.
+            placeholder files. If the special file's content was captured
+            when it was opened, the read is served from that snapshot.
         """
-        full_path = self._full_path(path)
-        opcode = self.vnfs_ops.vnfs_get_opcode(full_path)
-        file_name = self.vnfs_ops.vnfs_get_file_name(full_path)
-        if opcode == self.vnfs_ops.OP_NF:
-            nf_type = self.vnfs_ops.vnfs_get_nf_type(path)
-            mbox_module = importlib.import_module(
-                self.module_root +
-                "." +
-                nf_type)
+        fh = fi.fh
+        content = self._snapshots.get(fh)
+        if content is not None:
+            return content[offset:offset + length]
+        control = self.control.get(fh)
+        if control is not None:
+            return control.read(length, offset)
+        route = path_router.route(path)
+        if route.opcode == VNFSOperations.OP_NF:
+            nf_type = route.nf_type
+            mbox_module = self._middlebox(nf_type)
             return mbox_module._read(self.root, path, length, offset, fh)
         os.lseek(fh, offset, os.SEEK_SET)
         return os.read(fh, length)
 
-    def write(self, path, buf, offset, fh):
+    def write(self, path, buf, offset, fi):
         """
         Write to an open file. In this nfio specific implementation the path is
         parsed to see if the write is for any specific VNF or not. If the write
@@ -290,7 +525,8 @@ class Nfio(Operations):
             path: path to the file to write
             buf: the data to write
             offset: the byte offset at which the write should begin
-            fh: file descriptor of the open file represented by path
+            fi: fuse_file_info of the open file represented by path. fi.fh
+                is the file descriptor of the backing file.
 
         Returns:
             Returns the number of bytes written to the file starting at offset
@@ -299,38 +535,127 @@ class Nfio(Operations):
             VNFs can have special files where writing specific strings trigger
             a specific function. For example, writing 'activate' to the 'action'
             file of a VNF will start the VNF. VNF specific modules handle such
-            special cases of writing.
+            special cases of writing. Actions run in the background; a write
+            to an action file opened with O_SYNC waits for them to complete.
         """
-        opcode = self.vnfs_ops.vnfs_get_opcode(path)
-        full_path = self._full_path(path)
-        file_name = self.vnfs_ops.vnfs_get_file_name(path)
-        if opcode == VNFSOperations.OP_NF:
-            nf_type = self.vnfs_ops.vnfs_get_nf_type(full_path)
-            mbox_module = importlib.import_module(
-                self.module_root +
-                "." +
-                nf_type)
-            return mbox_module._write(self.root, path, buf, offset, fh)
+        fh = fi.fh
+        control = self.control.get(fh)
+        if control is not None:
+            return control.write(buf, offset)
+        route = path_router.route(path)
+        if route.opcode == VNFSOperations.OP_NF:
+            nf_type = route.nf_type
+            mbox_module = self._middlebox(nf_type)
+            result = mbox_module._write(self.root, path, buf, offset, fh)
+            if route.file_name == 'action' and route.instance_path:
+                self._forget_instance_sizes(path)
+                if fi.flags & os.O_SYNC == os.O_SYNC:
+                    self._wait_for_actions(route)
+            else:
+                self._update_instance(route)
+            return result
 
         os.lseek(fh, offset, os.SEEK_SET)
         return os.write(fh, buf)
 
-    def truncate(self, path, length, fh=None):
+    def submit_action(self, path, action):
+        """
+        Runs a lifecycle action as writing it to an action file does, and
+        returns a handle to wait for it.
+
+        Args:
+            path: path of the action file of an instance.
+            action: the action, e.g., activate.
+
+        Returns:
+            The lifecycle.Action, or None if the middlebox module has no
+            _submit_action, in which case nothing was done.
+        """
+        route = path_router.route(path)
+        mbox_module = self._middlebox(route.nf_type)
+        if not hasattr(mbox_module, '_submit_action'):
+            return None
+        queued = mbox_module._submit_action(self.root, path, action)
+        with open(self._full_path(path), 'w') as action_file:
+            action_file.write(action)
+        self._forget_instance_sizes(path)
+        return queued
+
+    def truncate(self, path, length, fi=None):
+        if path_router.route(path).opcode == path_router.OP_CONTROL:
+            # a new request is started by writing to a handle
+            return
         full_path = self._full_path(path)
         with open(full_path, 'r+') as f:
             f.truncate(length)
+        route = path_router.route(path)
+        if route.instance_path is not None:
+            self._update_instance(route)
+
+    def flush(self, path, fi):
+        control = self.control.get(fi.fh)
+        if control is not None:
+            return control.flush()
+        return os.fsync(fi.fh)
+
+    def release(self, path, fi):
+        if self.control.get(fi.fh) is not None:
+            return self.control.release(fi.fh)
+        self._snapshots.pop(fi.fh, None)
+        return os.close(fi.fh)
+
+    def fsync(self, path, fdatasync, fi):
+        result = self.flush(path, fi)
+        route = path_router.route(path)
+        if route.file_name == 'action' and route.instance_path:
+            self._wait_for_actions(route)
+        return result
 
-    def flush(self, path, fh):
-        return os.fsync(fh)
-
-    def release(self, path, fh):
-        return os.close(fh)
 
-    def fsync(self, path, fdatasync, fh):
-        return self.flush(path, fh)
+def serve(operations, mountpoint, signal_handlers=None, **fuse_options):
+    """Mounts the file system and serves requests until it is unmounted.
+
+    Python only runs signal handlers in the main thread, between two
+    bytecodes, while fuse_main blocks the thread calling it in libfuse. FUSE
+    therefore runs in its own thread and the main thread waits for it, so
+    that signal handlers run while the file system is mounted. SIGINT and
+    SIGTERM unmount the file system.
+
+    Args:
+        operations: the Operations object implementing the file system.
+        mountpoint: the directory to mount the file system on.
+        signal_handlers: dictionary of signal number -> handler(signum,
+            frame) to install while the file system is mounted.
+        fuse_options: keyword arguments of FUSE().
+    """
+    def unmount(signum, frame):
+        logger.info('Unmounting ' + mountpoint)
+        subprocess.call(['fusermount', '-u', '-z', mountpoint])
+
+    handlers = {signal.SIGINT: unmount, signal.SIGTERM: unmount}
+    handlers.update(signal_handlers or {})
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+    failures = []
+
+    def run():
+        try:
+            FUSE(operations, mountpoint, **fuse_options)
+        except Exception, ex:
+            failures.append(ex)
+
+    fuse_thread = threading.Thread(target=run, name='fuse')
+    fuse_thread.daemon = True
+    fuse_thread.start()
+    while fuse_thread.is_alive():
+        fuse_thread.join(1.0)
+    if failures:
+        raise failures[0]
 
 
 def nfio_main():
+    imported = time.time()
     arg_parser = argparse.ArgumentParser(
         description="nf.io File System for NFV Orchestration",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -344,23 +669,211 @@ def nfio_main():
         required=True)
     arg_parser.add_argument(
         '--hypervisor',
-        help='Hypervisor to use for VNF deployment (DockerDriver/Libvirt)',
+        help='Hypervisor to use for VNF deployment (' +
+             '/'.join(sorted(hyp_factory.DRIVERS)) + '). Only the driver '
+             'of this hypervisor is imported',
         default="DockerDriver")
+    arg_parser.add_argument(
+        '--hypervisor_pool_size',
+        help='Maximum number of concurrent connections kept open to each '
+             'hypervisor host. Should match the number of fuse threads',
+        type=int,
+        default=10)
+    arg_parser.add_argument(
+        '--hypervisor_cache_ttl',
+        help='Seconds a VNF state lookup from the hypervisor is reused',
+        type=float,
+        default=2.0)
+    arg_parser.add_argument(
+        '--no_hypervisor_events',
+        help='Do not follow hypervisor events; query VNF status and IP '
+             'from the hypervisor on every read instead',
+        action='store_true')
+    arg_parser.add_argument(
+        '--hypervisor_failure_threshold',
+        help='Number of calls to a hypervisor host that fail in a row after '
+             'which the host is considered down and calls to it fail at '
+             'once. 0 never considers a host down',
+        type=int,
+        default=3)
+    arg_parser.add_argument(
+        '--hypervisor_retry_interval',
+        help='Seconds between two calls that check whether a hypervisor '
+             'host that is down is back',
+        type=float,
+        default=10.0)
+    arg_parser.add_argument(
+        '--sim_latency',
+        help='Mean seconds every call of the Simulated hypervisor takes',
+        type=float,
+        default=0.0)
+    arg_parser.add_argument(
+        '--sim_latency_distribution',
+        help='Distribution of the latency of the Simulated hypervisor',
+        choices=['constant', 'uniform', 'exponential'],
+        default='constant')
+    arg_parser.add_argument(
+        '--sim_call_latency',
+        help='Mean latency of individual calls of the Simulated '
+             'hypervisor, e.g., deploy=0.5,guest_status=0')
+    arg_parser.add_argument(
+        '--sim_failure_rate',
+        help='Probability that a lifecycle call or command of the Simulated '
+             'hypervisor fails',
+        type=float,
+        default=0.0)
+    arg_parser.add_argument(
+        '--sim_call_failure_rate',
+        help='Failure probability of individual calls of the Simulated '
+             'hypervisor, e.g., deploy=0.1,list_guests=0.01')
+    arg_parser.add_argument(
+        '--sim_seed',
+        help='Seed of the Simulated hypervisor, for repeatable runs',
+        type=int)
+    arg_parser.add_argument(
+        '--stats_interval',
+        help='Seconds between two background samples of a VNF statistic. '
+             '0 queries the VNF on every read instead',
+        type=float,
+        default=5.0)
+    arg_parser.add_argument(
+        '--stats_workers',
+        help='Number of threads sampling VNF statistics concurrently',
+        type=int,
+        default=4)
+    arg_parser.add_argument(
+        '--mount_profile',
+        help='Set of fuse mount options (%s). The options below override '
+             'the profile' % '/'.join(sorted(MOUNT_PROFILES)),
+        choices=sorted(MOUNT_PROFILES),
+        default='default')
+    arg_parser.add_argument(
+        '--attr_timeout',
+        help='Seconds the kernel caches file attributes',
+        type=float)
+    arg_parser.add_argument(
+        '--entry_timeout',
+        help='Seconds the kernel caches directory entries',
+        type=float)
+    arg_parser.add_argument(
+        '--negative_timeout',
+        help='Seconds the kernel caches failed lookups',
+        type=float)
+    arg_parser.add_argument(
+        '--max_read',
+        help='Maximum size of a read request in bytes',
+        type=int)
+    arg_parser.add_argument(
+        '--max_write',
+        help='Maximum size of a write request in bytes (needs --big_writes '
+             'with libfuse 2)',
+        type=int)
+    arg_parser.add_argument(
+        '--big_writes',
+        help='Allow write requests larger than a page',
+        action='store_true',
+        default=None)
     arg_parser.add_argument(
         '--middlebox_module_root',
         help='Module directory inside the source tree containing middlebox specific implementation of system calls',
         default='middleboxes')
+    arg_parser.add_argument(
+        '--middlebox_reload_interval',
+        help='Seconds between two checks for changed middlebox modules, '
+             'which are then reloaded. 0 disables the check; modules are '
+             'still reloaded on SIGHUP',
+        type=float,
+        default=5.0)
+    arg_parser.add_argument(
+        '--lifecycle_workers',
+        help='Number of lifecycle actions, e.g., activate, that run at the '
+             'same time',
+        type=int,
+        default=8)
+    arg_parser.add_argument(
+        '--lifecycle_per_host',
+        help='Number of lifecycle actions that run at the same time against '
+             'one hypervisor host',
+        type=int,
+        default=2)
+    arg_parser.add_argument(
+        '--no_journal',
+        help='Do not record lifecycle actions in a journal. Actions that are '
+             'interrupted by a crash are then not recovered',
+        action='store_true')
+    arg_parser.add_argument(
+        '--reconcile_timeout',
+        help='Seconds to wait at mount time for the hosts of the instances '
+             'to list their VMs/containers. 0 disables reconciliation',
+        type=float,
+        default=10.0)
+    arg_parser.add_argument(
+        '--reconcile_workers',
+        help='Number of hosts listed at the same time during '
+             'reconciliation',
+        type=int,
+        default=16)
+    arg_parser.add_argument(
+        '--path_cache_size',
+        help='Number of parsed paths to keep',
+        type=int,
+        default=4096)
+    arg_parser.add_argument(
+        '--no_fuse_metrics',
+        help='Do not count and time the FUSE operations. With metrics, '
+             '/.nfio/metrics reports them and SIGUSR1 prints them',
+        action='store_true')
+    arg_parser.add_argument(
+        '--startup_trace',
+        help='Print how long each phase of the startup took, from importing '
+             'modules to the file system being mounted',
+        action='store_true')
     arg_parser.add_argument(
         '--log_level',
         help='[debug|info|warning|error]',
         default='info')
 
     args = arg_parser.parse_args()
+    startup_trace.start(_STARTED, args.startup_trace)
+    startup_trace.mark('imports', imported)
+    startup_trace.mark('arguments')
     root = args.nfio_root
+    instance_template.remove_partial_instances(root)
+    startup_trace.mark('partial instances')
     mountpoint = args.nfio_mount
     hypervisor = args.hypervisor
-    hypervisor_factory = hyp_factory.HypervisorFactory(hypervisor)
+    driver_options = {}
+    if hypervisor == 'DockerDriver':
+        driver_options['pool_size'] = args.hypervisor_pool_size
+        driver_options['inspect_ttl'] = args.hypervisor_cache_ttl
+        driver_options['watch_events'] = not args.no_hypervisor_events
+        driver_options['failure_threshold'] = \
+            args.hypervisor_failure_threshold
+        driver_options['retry_interval'] = args.hypervisor_retry_interval
+    elif hypervisor == 'Simulated':
+        from hypervisor.simulated_driver import parse_call_values
+        driver_options['latency'] = args.sim_latency
+        driver_options['latency_distribution'] = args.sim_latency_distribution
+        driver_options['call_latency'] = parse_call_values(
+            args.sim_call_latency)
+        driver_options['failure_rate'] = args.sim_failure_rate
+        driver_options['call_failure_rate'] = parse_call_values(
+            args.sim_call_failure_rate)
+        driver_options['seed'] = args.sim_seed
+    hypervisor_factory = hyp_factory.HypervisorFactory(hypervisor,
+                                                       **driver_options)
+    startup_trace.mark('hypervisor driver')
     module_root = args.middlebox_module_root
+    path_router.init_router(args.path_cache_size)
+    action_journal = None
+    if not args.no_journal:
+        action_journal, interrupted = journal.open_journal(root)
+        startup_trace.mark('journal')
+    lifecycle.init_manager(args.lifecycle_workers, args.lifecycle_per_host,
+                           action_journal)
+    stats_sampler.init_sampler(
+        hyp_factory.HypervisorFactory.get_hypervisor_instance(),
+        args.stats_interval, args.stats_workers)
 
     # set the logging level
     LOG_LEVELS = {'debug':logging.DEBUG,
@@ -378,14 +891,43 @@ def nfio_main():
     FORMAT = "[%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s"
     logging.basicConfig(format=FORMAT)
 
-    FUSE(
-        Nfio(
-            root,
-            mountpoint,
-            hypervisor,
-            module_root),
+    fuse_options = mount_options(
+        args.mount_profile,
+        attr_timeout=args.attr_timeout,
+        entry_timeout=args.entry_timeout,
+        negative_timeout=args.negative_timeout,
+        max_read=args.max_read,
+        max_write=args.max_write,
+        big_writes=args.big_writes)
+    logger.info('Mounting with options: ' + str(fuse_options))
+
+    metrics.init_fuse_metrics(not args.no_fuse_metrics)
+    startup_trace.mark('workers')
+
+    nfio = Nfio(root, mountpoint, hypervisor, module_root)
+    nfio.middleboxes.watch(args.middlebox_reload_interval)
+    startup_trace.mark('registries')
+    if action_journal is not None:
+        journal.recover(nfio, action_journal, interrupted)
+        startup_trace.mark('recovery')
+    if args.reconcile_timeout > 0:
+        reconcile.init_reconciler(
+            nfio.instances,
+            hyp_factory.HypervisorFactory.get_hypervisor_instance(),
+            args.reconcile_workers,
+            args.reconcile_timeout).run()
+        startup_trace.mark('reconciliation')
+    signal_handlers = {
+        signal.SIGHUP: lambda signum, frame: nfio.middleboxes.reload()}
+    if nfio.metrics is not None:
+        signal_handlers[signal.SIGUSR1] = metrics.dump
+    serve(
+        nfio,
         mountpoint,
-        foreground=True)
+        signal_handlers,
+        raw_fi=True,
+        foreground=True,
+        **fuse_options)
 
 if __name__ == '__main__':
     nfio_main()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Parsing of nf.io paths.
+
+Every file system call used to split its path several times, once for each
+question asked about it: is it under nf-types, which VNF type, which
+instance, which file. The router answers all of them with a single parse and
+keeps the result in a bounded LRU cache, as the same few paths are looked up
+over and over, e.g., by ls -l or a monitoring loop reading stats files.
+
+A path under nf-types is laid out as
+    .../nf-types/<nf_type>/<instance>/<file>
+where <file> may itself contain directories, e.g., stats/eth0/rx_bytes.
+
+Paths under /.nfio name control files, which do not exist in the nf.io root
+and are served by nf.io itself, see control_files.py.
+"""
+
+import collections
+import threading
+
+import middlebox_registry
+
+OP_UNDEFINED = 0xFF
+OP_NF = 0x01
+OP_CONTROL = 0x02
+
+# directory of the control files at the root of the mount
+CONTROL_DIR = '.nfio'
+
+
+class Route(object):
+
+    """
+    The parsed form of a path.
+
+    Attributes:
+        opcode: OP_NF if the path is under nf-types, OP_CONTROL if it is
+            under the control directory, otherwise OP_UNDEFINED.
+        nf_type: type of the VNF, e.g., firewall, or '' if the path is not
+            below a type directory.
+        instance: name of the VNF instance, or '' if the path is not below
+            an instance directory.
+        instance_path: the path up to and including the instance directory,
+            or None.
+        file: path of the file relative to the instance directory, e.g.,
+            machine/vm.ip. '' for the instance directory itself. For control
+            files, the path relative to the control directory.
+        file_name: last component of the path.
+        handler: name prefix of the special file handler of the VNF module,
+            e.g., vm_ip for machine/vm.ip, or None if the file is not special.
+        counter: a tuple (group, counter) if the path names a file in the
+            network counter tree, stats/<group>/<counter>, otherwise None.
+    """
+    __slots__ = ('opcode', 'nf_type', 'instance', 'instance_path', 'file',
+                 'file_name', 'handler', 'counter')
+
+    def __init__(self, opcode, nf_type='', instance='', instance_path=None,
+                 file='', file_name='', handler=None, counter=None):
+        self.opcode = opcode
+        self.nf_type = nf_type
+        self.instance = instance
+        self.instance_path = instance_path
+        self.file = file
+        self.file_name = file_name
+        self.handler = handler
+        self.counter = counter
+
+    def is_instance_dir(self):
+        return self.instance_path is not None and self.file == ''
+
+    def in_stats(self):
+        """
+        Returns True for the stats directory of an instance and everything
+        below it.
+        """
+        return self.file == 'stats' or self.file.startswith('stats/')
+
+
+class PathRouter(object):
+
+    """
+    Parses paths into Route objects and caches the most recently used ones.
+    """
+
+    def __init__(self, max_entries=4096):
+        """
+        Args:
+            max_entries: number of parsed paths to keep.
+        """
+        self._max_entries = max_entries
+        self._routes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def route(self, path):
+        """
+        Returns the Route of a path.
+        """
+        with self._lock:
+            route = self._routes.pop(path, None)
+            if route is not None:
+                self._routes[path] = route
+                return route
+        route = self._parse(path)
+        with self._lock:
+            self._routes[path] = route
+            if len(self._routes) > self._max_entries:
+                self._routes.popitem(last=False)
+        return route
+
+    def clear(self):
+        """
+        Drops all cached routes, e.g., after middlebox modules are reloaded.
+        """
+        with self._lock:
+            self._routes.clear()
+
+    def _handler(self, nf_type, file_name):
+        module = middlebox_registry.get_module(nf_type)
+        if module is None:
+            return None
+        special_files = getattr(module, 'special_files', ())
+        if isinstance(special_files, dict):
+            return special_files.get(file_name)
+        if file_name in special_files:
+            return file_name
+        return None
+
+    def _parse(self, path):
+        tokens = path.split('/')
+        file_name = tokens[-1]
+        if len(tokens) > 1 and tokens[0] == '' and tokens[1] == CONTROL_DIR:
+            return Route(OP_CONTROL, file='/'.join(tokens[2:]),
+                         file_name=file_name)
+        try:
+            index = tokens.index('nf-types')
+        except ValueError:
+            return Route(OP_UNDEFINED, file_name=file_name)
+        if len(tokens) <= index + 2:
+            nf_type = tokens[index + 1] if len(tokens) > index + 1 else ''
+            return Route(OP_NF, nf_type, file_name=file_name)
+        nf_type = tokens[index + 1]
+        file_tokens = tokens[index + 3:]
+        handler = None
+        counter = None
+        if len(file_tokens) == 3 and file_tokens[0] == 'stats':
+            counter = (file_tokens[1], file_tokens[2])
+        elif file_tokens:
+            handler = self._handler(nf_type, file_name)
+        return Route(OP_NF, nf_type, tokens[index + 2],
+                     '/'.join(tokens[:index + 3]), '/'.join(file_tokens),
+                     file_name, handler, counter)
+
+
+_router = PathRouter()
+
+
+def init_router(max_entries=4096):
+    """
+    Replaces the process wide router, e.g., to use another cache size.
+    """
+    global _router
+    _router = PathRouter(max_entries)
+    return _router
+
+
+def route(path):
+    """
+    Returns the Route of a path from the process wide router.
+    """
+    return _router.route(path)
+
+
+def clear():
+    _router.clear()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Reconciliation of the nf.io root with the state of the hypervisor.
+
+When nf.io is mounted it knows the instances under nf-types from their
+directories, but nothing about their VMs/containers: the first read of every
+status file paid for a lookup on the hypervisor, and containers or
+directories left behind, e.g., by a crash, went unnoticed. The reconciler
+lists the guests of every host once, with one call per host and all hosts
+in parallel, records the container ID of every deployed instance and primes
+the hypervisor driver's caches. It also reports drift:
+
+    unreachable host    a host of an instance could not be listed.
+    orphaned container  a container of the user on a host that no instance
+                        is configured on, or for an instance that does
+                        not exist.
+    misplaced instance  an instance whose container was found on another
+                        host than the one it is configured on.
+    no host             an instance without machine/ip.
+    unknown type        an instance directory of a VNF type that has no
+                        middlebox module.
+
+The report of the last pass can be read from /.nfio/drift; writing to it
+runs a new pass.
+"""
+
+import getpass
+import logging
+import threading
+import time
+import Queue
+
+import middlebox_registry
+
+logger = logging.getLogger(__name__)
+
+_reconciler = None
+_reconciler_lock = threading.Lock()
+
+
+def init_reconciler(instances, hypervisor, workers=16, timeout=10.0):
+    """
+    Creates the process wide Reconciler.
+    """
+    global _reconciler
+    with _reconciler_lock:
+        _reconciler = Reconciler(instances, hypervisor, workers, timeout)
+    return _reconciler
+
+
+def get_reconciler():
+    """
+    Returns the process wide Reconciler, or None if it was not created.
+    """
+    return _reconciler
+
+
+class DriftReport(object):
+
+    """
+    The result of a reconciliation pass.
+
+    Attributes:
+        instances: number of instances that were checked.
+        hosts: number of hosts that were listed or tried.
+        elapsed: seconds the pass took.
+        states: dictionary of container state -> number of instances, where
+            instances without a container count as 'not deployed'.
+        unreachable: dictionary of host -> reason it could not be listed.
+        orphaned: list of (host, VNF name, state) of orphaned containers.
+        misplaced: list of (nf_type, name, configured host, actual host).
+        no_host: list of (nf_type, name).
+        unknown_type: list of (nf_type, name).
+    """
+
+    def __init__(self):
+        self.instances = 0
+        self.hosts = 0
+        self.elapsed = 0.0
+        self.states = {}
+        self.unreachable = {}
+        self.orphaned = []
+        self.misplaced = []
+        self.no_host = []
+        self.unknown_type = []
+
+    def drift(self):
+        """
+        Returns the number of problems found.
+        """
+        return (len(self.unreachable) + len(self.orphaned) +
+                len(self.misplaced) + len(self.no_host) +
+                len(self.unknown_type))
+
+    def format(self):
+        lines = ['reconciled %d instances on %d hosts in %.2fs, %d drift' %
+                 (self.instances, self.hosts, self.elapsed, self.drift())]
+        for state, count in sorted(self.states.items()):
+            lines.append('%s %d' % (state, count))
+        for host, reason in sorted(self.unreachable.items()):
+            lines.append('unreachable host ' + host + ': ' + reason)
+        for host, name, state in sorted(self.orphaned):
+            lines.append('orphaned container ' + name + '@' + host + ' (' +
+                         state + ')')
+        for nf_type, name, configured, actual in sorted(self.misplaced):
+            lines.append('misplaced instance ' + nf_type + '/' + name +
+                         ': configured on ' + configured + ', found on ' +
+                         actual)
+        for nf_type, name in sorted(self.no_host):
+            lines.append('no host ' + nf_type + '/' + name)
+        for nf_type, name in sorted(self.unknown_type):
+            lines.append('unknown type ' + nf_type + '/' + name)
+        return '\n'.join(lines) + '\n'
+
+
+class Reconciler(object):
+
+    """
+    Reconciles the instance registry with the guests of the hypervisor.
+    """
+
+    def __init__(self, instances, hypervisor, workers=16, timeout=10.0):
+        """
+        Args:
+            instances: the instance_registry.InstanceRegistry.
+            hypervisor: the hypervisor driver.
+            workers: number of hosts that are listed at the same time.
+            timeout: seconds a pass waits for the listings. Hosts that do
+                not answer in time are reported as unreachable; their
+                listing still primes the caches when it completes.
+        """
+        self._instances = instances
+        self._hypervisor = hypervisor
+        self._workers = max(1, workers)
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self.last_report = None
+
+    def _list_hosts(self, hosts, user):
+        """
+        Lists the guests of every host, in parallel.
+
+        Returns:
+            A tuple (guests, unreachable): dictionaries of host -> {VNF name:
+            (ID, state)} and host -> reason.
+        """
+        work = Queue.Queue()
+        for host in hosts:
+            work.put(host)
+        results = Queue.Queue()
+
+        def list_guests():
+            while True:
+                try:
+                    host = work.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    # None when the driver cannot list guests, nothing to
+                    # reconcile then
+                    results.put((host, self._hypervisor.list_guests(host,
+                                                                    user),
+                                 None))
+                except Exception, ex:
+                    results.put((host, None,
+                                 str(ex) or ex.__class__.__name__))
+
+        for i in range(min(self._workers, len(hosts))):
+            thread = threading.Thread(target=list_guests,
+                                      name='reconcile-%d' % i)
+            thread.daemon = True
+            thread.start()
+        guests = {}
+        unreachable = {}
+        answered = set()
+        deadline = time.time() + self._timeout
+        for i in range(len(hosts)):
+            try:
+                host, listing, failure = results.get(
+                    timeout=max(0.0, deadline - time.time()))
+            except Queue.Empty:
+                break
+            if failure is not None:
+                unreachable[host] = failure
+            elif listing is not None:
+                guests[host] = listing
+            answered.add(host)
+        for host in hosts:
+            if host not in answered:
+                unreachable[host] = 'no answer within %.1fs' % self._timeout
+        return guests, unreachable
+
+    def run(self):
+        """
+        Runs a reconciliation pass.
+
+        Returns:
+            The DriftReport, which is also kept as last_report.
+        """
+        with self._lock:
+            start = time.time()
+            report = DriftReport()
+            instances = self._instances.instances()
+            report.instances = len(instances)
+            by_host = {}
+            for instance in instances:
+                if middlebox_registry.get_module(instance.nf_type) is None:
+                    report.unknown_type.append((instance.nf_type,
+                                                instance.name))
+                if not instance.host:
+                    report.no_host.append((instance.nf_type, instance.name))
+                    continue
+                by_host.setdefault(instance.host, []).append(instance)
+            report.hosts = len(by_host)
+            guests, report.unreachable = self._list_hosts(
+                sorted(by_host), getpass.getuser())
+            # where each VNF name was found
+            found = {}
+            for host, listing in guests.items():
+                for name in listing:
+                    found.setdefault(name, []).append(host)
+            claimed = set()
+            for host, host_instances in by_host.items():
+                listing = guests.get(host)
+                for instance in host_instances:
+                    if listing is None:
+                        continue
+                    guest = listing.get(instance.name)
+                    if guest is None:
+                        state = 'not deployed'
+                        for other in found.get(instance.name, ()):
+                            if other != host:
+                                report.misplaced.append(
+                                    (instance.nf_type, instance.name, host,
+                                     other))
+                                claimed.add((other, instance.name))
+                    else:
+                        self._instances.set_container_id(
+                            instance.nf_type, instance.name, guest[0])
+                        state = guest[1]
+                        claimed.add((host, instance.name))
+                    report.states[state] = report.states.get(state, 0) + 1
+            for host, listing in guests.items():
+                for name, (guest_id, state) in listing.items():
+                    if (host, name) not in claimed:
+                        report.orphaned.append((host, name, state))
+            report.elapsed = time.time() - start
+            self.last_report = report
+        if report.drift():
+            logger.warning(report.format().rstrip('\n'))
+        else:
+            logger.info(report.format().split('\n')[0])
+        return report
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+Background sampling of VNF statistics.
+
+Reading a statistics file such as stats/rx_bytes used to run a command inside
+the VNF from the fuse thread serving the read. The sampler instead polls
+every VNF whose statistics are being read on a fixed interval with a bounded
+pool of worker threads. Reads are answered from the last sample, so the load
+on the VNFs does not depend on the number of readers.
+"""
+
+import logging
+import threading
+import time
+import Queue
+
+import errors
+
+logger = logging.getLogger(__name__)
+
+_sampler = None
+
+
+def init_sampler(hypervisor, interval=5.0, workers=4):
+    """
+    Creates and starts the process wide sampler.
+
+    Args:
+        hypervisor: the hypervisor driver used to query the VNFs.
+        interval: seconds between two samples of the same statistic. An
+            interval of 0 disables background sampling.
+        workers: number of threads querying VNFs concurrently.
+
+    Returns:
+        The StatsSampler object, or None if sampling is disabled.
+    """
+    global _sampler
+    if interval <= 0:
+        return None
+    _sampler = StatsSampler(hypervisor, interval, workers)
+    _sampler.start()
+    return _sampler
+
+
+def get_sampler():
+    """
+    Returns the process wide sampler, or None if it is not running.
+    """
+    return _sampler
+
+
+def read(hypervisor, nf_config, stat, sample_fn):
+    """
+    Returns the value of a statistic of a VNF.
+
+    Args:
+        hypervisor: the hypervisor driver.
+        nf_config: dictionary describing the VNF instance, as built by the
+            middlebox modules.
+        stat: name of the statistic, e.g., rx_bytes.
+        sample_fn: function(hypervisor, nf_config) that queries the VNF for
+            the current value.
+
+    Returns:
+        The last sampled value if the sampler is running, otherwise the
+        value returned by sample_fn.
+    """
+    if _sampler is None:
+        return sample_fn(hypervisor, nf_config)
+    return _sampler.read(nf_config, stat, sample_fn)
+
+
+def watch(nf_config, stat, sample_fn, on_sample):
+    """
+    Schedules a statistic of a VNF for background sampling without sampling
+    it now.
+
+    Args:
+        nf_config: dictionary describing the VNF instance.
+        stat: name of the statistic.
+        sample_fn: function(hypervisor, nf_config) that queries the VNF.
+        on_sample: function(value) called by the sampler with every new
+            value of the statistic.
+
+    Returns:
+        The last sampled value, or None if there is none or the sampler is
+        not running.
+    """
+    if _sampler is None:
+        return None
+    return _sampler.watch(nf_config, stat, sample_fn, on_sample)
+
+
+def sample_time(nf_config, stat):
+    """
+    Returns the time of the last sample of a statistic, or None.
+    """
+    if _sampler is None:
+        return None
+    return _sampler.sample_time(nf_config, stat)
+
+
+class _Target(object):
+    """
+    A statistic of one VNF that is being sampled.
+    """
+    __slots__ = ('nf_config', 'sample_fn', 'on_sample', 'value', 'timestamp',
+                 'last_read', 'in_flight')
+
+    def __init__(self, nf_config, sample_fn):
+        self.nf_config = nf_config
+        self.sample_fn = sample_fn
+        self.on_sample = None
+        self.value = None
+        self.timestamp = None
+        self.last_read = time.time()
+        self.in_flight = False
+
+
+class StatsSampler(object):
+
+    """
+    Samples VNF statistics in the background and caches the results.
+
+    A statistic is sampled from the moment it is first read until it has not
+    been read for idle_intervals intervals, or until its VNF stops running.
+    """
+
+    def __init__(self, hypervisor, interval=5.0, workers=4,
+                 idle_intervals=12):
+        self._hypervisor = hypervisor
+        self._interval = interval
+        self._workers = max(1, workers)
+        self._idle_timeout = interval * idle_intervals
+        # a sample older than this is not served; the sampler is lagging
+        self._max_age = interval * 3
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._stopped = threading.Event()
+
+    def _key(self, nf_config, stat):
+        return (nf_config['host'], nf_config['username'],
+                nf_config['nf_instance_name'], stat)
+
+    def start(self):
+        threads = [threading.Thread(target=self._schedule,
+                                    name='stats-scheduler')]
+        for i in range(self._workers):
+            threads.append(threading.Thread(target=self._work,
+                                            name='stats-worker-%d' % i))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        logger.info('Sampling VNF statistics every %.1f seconds with %d '
+                    'workers' % (self._interval, self._workers))
+
+    def stop(self):
+        self._stopped.set()
+
+    def read(self, nf_config, stat, sample_fn):
+        """
+        Returns the last sampled value of a statistic. The first read of a
+        statistic, or a read of a sample that is too old, samples it
+        synchronously and schedules it for background sampling.
+        """
+        key = self._key(nf_config, stat)
+        now = time.time()
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _Target(nf_config, sample_fn)
+            target.last_read = now
+            if target.timestamp is not None and \
+                    now - target.timestamp <= self._max_age:
+                return target.value
+        value = sample_fn(self._hypervisor, nf_config)
+        self._store(key, target, value)
+        return value
+
+    def watch(self, nf_config, stat, sample_fn, on_sample):
+        """
+        Schedules a statistic for background sampling, as if it had been
+        read, and calls on_sample with every new value.
+
+        Returns:
+            The last sampled value, or None.
+        """
+        key = self._key(nf_config, stat)
+        with self._lock:
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _Target(nf_config, sample_fn)
+            target.last_read = time.time()
+            target.on_sample = on_sample
+            return target.value
+
+    def _store(self, key, target, value):
+        with self._lock:
+            target.value = value
+            target.timestamp = time.time()
+            on_sample = target.on_sample
+        if on_sample is not None:
+            try:
+                on_sample(value)
+            except Exception, ex:
+                logger.warning('Handling a sample of ' + key[3] + ' of ' +
+                               key[2] + '@' + key[0] + ' failed: ' + str(ex))
+
+    def sample_time(self, nf_config, stat):
+        target = self._targets.get(self._key(nf_config, stat))
+        if target is None:
+            return None
+        return target.timestamp
+
+    def _schedule(self):
+        while not self._stopped.wait(self._interval):
+            now = time.time()
+            with self._lock:
+                for key, target in self._targets.items():
+                    if now - target.last_read > self._idle_timeout:
+                        del self._targets[key]
+                    elif not target.in_flight:
+                        target.in_flight = True
+                        self._queue.put((key, target))
+
+    def _drop(self, key):
+        with self._lock:
+            self._targets.pop(key, None)
+
+    def _work(self):
+        while not self._stopped.is_set():
+            key, target = self._queue.get()
+            nf_config = target.nf_config
+            try:
+                if self._hypervisor.guest_status(
+                        nf_config['host'], nf_config['username'],
+                        nf_config['nf_instance_name']) != 'running':
+                    self._drop(key)
+                    continue
+                value = target.sample_fn(self._hypervisor, nf_config)
+            except errors.VNFNotFoundError:
+                self._drop(key)
+            except Exception, ex:
+                logger.warning('Sampling ' + key[3] + ' of ' +
+                               nf_config['nf_instance_name'] + '@' +
+                               nf_config['host'] + ' failed: ' +
+                               ex.__class__.__name__)
+            else:
+                self._store(key, target, value)
+            finally:
+                target.in_flight = False
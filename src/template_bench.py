@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Benchmark of the creation of VNF instance directories.
+
+Creates instances from the default instance template in a temporary
+directory, without mounting nf.io, from a number of threads, and reports
+the throughput and latency percentiles of InstanceTemplate.create() as JSON,
+see fuse_bench.py:
+
+    python template_bench.py --instances 5000 --concurrency 4
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import fuse_bench
+import instance_template
+
+
+def benchmark(instances, concurrency,
+              template=instance_template.DEFAULT_TEMPLATE):
+    """
+    Creates a number of instances in a temporary directory.
+
+    Returns:
+        The report, a dictionary with the settings of the run and, under
+        'create', the summary of the calls to template.create().
+    """
+    report = {
+        'commit': fuse_bench.git_commit(),
+        'instances': instances,
+        'concurrency': concurrency,
+    }
+    work_dir = tempfile.mkdtemp()
+    try:
+        report['create'] = fuse_bench.run_op(
+            lambda i: template.create(os.path.join(work_dir, 'vnf-%d' % i),
+                                      0o755),
+            instances, concurrency)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmarks the creation of VNF instance directories')
+    arg_parser.add_argument(
+        '--instances',
+        help='Number of instances to create',
+        type=int,
+        default=1000)
+    arg_parser.add_argument(
+        '--concurrency',
+        help='Number of threads creating instances at the same time',
+        type=int,
+        default=1)
+    arg_parser.add_argument(
+        '--output',
+        help='File to write the JSON report to, instead of stdout')
+    args = arg_parser.parse_args()
+    report = benchmark(max(1, args.instances), max(1, args.concurrency))
+    text = json.dumps(report, indent=1, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
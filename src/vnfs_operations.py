@@ -13,10 +13,30 @@ import getpass
 import re
 
 import errors
+import instance_registry
+import instance_template
+import lifecycle
+import net_counters
+import path_router
 from hypervisor import hypervisor_factory
 
 logger = logging.getLogger(__name__)
 
+_vnfs_operations = {}
+
+
+def get_vnfs_operations(vnfs_root):
+    """
+    Returns a shared VNFSOperations object for an nf.io root, so that
+    middlebox modules do not create one per system call.
+    """
+    vnfs_ops = _vnfs_operations.get(vnfs_root)
+    if vnfs_ops is None:
+        vnfs_ops = _vnfs_operations.setdefault(vnfs_root,
+                                               VNFSOperations(vnfs_root))
+    return vnfs_ops
+
+
 class VNFSOperations:
 
     """
@@ -24,12 +44,13 @@ class VNFSOperations:
     helper.
     """
 
-    OP_UNDEFINED = 0xFF
-    OP_NF = 0x01
+    OP_UNDEFINED = path_router.OP_UNDEFINED
+    OP_NF = path_router.OP_NF
 
     def __init__(self, vnfs_root):
         self.vnfs_root = vnfs_root
         self._hypervisor = hypervisor_factory.HypervisorFactory.get_hypervisor_instance()
+        self._instances = instance_registry.get_registry(vnfs_root)
 
     def _full_path(self, partial):
         if partial.startswith("/"):
@@ -39,53 +60,19 @@ class VNFSOperations:
 
     def vnfs_create_vnf_instance(self, path, mode):
         """
-        Create the file system structure for a VNF.
+        Create the file system structure for a VNF from the default instance
+        template.
 
         Args:
             path: path of the new VNF instance.
             mode: file creation mode for the new VNF instance directory.
 
         Returns:
-            returns the return code of os.mkdir
+            None, like os.mkdir
         """
         logger.info('Creating file/directory structure in ' + path)
-        full_path = self._full_path(path)
-        result = os.mkdir(full_path)
-        default_file_mode = 0o644
-        os.open(
-            full_path +
-            "/status",
-            os.O_WRONLY | os.O_CREAT,
-            default_file_mode)
-
-        os.mkdir(full_path + "/config", mode)
-        os.open(full_path + "/config/boot.conf", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/config/nf_conf", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.mkdir(full_path + "/machine", mode)
-        os.open(full_path + "/machine/ip", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/machine/vm.vcpu", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/machine/vm.memory", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/machine/vm.image", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/machine/vm.ip", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/action", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/command", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        default_file_mode = 0o444
-        os.mkdir(full_path + "/stats", mode)
-        os.open(full_path + "/stats/rx_bytes", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/stats/tx_bytes", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
-        os.open(full_path + "/stats/pkt_drops", os.O_WRONLY | os.O_CREAT,
-                default_file_mode)
+        result = instance_template.DEFAULT_TEMPLATE.create(
+            self._full_path(path), mode)
         logger.info('Finished creating file/directory structure in ' + path)
         return result
 
@@ -101,10 +88,7 @@ class VNFSOperations:
             If the file is under nf-types subdirectory in the nfio mount, then
             returns OP_NF. Otherwise, returns OP_UNDEFINED.
         """
-        tokens = self._full_path(path).encode('ascii').split('/')
-        if "nf-types" in tokens:
-            return VNFSOperations.OP_NF
-        return VNFSOperations.OP_UNDEFINED
+        return path_router.route(path).opcode
 
     def vnfs_get_nf_type(self, path):
         """
@@ -119,13 +103,7 @@ class VNFSOperations:
             /mnt/vnfsroot/nf-types/firewall/fw-alpha/action then returns
             firewall.
         """
-        tokens = self._full_path(path).encode('ascii').split('/')
-        try:
-            return tokens[tokens.index("nf-types") + 1]
-        except ValueError:
-            return ""
-        except IndexError:
-            return ""
+        return path_router.route(path).nf_type
 
     def vnfs_get_file_name(self, path):
         """
@@ -155,11 +133,26 @@ class VNFSOperations:
             example, if path is /mnt/vnfsmnt/nf-types/firewall/fw-alpha/action
             then returns False.
         """
-        tokens = self._full_path(path).encode('ascii').split('/')
-        if ('nf-types' in tokens) and len(tokens) > tokens.index('nf-types') + \
-                1:
-            return True
-        return False
+        return path_router.route(path).is_instance_dir()
+
+    def vnfs_get_instance(self, nf_path):
+        """
+        Return the in-memory record of a VNF instance.
+
+        Args:
+            nf_path: path of the VNF instance, or of any file in it.
+
+        Returns:
+            The instance_registry.VNFInstance of the instance.
+
+        Raises:
+            IOError if the instance does not exist.
+        """
+        route = path_router.route(nf_path)
+        instance = self._instances.get(route.nf_type, route.instance)
+        if instance is None:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), nf_path)
+        return instance
 
     def vnfs_get_instance_configuration(self, nf_path):
         """
@@ -178,16 +171,12 @@ class VNFSOperations:
                     deployed.
                 image_name: name of the VM/container image for that VNF.
         """
-        nf_instance_name = self.vnfs_get_file_name(nf_path)
-        nf_type = self.vnfs_get_nf_type(nf_path)
-        ip_address = ''
-        logger.debug(nf_path + '/machine/ip')
-        with open(nf_path + '/machine/ip') as ip_fd:
-            ip_address = ip_fd.readline().rstrip('\n')
-        image_name = ''
-        with open(nf_path + '/machine/vm.image') as img_fd:
-            image_name = img_fd.readline().rstrip('\n')
-        logger.info("Instance name: " + nf_instance_name + ", type: " 
+        instance = self.vnfs_get_instance(nf_path)
+        nf_instance_name = instance.name
+        nf_type = instance.nf_type
+        ip_address = instance.host
+        image_name = instance.image
+        logger.info("Instance name: " + nf_instance_name + ", type: "
             + nf_type + ", host-ip: " + ip_address + " VNF image: " + image_name)
         return nf_instance_name, nf_type, ip_address, image_name
 
@@ -206,6 +195,8 @@ class VNFSOperations:
             cont_id  = self._hypervisor.deploy(
                 ip_address, getpass.getuser(), image_name, nf_instance_name)
             logger.debug(cont_id)
+            self._instances.set_container_id(nf_type, nf_instance_name,
+                                             cont_id)
         except errors.VNFDeployError:
             logger.info('Instance: ' + nf_instance_name  + ' deployment failed')
         else:
@@ -272,8 +263,50 @@ class VNFSOperations:
         nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
             nf_path)
         self._hypervisor.destroy(ip_address, getpass.getuser(), nf_instance_name)
+        self._instances.set_container_id(nf_type, nf_instance_name, None)
         logger.info('Instance: ' + nf_instance_name + ' successfully destroyed')
 
+    def vnfs_get_net_counter(self, nf_path, interface, counter):
+        """
+        Reads a network counter of a VNF instance from the last counter
+        snapshot of the VNF.
+
+        Args:
+            nf_path: path of the VNF instance.
+            interface: name of the interface, e.g., eth0, or 'snmp' for the
+                protocol counters of /proc/net/snmp.
+            counter: name of the counter, e.g., rx_bytes or Ip.InDiscards.
+
+        Returns:
+            the value of the counter followed by a newline.
+        """
+        nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
+            nf_path)
+        nf_config = {'nf_image_name': image_name,
+                     'nf_instance_name': nf_instance_name,
+                     'host': ip_address,
+                     'username': getpass.getuser()}
+        return net_counters.read_counter(self._hypervisor, nf_config,
+            interface, counter)
+
+    def vnfs_watch_net_counters(self, nf_path):
+        """
+        Builds the stats/<interface>/ directories of a VNF instance from the
+        last counter snapshot of the VNF, and has the stats sampler keep them
+        up to date.
+
+        Args:
+            nf_path: path of the VNF instance.
+        """
+        nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
+            nf_path)
+        nf_config = {'nf_image_name': image_name,
+                     'nf_instance_name': nf_instance_name,
+                     'host': ip_address,
+                     'username': getpass.getuser()}
+        net_counters.watch_tree(self._hypervisor, nf_config,
+            os.path.join(self._full_path(nf_path), 'stats'))
+
     def vnfs_get_rx_bytes(self, nf_path):
         """
         Reads the number of bytes received by a VNF instance.
@@ -285,13 +318,7 @@ class VNFSOperations:
             returns the number of bytes received by a VNF instance.
         """
         logger.info('Reading rx_bytes at ' + nf_path)
-        nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
-            nf_path)
-        command = "ifconfig eth0 | grep -Eo 'RX bytes:[0-9]+' | cut -d':' -f 2"
-        response = self._hypervisor.execute_in_guest(
-            ip_address,
-            getpass.getuser(), nf_instance_name,
-            command)
+        response = self.vnfs_get_net_counter(nf_path, 'eth0', 'rx_bytes')
         logger.info('Successfully read rx_bytes')
         return response
 
@@ -306,13 +333,7 @@ class VNFSOperations:
             returns the number of bytes sent by a VNF instance.
         """
         logger.info('Reading tx_bytes at ' + nf_path)
-        nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
-            nf_path)
-        command = "ifconfig eth0 | grep -Eo 'TX bytes:[0-9]+' | cut -d':' -f 2"
-        response = self._hypervisor.execute_in_guest(
-            ip_address,
-            getpass.getuser(), nf_instance_name,
-            command)
+        response = self.vnfs_get_net_counter(nf_path, 'eth0', 'tx_bytes')
         logger.info('Successfully read tx_bytes')
         return response
 
@@ -327,13 +348,7 @@ class VNFSOperations:
             returns the number of packets dropped by a VNF instance.
         """
         logger.info('Reading pkt_drops at ' + nf_path)
-        nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
-            nf_path)
-        command = "ifconfig eth0 | grep -Eo 'RX .* dropped:[0-9]+' | cut -d':' -f 4"
-        response = self._hypervisor.execute_in_guest(
-            ip_address,
-            getpass.getuser(), nf_instance_name,
-            command)
+        response = self.vnfs_get_net_counter(nf_path, 'eth0', 'rx_dropped')
         logger.info('Successfully read pkt_drops')
         return response
 
@@ -348,20 +363,39 @@ class VNFSOperations:
         Returns:
             Hypervisor specific status of the VNF. For example, if Docker is
             being used for VNF deployment then Docker specific container status
-            message is returned.
+            message is returned. While a lifecycle action is pending, its
+            transitional state, e.g., deploying, or 'failed: <reason>' if it
+            failed.
         """
         logger.info('Reading status at ' + nf_path)
         nf_instance_name, nf_type, ip_address, image_name = self.vnfs_get_instance_configuration(
             nf_path)
-        response = ''
-        try:
-            response = self._hypervisor.guest_status(ip_address, getpass.getuser(), 
-                nf_instance_name)
-        except errors.VNFNotFoundError:
-            logger.info('Instance: ' + nf_instance_name + ' does not exist')
+        response = lifecycle.status((nf_type, nf_instance_name))
+        if response is None:
+            response = self.vnfs_get_container_status(nf_path)
         logger.info('Successfully read status')
         return response
 
+    def vnfs_get_container_status(self, nf_path):
+        """
+        Get the hypervisor's status of the VM/container of a VNF instance,
+        ignoring pending lifecycle actions.
+
+        Args:
+            nf_path: path of the VNF instance.
+
+        Returns:
+            Hypervisor specific status of the VNF, or '' if the VNF is not
+            deployed.
+        """
+        instance = self.vnfs_get_instance(nf_path)
+        try:
+            return self._hypervisor.guest_status(instance.host,
+                getpass.getuser(), instance.name)
+        except errors.VNFNotFoundError:
+            logger.info('Instance: ' + instance.name + ' does not exist')
+            return ''
+
     def vnfs_get_ip(self, nf_path):
         """
         Get the status of a VNF instance, e.g., the VNF is
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Tests of the activate action of the middlebox modules against the Simulated
+hypervisor driver.
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import errors
+import instance_registry
+from hypervisor.simulated_driver import Simulated
+from middleboxes import firewall, nginx, squid
+
+USER = 'test'
+HOST = '10.0.0.1'
+
+
+class UnreachableOnStart(Simulated):
+
+    """
+    A Simulated driver whose host stops answering between deploy and start,
+    like a docker host whose circuit breaker opens.
+    """
+
+    def start(self, host, user, vnf_name, is_privileged=True):
+        raise errors.HypervisorConnectionError
+
+
+class ActivateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        instance_registry.get_registry(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def nf_config(self, module):
+        return {'nf_type': module.__name__.split('.')[-1],
+                'nf_instance_name': 'vnf-1',
+                'nf_image_name': 'nfio/test',
+                'host': HOST,
+                'username': USER}
+
+    def assert_rolled_back(self, driver, error=errors.VNFDeployError):
+        for module in (firewall, nginx, squid):
+            self.assertRaises(error, module.run_action, driver,
+                              self.nf_config(module), 'activate')
+            self.assertEqual(driver.list_guests(HOST, USER), {})
+
+    def test_failed_start_destroys_the_container(self):
+        self.assert_rolled_back(Simulated(call_failure_rate={'start': 1.0}))
+
+    def test_unreachable_host_on_start_destroys_the_container(self):
+        self.assert_rolled_back(UnreachableOnStart())
+
+    def test_failed_rollback_is_reported(self):
+        for module in (firewall, nginx, squid):
+            driver = UnreachableOnStart(call_failure_rate={'destroy': 1.0})
+            self.assertRaises(errors.VNFDeployErrorWithInconsistentState,
+                              module.run_action, driver,
+                              self.nf_config(module), 'activate')
+            self.assertEqual(len(driver.list_guests(HOST, USER)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
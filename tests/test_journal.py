@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""
+Tests of the lifecycle journal, see src/journal.py.
+
+    python -m unittest discover tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import journal
+
+
+def write_records(path, records, tail=''):
+    with open(path, 'w') as journal_file:
+        for record in records:
+            journal_file.write(json.dumps(record) + '\n')
+        journal_file.write(tail)
+
+
+def intent(seq, nf_type, name, action, host='10.0.0.1'):
+    return {'op': 'intent', 'seq': seq, 'type': nf_type, 'name': name,
+            'host': host, 'action': action}
+
+
+def complete(seq, intent_seq, failure=None):
+    return {'op': 'complete', 'seq': seq, 'intent': intent_seq,
+            'failure': failure}
+
+
+class FakeBatchFile(object):
+
+    """
+    Stands in for control_files.BatchFile: records the operations it is
+    asked to run and reports every one of them with result.
+    """
+    runs = []
+    result = 'ok'
+
+    def __init__(self, operations):
+        self.operations = operations
+
+    def run(self, operations):
+        FakeBatchFile.runs.append([(operation.op, operation.nf_type,
+                                    operation.name)
+                                   for operation in operations])
+        for operation in operations:
+            operation.result = FakeBatchFile.result
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, journal.JOURNAL_NAME)
+        self.batch_file = journal.control_files.BatchFile
+        journal.control_files.BatchFile = FakeBatchFile
+        FakeBatchFile.runs = []
+        FakeBatchFile.result = 'ok'
+        self.fsync = os.fsync
+        # size of the journal that is on disk, what survives a crash
+        self.durable_size = 0
+
+    def tearDown(self):
+        journal.control_files.BatchFile = self.batch_file
+        journal.os.fsync = self.fsync
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def slow_fsync(self, fd):
+        time.sleep(0.2)
+        self.fsync(fd)
+        self.durable_size = os.fstat(fd).st_size
+
+    def crash(self):
+        """
+        Returns an nf.io root with what a crash would leave of the journal.
+        """
+        crashed_root = os.path.join(self.root, 'crashed')
+        os.mkdir(crashed_root)
+        with open(self.path) as journal_file:
+            durable = journal_file.read(self.durable_size)
+        with open(os.path.join(crashed_root, journal.JOURNAL_NAME),
+                  'w') as crashed_file:
+            crashed_file.write(durable)
+        return crashed_root
+
+    def test_scan_skips_torn_last_record(self):
+        write_records(self.path,
+                      [intent(1, 'firewall', 'fw1', 'activate'),
+                       complete(2, 1),
+                       intent(3, 'firewall', 'fw2', 'stop')],
+                      tail='{"op": "intent", "seq": 4, "type": "fire')
+        incomplete, last_seq = journal._scan(self.path)
+        self.assertEqual([record['seq'] for record in incomplete], [3])
+        self.assertEqual(last_seq, 3)
+
+    def test_record_after_torn_record_is_read(self):
+        write_records(self.path, [intent(1, 'firewall', 'fw1', 'start')],
+                      tail='{"op": "complete", "se')
+        nfio_journal, incomplete = journal.open_journal(self.root)
+        self.assertEqual([record['seq'] for record in incomplete], [1])
+        seq = nfio_journal.intent(('firewall', 'fw2'), '10.0.0.1', 'stop')
+        self.assertEqual(seq, 2)
+        self.assertEqual([record['seq'] for record in
+                          journal.read_incomplete(self.path)], [1, 2])
+
+    def test_scan_of_missing_journal(self):
+        self.assertEqual(journal._scan(self.path), ([], 0))
+
+    def test_intent_in_flight_is_not_truncated(self):
+        nfio_journal = journal.Journal(self.path, compact_size=0)
+        seq = nfio_journal.intent(('firewall', 'fw1'), '10.0.0.1',
+                                  'activate')
+        self.assertEqual([record['seq'] for record in
+                          journal.read_incomplete(self.path)], [seq])
+        nfio_journal.complete(seq)
+        nfio_journal.sync()
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_intent_queued_during_a_write_is_not_truncated(self):
+        nfio_journal = journal.Journal(self.path, compact_size=0)
+        first = nfio_journal.intent(('firewall', 'fw1'), '10.0.0.1',
+                                    'stop')
+        # hold the writer in the fsync of the complete record of the first
+        # intent, which leaves nothing in flight, until a second intent has
+        # been queued
+        in_fsync = threading.Event()
+        resume = threading.Event()
+        fsync = os.fsync
+
+        def blocking_fsync(fd):
+            if not resume.is_set():
+                in_fsync.set()
+                resume.wait(10)
+            fsync(fd)
+        journal.os.fsync = blocking_fsync
+        try:
+            nfio_journal.complete(first)
+            self.assertTrue(in_fsync.wait(10))
+            second = []
+            thread = threading.Thread(target=lambda: second.append(
+                nfio_journal.intent(('firewall', 'fw2'), '10.0.0.1',
+                                    'start')))
+            thread.start()
+            while not nfio_journal._queued:
+                thread.join(0.01)
+            resume.set()
+            thread.join(10)
+        finally:
+            journal.os.fsync = fsync
+        self.assertEqual([record['seq'] for record in
+                          journal.read_incomplete(self.path)], second)
+
+    def test_concurrent_intents_are_durable(self):
+        nfio_journal = journal.Journal(self.path, compact_size=0)
+        lost = []
+
+        def work(i):
+            for j in range(20):
+                seq = nfio_journal.intent(('firewall', 'fw%d' % i),
+                                          '10.0.0.1', 'start')
+                if seq not in [record['seq'] for record in
+                               journal.read_incomplete(self.path)]:
+                    lost.append(seq)
+                nfio_journal.complete(seq)
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        nfio_journal.sync()
+        self.assertEqual(lost, [])
+        self.assertEqual(journal.read_incomplete(self.path), [])
+
+    def test_recover_rolls_back_interrupted_activate(self):
+        write_records(self.path,
+                      [intent(1, 'firewall', 'fw1', 'activate'),
+                       intent(2, 'firewall', 'fw2', 'stop'),
+                       complete(3, 2),
+                       intent(4, 'firewall', 'fw3', 'start')])
+        nfio_journal, incomplete = journal.open_journal(self.root)
+        results = journal.recover(None, nfio_journal, incomplete)
+        self.assertEqual(FakeBatchFile.runs,
+                         [[('destroy', 'firewall', 'fw1'),
+                           ('start', 'firewall', 'fw3')]])
+        self.assertEqual([(record['seq'], action, result)
+                          for record, action, result in results],
+                         [(1, 'destroy', 'ok'), (4, 'start', 'ok')])
+        self.assertEqual(journal.read_incomplete(self.path), [])
+
+    def test_completed_activate_is_not_rolled_back(self):
+        journal.os.fsync = self.slow_fsync
+        nfio_journal = journal.Journal(self.path)
+        seq = nfio_journal.intent(('firewall', 'fw1'), '10.0.0.1',
+                                  'activate')
+        # nf.io crashes right after the activate has completed
+        nfio_journal.complete(seq)
+        crashed_journal, incomplete = journal.open_journal(self.crash())
+        self.assertEqual(incomplete, [])
+        self.assertEqual(journal.recover(None, crashed_journal, incomplete),
+                         [])
+        self.assertEqual(FakeBatchFile.runs, [])
+
+    def test_failed_recovery_stays_in_journal(self):
+        write_records(self.path,
+                      [intent(1, 'firewall', 'fw1', 'activate'),
+                       intent(2, 'firewall', 'fw2', 'start')])
+        nfio_journal, incomplete = journal.open_journal(self.root,
+                                                        compact_size=0)
+        FakeBatchFile.result = 'failed: Host unreachable'
+        journal.recover(None, nfio_journal, incomplete)
+        # a later action must not truncate the records away
+        FakeBatchFile.result = 'ok'
+        seq = nfio_journal.intent(('firewall', 'fw3'), '10.0.0.1', 'stop')
+        nfio_journal.complete(seq)
+        nfio_journal.sync()
+        self.assertEqual([record['seq'] for record in
+                          journal.read_incomplete(self.path)], [1, 2])
+        incomplete = journal.read_incomplete(self.path)
+        journal.recover(None, nfio_journal, incomplete)
+        nfio_journal.sync()
+        self.assertEqual(journal.read_incomplete(self.path), [])
+        self.assertEqual(FakeBatchFile.runs[-1],
+                         [('destroy', 'firewall', 'fw1'),
+                          ('start', 'firewall', 'fw2')])
+
+    def test_recover_without_incomplete_actions(self):
+        nfio_journal, incomplete = journal.open_journal(self.root)
+        self.assertEqual(journal.recover(None, nfio_journal, incomplete), [])
+
+
+if __name__ == '__main__':
+    unittest.main()